@@ -0,0 +1,274 @@
+"""Maintenance commands for the gallery.
+
+    python -m app.cli export images.ndjson
+    python -m app.cli import images.ndjson --mode upsert
+    python -m app.cli reconcile [--fix] [--backend local]
+    python -m app.cli phash
+
+Every command streams: documents are read and written in fixed-size batches and
+storage is paged through, so memory use does not depend on collection size.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import IO, List
+
+import httpx
+from bson import json_util
+from bson.json_util import JSONOptions, JSONMode
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.config import get_settings
+from app.database import database
+from app.services import phash as perceptual_hash
+from app.services.changes import forget_deletions, record_deletions
+from app.services.storage import (
+    CloudinaryStorage,
+    StorageBackend,
+    delete_unreferenced,
+    get_storage,
+    storage_filter,
+)
+
+logger = logging.getLogger(__name__)
+
+# Canonical mode keeps ObjectId and datetime types intact across a round trip
+JSON_OPTIONS = JSONOptions(json_mode=JSONMode.CANONICAL, tz_aware=False)
+DUPLICATE_KEY = 11000
+
+
+def _open(path: str, mode: str) -> IO[str]:
+    if path == "-":
+        return sys.stdout if "w" in mode else sys.stdin
+    return open(path, mode, encoding="utf-8")
+
+
+async def export_images(path: str, batch_size: int) -> int:
+    count = 0
+    out = _open(path, "w")
+    try:
+        async for doc in database.db.images.find({}, batch_size=batch_size):
+            out.write(json_util.dumps(doc, json_options=JSON_OPTIONS))
+            out.write("\n")
+            count += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    logger.info(f"Exported {count} images to {path}")
+    return count
+
+
+async def _write_batch(batch: List[dict], mode: str) -> int:
+    # Imported documents are changes as far as the change feed is concerned
+    now = datetime.utcnow()
+    for doc in batch:
+        doc["modified_at"] = now
+    await forget_deletions([doc["_id"] for doc in batch])
+    if mode == "upsert":
+        result = await database.db.images.bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in batch],
+            ordered=False
+        )
+        return result.upserted_count + result.modified_count
+    try:
+        result = await database.db.images.insert_many(batch, ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as bwe:
+        # Documents that already exist are skipped; anything else is a real failure
+        errors = bwe.details.get("writeErrors", [])
+        if any(error["code"] != DUPLICATE_KEY for error in errors):
+            raise
+        return bwe.details.get("nInserted", 0)
+
+
+async def import_images(path: str, batch_size: int, mode: str) -> int:
+    written = 0
+    batch: List[dict] = []
+    source = _open(path, "r")
+    try:
+        for line in source:
+            if not line.strip():
+                continue
+            batch.append(json_util.loads(line, json_options=JSON_OPTIONS))
+            if len(batch) >= batch_size:
+                written += await _write_batch(batch, mode)
+                batch = []
+        if batch:
+            written += await _write_batch(batch, mode)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    logger.info(f"Imported {written} images from {path} ({mode})")
+    return written
+
+
+async def find_orphans(storage: StorageBackend, min_age: timedelta, fix: bool) -> int:
+    """Stored files that no image document points to"""
+    cutoff = datetime.now(timezone.utc) - min_age
+    orphans = 0
+    if fix:
+        recovered = storage.recover(min_age.total_seconds())
+        if recovered:
+            logger.info(f"Put back {recovered} files an interrupted delete left behind")
+    for objects in storage.iter_objects():
+        # Skip files young enough to belong to an upload that is still being saved
+        keys = [obj["key"] for obj in objects if obj["created_at"] < cutoff]
+        if not keys:
+            continue
+        referenced = {
+            doc["cloudinary_id"] async for doc in database.db.images.find(
+                {"cloudinary_id": {"$in": keys}}, {"cloudinary_id": 1}
+            )
+        }
+        missing = [key for key in keys if key not in referenced]
+        for key in missing:
+            print(f"orphan\t{key}")
+        if fix and missing:
+            # Re-checked at delete time: an upload may have reused a file since it was listed
+            removed = await delete_unreferenced(storage, missing)
+            logger.info(f"Deleted {len(removed)} orphaned files from {storage.name} storage")
+        orphans += len(missing)
+    return orphans
+
+
+async def _check_dangling(storage: StorageBackend, batch: List[dict], fix: bool) -> int:
+    existing = storage.existing(doc["cloudinary_id"] for doc in batch)
+    dangling = [doc for doc in batch if doc["cloudinary_id"] not in existing]
+    for doc in dangling:
+        print(f"dangling\t{doc['_id']}\t{doc['cloudinary_id']}")
+    if fix and dangling:
+        result = await database.db.images.delete_many({"_id": {"$in": [doc["_id"] for doc in dangling]}})
+        await record_deletions(dangling)
+        logger.info(f"Deleted {result.deleted_count} dangling image documents")
+    return len(dangling)
+
+
+async def find_dangling(storage: StorageBackend, fix: bool, batch_size: int = 100) -> int:
+    """Image documents kept by this backend whose file no longer exists"""
+    dangling = 0
+    batch: List[dict] = []
+    query = storage_filter(storage.name)
+    projection = {"cloudinary_id": 1, "category_id": 1, "year": 1}
+    async for doc in database.db.images.find(query, projection, batch_size=batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            dangling += await _check_dangling(storage, batch, fix)
+            batch = []
+    if batch:
+        dangling += await _check_dangling(storage, batch, fix)
+    return dangling
+
+
+async def reconcile(storage: StorageBackend, min_age: timedelta, fix: bool) -> None:
+    orphans = await find_orphans(storage, min_age, fix)
+    dangling = await find_dangling(storage, fix)
+    action = "fixed" if fix else "found"
+    logger.info(f"Reconciliation of {storage.name} storage {action}: "
+                f"{orphans} orphaned files, {dangling} dangling documents")
+
+
+async def _hash_batch(batch: List[dict], client: httpx.AsyncClient) -> int:
+    async def hash_one(doc: dict):
+        try:
+            storage = get_storage(doc.get("storage") or "cloudinary")
+            content = await storage.read(doc["cloudinary_id"], doc["url"], client)
+        except Exception as e:
+            logger.warning(f"Could not read image {doc['_id']}: {str(e)}")
+            return None
+        return await perceptual_hash.phash_of(content)
+
+    hashes = await asyncio.gather(*(hash_one(doc) for doc in batch))
+    # Not a modified_at change: the hash isn't part of what the change feed reports
+    requests = [
+        UpdateOne({"_id": doc["_id"]}, {"$set": {"phash": value}})
+        for doc, value in zip(batch, hashes) if value is not None
+    ]
+    if requests:
+        await database.db.images.bulk_write(requests, ordered=False)
+    return len(requests)
+
+
+async def backfill_phashes(concurrency: int) -> int:
+    """Compute perceptual hashes for images stored before hashing existed"""
+    if not perceptual_hash.available():
+        raise SystemExit("Perceptual hashes need numpy and Pillow: pip install numpy Pillow")
+    hashed = failed = 0
+    batch: List[dict] = []
+    projection = {"cloudinary_id": 1, "storage": 1, "url": 1}
+    async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=5.0), follow_redirects=True) as client:
+        async for doc in database.db.images.find({"phash": None}, projection, batch_size=100):
+            batch.append(doc)
+            if len(batch) >= concurrency:
+                done = await _hash_batch(batch, client)
+                hashed, failed = hashed + done, failed + len(batch) - done
+                batch = []
+        if batch:
+            done = await _hash_batch(batch, client)
+            hashed, failed = hashed + done, failed + len(batch) - done
+    logger.info(f"Hashed {hashed} images ({failed} could not be read or decoded)")
+    return hashed
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Focus Gallery maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_cmd = commands.add_parser("export", help="Stream the images collection to NDJSON")
+    export_cmd.add_argument("path", help="Output file, or - for stdout")
+    export_cmd.add_argument("--batch-size", type=int, default=1000)
+
+    import_cmd = commands.add_parser("import", help="Load images from NDJSON")
+    import_cmd.add_argument("path", help="Input file, or - for stdin")
+    import_cmd.add_argument("--batch-size", type=int, default=1000)
+    import_cmd.add_argument(
+        "--mode", choices=("insert", "upsert"), default="insert",
+        help="insert skips documents that already exist, upsert replaces them"
+    )
+
+    reconcile_cmd = commands.add_parser("reconcile", help="Compare MongoDB with file storage")
+    reconcile_cmd.add_argument(
+        "--backend", choices=("cloudinary", "local"), default=get_settings().storage_backend,
+        help="Storage backend to check (defaults to STORAGE_BACKEND)"
+    )
+    reconcile_cmd.add_argument("--folder", default="focus_gallery", help="Cloudinary folder to check")
+    reconcile_cmd.add_argument(
+        "--min-age", type=int, default=60,
+        help="Ignore files stored within this many minutes"
+    )
+    reconcile_cmd.add_argument("--fix", action="store_true", help="Delete orphans and dangling records")
+
+    phash_cmd = commands.add_parser("phash", help="Add perceptual hashes to images that have none")
+    phash_cmd.add_argument("--concurrency", type=int, default=8, help="Images fetched at once")
+    return parser
+
+
+async def run(args: argparse.Namespace) -> None:
+    await database.connect()
+    try:
+        if args.command == "export":
+            await export_images(args.path, args.batch_size)
+        elif args.command == "import":
+            await import_images(args.path, args.batch_size, args.mode)
+        elif args.command == "reconcile":
+            storage = CloudinaryStorage(args.folder) if args.backend == "cloudinary" else get_storage(args.backend)
+            await reconcile(storage, timedelta(minutes=args.min_age), args.fix)
+        elif args.command == "phash":
+            await backfill_phashes(args.concurrency)
+    finally:
+        await database.close()
+
+
+def main() -> None:
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO,
+        stream=sys.stderr
+    )
+    asyncio.run(run(build_parser().parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings
 from pydantic import Field, field_validator
 from typing import List, Optional
+from functools import lru_cache
 import os
 
 class Settings(BaseSettings):
@@ -15,12 +16,88 @@ class Settings(BaseSettings):
     ssl_certfile: Optional[str] = Field(None, description="SSL certificate file path")
     
     bot_token: str = Field(..., env="BOT_TOKEN")
+    # Remote uploads resolve Telegram file IDs here
+    telegram_api_url: str = Field("https://api.telegram.org", env="TELEGRAM_API_URL")
     bot_admin_ids: List[int] = Field(default_factory=list, env="BOT_ADMIN_IDS")
     
     mongodb_url: str = Field(..., env="MONGODB_URL")
-    cloudinary_cloud_name: str = Field(..., env="CLOUDINARY_CLOUD_NAME")
-    cloudinary_api_key: str = Field(..., env="CLOUDINARY_API_KEY")
-    cloudinary_api_secret: str = Field(..., env="CLOUDINARY_API_SECRET")
+    cloudinary_cloud_name: Optional[str] = Field(None, env="CLOUDINARY_CLOUD_NAME")
+    cloudinary_api_key: Optional[str] = Field(None, env="CLOUDINARY_API_KEY")
+    cloudinary_api_secret: Optional[str] = Field(None, env="CLOUDINARY_API_SECRET")
+    
+    # Where new uploads go: "cloudinary", or "local" to keep them under local_storage_dir and
+    # serve them from /media on public_base_url, which needs no external service at all
+    storage_backend: str = Field("cloudinary", env="STORAGE_BACKEND")
+    local_storage_dir: str = Field("media", env="LOCAL_STORAGE_DIR")
+    public_base_url: str = Field("http://localhost:8000", env="PUBLIC_BASE_URL")
+    media_cache_max_age: int = 31536000
+    
+    # "background" serves requests immediately and builds indexes/seed data in a task,
+    # "eager" finishes that work before the app accepts traffic
+    startup_mode: str = Field("background", env="STARTUP_MODE")
+    
+    # Admission control (requests authenticated with BOT_BACKEND_API_KEY skip the token buckets)
+    rate_limit_burst: int = 40
+    rate_limit_per_second: float = 10.0
+    images_rate_limit_burst: int = 20
+    images_rate_limit_per_second: float = 4.0
+    max_concurrent_uploads: int = 4
+    max_in_flight_requests: int = 64
+    # Proxies in front of the app that append to X-Forwarded-For (Render has one); 0 ignores the header
+    trusted_proxy_hops: int = 1
+    
+    # Bulk operations are leased to one worker, which renews the lease before every chunk;
+    # an operation whose lease lapses is resumed by any worker
+    bulk_lease: int = 120
+    
+    # Read caches: long TTL while change streams invalidate them, short TTL otherwise
+    api_cache_ttl: int = 3600
+    api_cache_fallback_ttl: int = 30
+    
+    # Upload Idempotency-Key records: kept for a day, repeats wait up to idempotency_wait seconds
+    # for the original, and a key left pending longer than idempotency_lease is taken over
+    idempotency_ttl: int = 86400
+    idempotency_wait: float = 30.0
+    idempotency_lease: int = 120
+    
+    # On-demand profiling: admins send X-Profile: 1 with the API key; profile_sample_rate
+    # additionally profiles that share of all requests. Profiles live in a bounded ring buffer.
+    profile_sample_rate: float = 0.0
+    profile_interval: float = 0.005
+    profile_dir: str = "profiles/api"
+    profile_max_files: int = 50
+    
+    # Tracing: spans go to a JSONL file or are POSTed to a collector URL. Requests from the
+    # bot follow its sampling decision; trace_sample_rate covers requests that start a trace.
+    trace_export: Optional[str] = Field(None, env="TRACE_EXPORT")
+    trace_sample_rate: float = 0.0
+    
+    # View counters are summed in memory and written every view_flush_interval seconds
+    view_flush_interval: float = 10.0
+    view_max_pending: int = 50000
+    
+    # ZIP archives: originals fetched ahead per archive, archives built at once, and the
+    # per-client token bucket for GET /api/v1/images/archive
+    archive_concurrency: int = 4
+    max_concurrent_archives: int = 2
+    archive_rate_limit_burst: int = 3
+    archive_rate_limit_per_second: float = 0.05
+    
+    # Change feed (GET /api/v1/images/changes): tombstones of deleted images are kept for
+    # change_tombstone_ttl seconds, and tokens older than that must resync from scratch.
+    # Changes younger than change_feed_settle seconds wait for the next call.
+    change_feed_batch_size: int = 500
+    change_feed_max_limit: int = 50000
+    change_tombstone_ttl: int = 30 * 86400
+    change_feed_settle: float = 2.0
+    
+    # Perceptual hashes (needs numpy and Pillow): an upload within duplicate_max_distance bits
+    # of an image in its category is refused with 409 unless allow_duplicate is set, and
+    # /similar returns images within similar_max_distance bits. Without change streams the
+    # in-memory hash index is rebuilt every similarity_refresh_interval seconds.
+    duplicate_max_distance: int = 5
+    similar_max_distance: int = 14
+    similarity_refresh_interval: int = 600
     
     class Config:
         env_file = ".env"
@@ -39,5 +116,13 @@ class Settings(BaseSettings):
             return [int(x.strip()) for x in v.split(",")]
         return [int(v)]
 
+    @field_validator('storage_backend')
+    @classmethod
+    def check_storage_backend(cls, v):
+        if v not in ("cloudinary", "local"):
+            raise ValueError("STORAGE_BACKEND must be 'cloudinary' or 'local'")
+        return v
+
+@lru_cache()
 def get_settings() -> Settings:
-    return Settings()
\ No newline at end of file
+    return Settings()
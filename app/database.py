@@ -1,6 +1,9 @@
+import asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
 from app.config import get_settings
+from app.services.tracing import MongoCommandTracer, tracer
 import logging
+from pymongo import IndexModel, UpdateOne
 from pymongo.errors import ConfigurationError
 
 logger = logging.getLogger(__name__)
@@ -10,25 +13,29 @@ class Database:
     def __init__(self):
         self.client = None
         self.db = None
+        self._prepare_task = None
 
     async def connect(self):
         try:
-            self.client = AsyncIOMotorClient(settings.mongodb_url)
-            
+            # The client connects lazily, so this does not wait for the server
+            self.client = AsyncIOMotorClient(settings.mongodb_url, event_listeners=[MongoCommandTracer(tracer)])
+
             # Extract database name from URL or use default
             if '/' in settings.mongodb_url:
                 db_name = settings.mongodb_url.split('/')[-1].split('?')[0]
             else:
                 db_name = "focus_gallery"
-                
+
             if not db_name:
                 db_name = "focus_gallery"
-                
+
             self.db = self.client[db_name]
             logger.info(f"Connected to MongoDB database: {db_name}")
-            
-            await self._ensure_indexes()
-            await self._seed_initial_data()
+
+            if settings.startup_mode == "eager":
+                await self.prepare()
+            else:
+                self._prepare_task = asyncio.create_task(self.prepare())
         except ConfigurationError as ce:
             logger.error(f"Configuration error: {str(ce)}")
             raise
@@ -36,9 +43,20 @@ class Database:
             logger.error(f"Failed to connect to MongoDB: {str(e)}")
             raise
 
-    # ... rest of the class remains the same ...
+    @property
+    def ready(self) -> bool:
+        """True once indexes and seed data are in place"""
+        return self._prepare_task is None or self._prepare_task.done()
+
+    async def prepare(self):
+        await self._ensure_indexes()
+        await self._enable_pre_images()
+        await self._seed_initial_data()
+        await self._backfill_modified_at()
 
     async def close(self):
+        if self._prepare_task and not self._prepare_task.done():
+            self._prepare_task.cancel()
         if self.client:
             self.client.close()
             logger.info("MongoDB connection closed")
@@ -46,13 +64,51 @@ class Database:
     async def _ensure_indexes(self):
         try:
             # Create indexes for faster queries
-            await self.db.categories.create_index("id", unique=True)
-            await self.db.images.create_index([("category_id", 1), ("year", 1)])
-            await self.db.images.create_index("uploaded_at")
+            await self.db.categories.create_indexes([IndexModel("id", unique=True)])
+            await self.db.images.create_indexes([
+                IndexModel([("category_id", 1), ("year", 1)]),
+                IndexModel("uploaded_at"),
+                IndexModel("cloudinary_id"),
+                IndexModel([("modified_at", 1), ("_id", 1)]),
+            ])
+            await self.db.image_tombstones.create_indexes([
+                IndexModel([("modified_at", 1), ("_id", 1)]),
+                IndexModel("modified_at", expireAfterSeconds=settings.change_tombstone_ttl),
+            ])
+            await self.db.bulk_operations.create_indexes([IndexModel([("status", 1), ("lease_until", 1)])])
+            await self.db.bulk_operation_items.create_indexes([
+                IndexModel([("op_id", 1), ("done", 1)]),
+            ])
+            await self.db.image_views.create_indexes([
+                IndexModel([("category_id", 1), ("year", 1), ("views", -1)]),
+                IndexModel([("views", -1)]),
+            ])
+            await self.db.subscriptions.create_indexes([
+                IndexModel([("category_id", 1), ("chat_id", 1)], unique=True),
+                IndexModel("chat_id"),
+            ])
+            await self.db.broadcasts.create_indexes([
+                IndexModel([("status", 1), ("created_at", 1)]),
+                # At most one pending broadcast per category/year for uploads to fold into
+                IndexModel(
+                    [("category_id", 1), ("year", 1)], unique=True,
+                    partialFilterExpression={"status": "pending"}
+                ),
+            ])
+            await self.db.idempotency_keys.create_indexes([
+                IndexModel("created_at", expireAfterSeconds=settings.idempotency_ttl),
+            ])
             logger.info("Database indexes created")
         except Exception as e:
             logger.error(f"Failed to create indexes: {str(e)}")
 
+    async def _enable_pre_images(self):
+        # Lets change streams report the category/year a deleted or moved image had (MongoDB 6+)
+        try:
+            await self.db.command("collMod", "images", changeStreamPreAndPostImages={"enabled": True})
+        except Exception as e:
+            logger.warning(f"Change stream pre-images unavailable: {str(e)}")
+
     async def _seed_initial_data(self):
         try:
             # Seed initial categories if they don't exist
@@ -63,16 +119,29 @@ class Database:
                 {"id": "easter", "name": "Easter"},
                 {"id": "manuscript", "name": "Manuscript"}
             ]
-            
-            for category in initial_categories:
-                await self.db.categories.update_one(
-                    {"id": category["id"]},
-                    {"$setOnInsert": category},
-                    upsert=True
-                )
+
+            await self.db.categories.bulk_write(
+                [
+                    UpdateOne({"id": category["id"]}, {"$setOnInsert": category}, upsert=True)
+                    for category in initial_categories
+                ],
+                ordered=False
+            )
             logger.info("Seeded initial categories")
         except Exception as e:
             logger.error(f"Failed to seed initial data: {str(e)}")
 
+    async def _backfill_modified_at(self):
+        # Images written before the change feed existed enter it as inserts at their upload time
+        try:
+            result = await self.db.images.update_many(
+                {"modified_at": {"$exists": False}},
+                [{"$set": {"modified_at": {"$ifNull": ["$uploaded_at", "$$NOW"]}}}]
+            )
+            if result.modified_count:
+                logger.info(f"Backfilled modified_at on {result.modified_count} images")
+        except Exception as e:
+            logger.error(f"Failed to backfill modified_at: {str(e)}")
+
 # Database instance to be imported
-database = Database()
\ No newline at end of file
+database = Database()
@@ -1,8 +1,16 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.database import database
-from app.routers import categories, images, upload
-from app.services.cloudinary import configure_cloudinary
+from app.middleware.profiling import ProfilingMiddleware
+from app.middleware.rate_limit import RateLimitMiddleware, RouteLimit
+from app.middleware.tracing import TracingMiddleware
+from app.routers import bulk, categories, events, images, media, profiles, subscriptions, upload, views
+from app.services.bulk import start_resuming, stop_operations
+from app.services.change_watcher import change_watcher
+from app.services.profiler import profiler
+from app.services.similarity import similarity_index
+from app.services.tracing import tracer
+from app.services.views import view_counter
 from app.config import get_settings
 import logging
 
@@ -18,6 +26,45 @@ app = FastAPI(
     redirect_slashes=False
 )
 
+# Innermost, so a profile covers the request's own work rather than time spent being rejected
+profiler.interval = settings.profile_interval
+app.add_middleware(
+    ProfilingMiddleware,
+    api_key=settings.BOT_BACKEND_API_KEY,
+    store=profiles.profile_store,
+    sample_rate=settings.profile_sample_rate,
+    exclude_prefixes=("/api/v1/profiles", "/api/v1/events"),
+)
+
+# Add admission control before CORS so rejected responses still get CORS headers
+app.add_middleware(
+    RateLimitMiddleware,
+    api_key=settings.BOT_BACKEND_API_KEY,
+    capacity=settings.rate_limit_burst,
+    rate=settings.rate_limit_per_second,
+    route_limits=[
+        RouteLimit(
+            name="images",
+            method="GET",
+            paths=("/api/v1/images", "/api/v1/images/"),
+            capacity=settings.images_rate_limit_burst,
+            rate=settings.images_rate_limit_per_second,
+        ),
+        RouteLimit(
+            name="archive",
+            method="GET",
+            paths=("/api/v1/images/archive",),
+            capacity=settings.archive_rate_limit_burst,
+            rate=settings.archive_rate_limit_per_second,
+        ),
+    ],
+    upload_paths=("/api/v1/images/", "/api/v1/images/remote"),
+    max_concurrent_uploads=settings.max_concurrent_uploads,
+    max_in_flight=settings.max_in_flight_requests,
+    trusted_proxy_hops=settings.trusted_proxy_hops,
+    exempt_paths=("/health",),
+)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -27,18 +74,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost: a request's trace covers everything the API does with it
+tracer.configure("api", settings.trace_export, settings.trace_sample_rate)
+app.add_middleware(TracingMiddleware)
+
 # Include routers
 app.include_router(categories.router, prefix="/api/v1/categories", tags=["categories"])
 app.include_router(images.router, prefix="/api/v1/images", tags=["images"])
 app.include_router(upload.router, prefix="/api/v1/images", tags=["upload"])
+app.include_router(bulk.router, prefix="/api/v1/images/bulk", tags=["bulk"])
+app.include_router(views.router, prefix="/api/v1/images/views", tags=["views"])
+app.include_router(events.router, prefix="/api/v1/events", tags=["events"])
+app.include_router(profiles.router, prefix="/api/v1/profiles", tags=["profiles"])
+app.include_router(subscriptions.router, prefix="/api/v1/subscriptions", tags=["subscriptions"])
+app.include_router(media.router, prefix="/media", tags=["media"])
 
 @app.on_event("startup")
 async def startup_event():
     logger.info("Application starting up...")
     try:
         await database.connect()
-        configure_cloudinary()
-        logger.info("Application started successfully")
+        start_resuming()
+        change_watcher.start()
+        view_counter.start()
+        similarity_index.start()
+        logger.info(f"Application started successfully ({settings.startup_mode} startup)")
     except Exception as e:
         logger.error(f"Startup failed: {str(e)}")
         raise
@@ -46,9 +106,19 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Application shutting down...")
+    await change_watcher.stop()
+    await similarity_index.stop()
+    await stop_operations()
+    # Write out the counts gathered since the last flush
+    await view_counter.stop()
     await database.close()
     logger.info("Application shutdown complete")
 
 @app.get("/")
 async def root():
-    return {"message": "Focus Gallery API is running"}
\ No newline at end of file
+    return {"message": "Focus Gallery API is running"}
+
+@app.get("/health")
+async def health():
+    # Answers as soon as the process is up; "ready" flips once indexes and seed data exist
+    return {"status": "ok", "ready": database.ready}
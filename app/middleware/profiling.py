@@ -0,0 +1,71 @@
+import asyncio
+import hmac
+import logging
+import random
+from typing import Iterable
+
+from app.services.profiler import ProfileStore, profiler
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+
+
+class ProfilingMiddleware:
+    """Profile selected requests with the sampling profiler.
+
+    A request is profiled when it sends ``X-Profile: 1`` together with the backend
+    API key, or when it falls within ``sample_rate``. The response carries
+    ``X-Profile-Id`` naming the stored profile. Other requests only pay for a scan
+    of their headers.
+    """
+
+    def __init__(
+        self,
+        app,
+        api_key: str,
+        store: ProfileStore,
+        sample_rate: float = 0.0,
+        exclude_prefixes: Iterable[str] = (),
+    ):
+        self.app = app
+        self.authorization = f"Bearer {api_key}".encode()
+        self.store = store
+        self.sample_rate = sample_rate
+        self.exclude_prefixes = tuple(exclude_prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wanted(scope):
+            return await self.app(scope, receive, send)
+
+        session = profiler.start(f"{scope['method']} {scope['path']}")
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", session.name.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.stop(session)
+            try:
+                await asyncio.to_thread(self.store.save, session)
+            except OSError as e:
+                logger.error(f"Failed to save profile {session.name}: {str(e)}")
+
+    def _wanted(self, scope) -> bool:
+        requested = False
+        authorized = False
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                requested = value not in (b"", b"0")
+            elif name == b"authorization":
+                authorized = hmac.compare_digest(value, self.authorization)
+        if requested:
+            if authorized:
+                return True
+            logger.warning(f"Ignoring X-Profile on {scope['path']} without the API key")
+        if self.sample_rate and random.random() < self.sample_rate:
+            return not scope["path"].startswith(self.exclude_prefixes)
+        return False
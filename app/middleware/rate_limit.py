@@ -0,0 +1,157 @@
+import hmac
+import json
+import math
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """Consume one token; returns 0 on success or the seconds until one is available"""
+        # A bucket created after ``now`` was read hasn't been waiting for negative time
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(now, self.updated)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+@dataclass(frozen=True)
+class RouteLimit:
+    name: str
+    method: str
+    paths: tuple
+    capacity: float
+    rate: float
+
+    def matches(self, method: str, path: str) -> bool:
+        return method == self.method and path in self.paths
+
+
+class RateLimitMiddleware:
+    """Admission control for the API.
+
+    Anonymous clients get a global token bucket plus one per matching route. Requests
+    carrying the backend API key (the bot, which proxies all of its users) skip the
+    buckets but still count against the upload and in-flight caps, which shed load
+    with 503 before latency piles up. Exempt paths (the platform's health check) skip
+    all of it, so a busy instance isn't mistaken for a dead one and restarted.
+    """
+
+    def __init__(
+        self,
+        app,
+        api_key: str,
+        capacity: float,
+        rate: float,
+        route_limits: Iterable[RouteLimit] = (),
+        upload_paths: Iterable[str] = (),
+        max_concurrent_uploads: int = 4,
+        max_in_flight: int = 64,
+        max_buckets: int = 10000,
+        trusted_proxy_hops: int = 1,
+        exempt_paths: Iterable[str] = (),
+    ):
+        self.app = app
+        self.api_key = api_key
+        self.capacity = capacity
+        self.rate = rate
+        self.route_limits = tuple(route_limits)
+        self.upload_paths = frozenset(upload_paths)
+        self.max_concurrent_uploads = max_concurrent_uploads
+        self.max_in_flight = max_in_flight
+        self.max_buckets = max_buckets
+        self.trusted_proxy_hops = trusted_proxy_hops
+        self.exempt_paths = frozenset(exempt_paths)
+        self._bearer = f"Bearer {api_key}".encode()
+        self.buckets: "OrderedDict[tuple, TokenBucket]" = OrderedDict()
+        self.in_flight = 0
+        self.active_uploads = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        path = scope["path"]
+        headers = dict(scope["headers"])
+        trusted = hmac.compare_digest(headers.get(b"authorization", b""), self._bearer)
+
+        if self.in_flight >= self.max_in_flight:
+            logger.warning(f"Shedding {method} {path}: {self.in_flight} requests in flight")
+            return await self._reject(send, 503, "Server is overloaded, try again shortly", 1)
+
+        if not trusted:
+            client = self._client_id(scope, headers)
+            now = time.monotonic()
+            wait = self._bucket((client, None), self.capacity, self.rate).take(now)
+            for limit in self.route_limits:
+                if not wait and limit.matches(method, path):
+                    wait = self._bucket((client, limit.name), limit.capacity, limit.rate).take(now)
+            if wait:
+                return await self._reject(send, 429, "Rate limit exceeded", wait)
+
+        is_upload = method == "POST" and path in self.upload_paths
+        if is_upload and self.active_uploads >= self.max_concurrent_uploads:
+            return await self._reject(send, 503, "Too many uploads in progress", 2)
+
+        self.in_flight += 1
+        if is_upload:
+            self.active_uploads += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+            if is_upload:
+                self.active_uploads -= 1
+
+    def _bucket(self, key: tuple, capacity: float, rate: float) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(capacity, rate)
+            # Forget the least recently seen clients so memory stays bounded
+            while len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def _client_id(self, scope, headers: dict) -> str:
+        # Render terminates TLS in front of the app, so the peer address is the proxy. Each proxy
+        # appends the address it received from, so only the last trusted_proxy_hops entries are
+        # real; anything to their left was sent by the client and could be anything.
+        forwarded: Optional[bytes] = headers.get(b"x-forwarded-for")
+        if forwarded and self.trusted_proxy_hops > 0:
+            hops = [hop.strip() for hop in forwarded.split(b",")]
+            if len(hops) >= self.trusted_proxy_hops and hops[-self.trusted_proxy_hops]:
+                return hops[-self.trusted_proxy_hops].decode("latin-1")
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    @staticmethod
+    async def _reject(send, status_code: int, detail: str, retry_after: float):
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
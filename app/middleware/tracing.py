@@ -0,0 +1,32 @@
+from app.services.tracing import tracer
+
+
+class TracingMiddleware:
+    """Server span per HTTP request, continuing the trace named in ``traceparent``.
+
+    Outermost, so the span includes time spent in admission control; the bot's
+    client span for the same call shows what the network and queueing added.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        traceparent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+
+        with tracer.trace(
+            f"{scope['method']} {scope['path']}", traceparent, query=scope["query_string"].decode("latin-1")
+        ) as span:
+            async def send_with_status(message):
+                if message["type"] == "http.response.start":
+                    span.attributes["status"] = message["status"]
+                await send(message)
+
+            await self.app(scope, receive, send_with_status if span.sampled else send)
@@ -8,16 +8,109 @@ class Category(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ImageMetadata(BaseModel):
-    url: str = Field(..., description="Cloudinary URL of the image")
-    cloudinary_id: str = Field(..., description="Cloudinary public ID")
+    id: Optional[str] = Field(None, description="Image document ID")
+    url: str = Field(..., description="Public URL of the image")
+    cloudinary_id: str = Field(..., description="Storage key (the Cloudinary public ID on Cloudinary)")
+    storage: str = Field("cloudinary", description="Storage backend holding the image")
     category_id: str = Field(..., description="Category ID the image belongs to")
     year: int = Field(..., description="Year associated with the image")
     tags: List[str] = Field(default=[], description="List of tags for the image")
     uploaded_by: int = Field(..., description="Telegram user ID of the uploader")
     uploaded_at: datetime = Field(default_factory=datetime.utcnow)
 
+class RemoteUpload(BaseModel):
+    file_id: str = Field(..., description="Telegram file_id of the photo")
+    category: str = Field(..., description="Category ID to upload into")
+    year: int = Field(..., description="Year associated with the image")
+    tags: str = Field("", description="Comma-separated tags")
+    uploaded_by: int = Field(..., description="Telegram user ID of the uploader")
+    thumbnail_file_id: Optional[str] = Field(
+        None, description="file_id of a small size of the same photo, downloaded for the perceptual hash"
+    )
+    allow_duplicate: bool = Field(False, description="Store the photo even if it looks like one already stored")
+
+class PopularImage(ImageMetadata):
+    views: int = Field(0, description="Views counted so far")
+
 class PaginatedResponse(BaseModel):
     total_count: int
     page: int
     per_page: int
-    items: List[ImageMetadata]
\ No newline at end of file
+    items: List[ImageMetadata]
+
+class Facet(BaseModel):
+    category_id: str
+    year: int
+    count: int
+    tags: List[str] = []
+
+class BulkSelection(BaseModel):
+    ids: List[str] = Field(default=[], description="Image IDs to act on")
+    category: Optional[str] = Field(None, description="Select every image in this category")
+    year: Optional[int] = Field(None, description="Narrow a category selection to one year")
+    tag: Optional[str] = Field(None, description="Narrow a category selection to one tag")
+    dry_run: bool = Field(False, description="Only count the selected images")
+
+class BulkMoveRequest(BulkSelection):
+    target_category: Optional[str] = Field(None, description="Category to move the images to")
+    target_year: Optional[int] = Field(None, description="Year to move the images to")
+
+class CacheKey(BaseModel):
+    category_id: str
+    year: int
+
+class BulkOperation(BaseModel):
+    id: str
+    kind: str
+    status: str = Field(..., description="preparing, pending, running, completed, failed or dry_run")
+    total: int
+    processed: int = 0
+    affected: List[CacheKey] = Field(default=[], description="Category/year pairs whose cached data changed")
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ViewEvent(BaseModel):
+    image_id: str
+    category_id: str
+    year: int
+    count: int = Field(1, ge=1, le=10000, description="Views of this image since the last report")
+
+class ViewBatch(BaseModel):
+    views: List[ViewEvent] = Field(..., max_length=5000)
+
+class SimilarImage(ImageMetadata):
+    distance: int = Field(..., description="Bits differing between the perceptual hashes, 0-64")
+
+class Subscription(BaseModel):
+    chat_id: int = Field(..., description="Telegram chat to notify")
+    category_id: str = Field(..., description="Category to follow")
+
+class SubscriberPage(BaseModel):
+    chat_ids: List[int]
+    next_after: Optional[int] = Field(None, description="Pass as after for the next page; None on the last one")
+
+class BroadcastRequest(BaseModel):
+    category_id: str
+    year: int
+    count: int = Field(..., ge=1, description="New images in the upload batch")
+    title: str = Field(..., max_length=200, description="Category and year as shown to subscribers")
+
+class Broadcast(BaseModel):
+    id: str
+    category_id: str
+    year: int
+    count: int
+    title: str
+    status: str = Field(..., description="pending, running or completed")
+    checkpoint: Optional[int] = Field(None, description="Last chat ID handled, in ascending order")
+    sent: int = 0
+    failed: int = 0
+    removed: int = Field(0, description="Subscribers dropped because the chat blocked the bot")
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class BroadcastProgress(BaseModel):
+    checkpoint: Optional[int] = None
+    status: Optional[str] = Field(None, pattern="^completed$", description="Set once the last page is sent")
+    sent: int = Field(0, ge=0, description="Added to the running total")
+    failed: int = Field(0, ge=0)
+    removed: int = Field(0, ge=0)
@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from app.models import BulkMoveRequest, BulkOperation, BulkSelection
+from app.services import bulk
+from app.utils.security import verify_api_key
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+@router.post("/delete", response_model=BulkOperation, status_code=status.HTTP_202_ACCEPTED)
+async def bulk_delete(selection: BulkSelection):
+    return await bulk.create_operation("delete", selection)
+
+@router.post("/move", response_model=BulkOperation, status_code=status.HTTP_202_ACCEPTED)
+async def bulk_move(request: BulkMoveRequest):
+    return await bulk.create_operation("move", request)
+
+@router.get("/{op_id}", response_model=BulkOperation)
+async def get_bulk_operation(op_id: str):
+    op = await bulk.get_operation(op_id)
+    if not op:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Bulk operation not found"
+        )
+    return op
+
+@router.post("/{op_id}/resume", response_model=BulkOperation, status_code=status.HTTP_202_ACCEPTED)
+async def resume_bulk_operation(op_id: str):
+    op = await bulk.get_operation(op_id)
+    if not op:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Bulk operation not found"
+        )
+    if op.status in ("failed",) + bulk.RESUMABLE:
+        # Claimed like any other start, so an operation another worker is running stays with it
+        bulk.start_operation(op_id, ("failed",) + bulk.RESUMABLE)
+    return op
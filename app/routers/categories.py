@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends
 from app.database import database
+from app.services.cache import response_cache
 from app.models import Category
 from typing import List
 
@@ -7,8 +8,14 @@ router = APIRouter()
 
 @router.get("/", response_model=List[Category])
 async def get_categories():
+    cache_key = ("categories", None, None)
+    cached = response_cache.get(cache_key)
+    if not response_cache.is_miss(cached):
+        return cached
+    generation = response_cache.generation(cache_key)
     categories = []
     cursor = database.db.categories.find({})
     async for doc in cursor:
         categories.append(Category(**doc))
+    response_cache.set(cache_key, categories, generation)
     return categories
\ No newline at end of file
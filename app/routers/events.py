@@ -0,0 +1,34 @@
+import asyncio
+import json
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
+from app.services.change_watcher import change_watcher
+from app.utils.security import verify_api_key
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+HEARTBEAT_INTERVAL = 15  # seconds; keeps proxies from closing an idle stream
+
+@router.get("/")
+async def stream_invalidations(request: Request):
+    """Server-sent events with the category/year keys whose cached data changed"""
+    queue = change_watcher.subscribe()
+
+    async def event_stream():
+        try:
+            yield f"data: {json.dumps({'watching': change_watcher.active})}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            change_watcher.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
@@ -1,38 +1,233 @@
+from bson import ObjectId
+from bson.errors import InvalidId
 from fastapi import APIRouter, Query, HTTPException, status
+from fastapi.responses import StreamingResponse
+from app.config import get_settings
 from app.database import database
-from app.models import ImageMetadata, PaginatedResponse
+from app.services.archive import stream_archive
+from app.services.cache import response_cache
+from app.services.changes import check_token_age, decode_token, stream_changes
+from app.services.similarity import similarity_index
+from app.models import Facet, ImageMetadata, PaginatedResponse, PopularImage, SimilarImage
 from typing import List, Optional
 
 router = APIRouter()
+settings = get_settings()
+
+_active_archives = 0
+
+class _ArchiveResponse(StreamingResponse):
+    """Gives its archive slot back once the response is over, however it ends, even if the body never started"""
+
+    async def __call__(self, scope, receive, send):
+        global _active_archives
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            _active_archives -= 1
 
 @router.get("/years", response_model=List[int])
 async def get_years(category: str = Query(...)):
+    cache_key = ("years", category, None)
+    cached = response_cache.get(cache_key)
+    if not response_cache.is_miss(cached):
+        return cached
+    generation = response_cache.generation(cache_key)
     try:
         pipeline = [
             {"$match": {"category_id": category}},
             {"$group": {"_id": None, "years": {"$addToSet": "$year"}}}
         ]
         result = await database.db.images.aggregate(pipeline).to_list(1)
-        if not result:
-            return []
-        return sorted(result[0].get("years", []), reverse=True)
+        years = sorted(result[0].get("years", []), reverse=True) if result else []
+        response_cache.set(cache_key, years, generation)
+        return years
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error fetching years: {str(e)}"
         )
 
+@router.get("/facets", response_model=List[Facet])
+async def get_facets():
+    cache_key = ("facets", None, None)
+    cached = response_cache.get(cache_key)
+    if not response_cache.is_miss(cached):
+        return cached
+    generation = response_cache.generation(cache_key)
+    try:
+        pipeline = [
+            {"$group": {
+                "_id": {"category_id": "$category_id", "year": "$year"},
+                "count": {"$sum": 1},
+                "tags": {"$addToSet": "$tags"}
+            }},
+            {"$project": {
+                "_id": 0,
+                "category_id": "$_id.category_id",
+                "year": "$_id.year",
+                "count": 1,
+                # Flatten the collected tag lists into one set
+                "tags": {"$reduce": {
+                    "input": "$tags",
+                    "initialValue": [],
+                    "in": {"$setUnion": ["$$value", "$$this"]}
+                }}
+            }},
+            {"$sort": {"category_id": 1, "year": -1}}
+        ]
+        facets = [Facet(**doc) async for doc in database.db.images.aggregate(pipeline)]
+        response_cache.set(cache_key, facets, generation)
+        return facets
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error fetching facets: {str(e)}"
+        )
+
+@router.get("/popular", response_model=List[PopularImage])
+async def get_popular(
+    category: Optional[str] = Query(None),
+    year: Optional[int] = Query(None),
+    limit: int = Query(10, ge=1, le=50)
+):
+    # Not cached: counts move with every view flush, and the counters index makes this cheap
+    try:
+        query = {}
+        if category:
+            query["category_id"] = category
+        if year is not None:
+            query["year"] = year
+        counters = await database.db.image_views.find(query).sort("views", -1).limit(limit).to_list(limit)
+        docs = {
+            doc["_id"]: doc
+            async for doc in database.db.images.find({"_id": {"$in": [c["_id"] for c in counters]}})
+        }
+        popular = []
+        for counter in counters:
+            doc = docs.get(counter["_id"])
+            # Counters can briefly outlive a deleted image
+            if doc:
+                doc["id"] = str(doc["_id"])
+                popular.append(PopularImage(**doc, views=counter["views"]))
+        return popular
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error fetching popular images: {str(e)}"
+        )
+
+@router.get("/archive")
+async def download_archive(category: str = Query(...), year: int = Query(...)):
+    """Every image of a category/year as a ZIP, streamed while it is built"""
+    count = await database.db.images.count_documents({"category_id": category, "year": year})
+    if not count:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No images for this category and year"
+        )
+    # Checked and taken with no await in between, so concurrent requests can't all slip through
+    global _active_archives
+    if _active_archives >= settings.max_concurrent_archives:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many archives being built, try again shortly",
+            headers={"Retry-After": "30"}
+        )
+    response = _ArchiveResponse(
+        stream_archive(category, year, settings.archive_concurrency),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{category}-{year}.zip"',
+            "X-Image-Count": str(count),
+        },
+    )
+    _active_archives += 1
+    return response
+
+@router.get("/changes")
+async def get_changes(
+    since: Optional[str] = Query(None, description="Token from a previous call; omit for a full pull"),
+    limit: int = Query(10000, ge=1, le=settings.change_feed_max_limit)
+):
+    """Inserts, updates and deletes since a token, as NDJSON in modification order.
+    Each line has a ``token`` to resume after it, and the final ``end`` line has the
+    token for the next call."""
+    position = decode_token(since) if since else None
+    if position is not None:
+        check_token_age(position)
+    return StreamingResponse(stream_changes(position, limit), media_type="application/x-ndjson")
+
+@router.get("/{image_id}/similar", response_model=List[SimilarImage])
+async def get_similar(
+    image_id: str,
+    limit: int = Query(5, ge=1, le=20),
+    max_distance: int = Query(settings.similar_max_distance, ge=0, le=64)
+):
+    """Images of the same category that look alike, closest first"""
+    if not similarity_index.available:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Similarity search needs numpy and Pillow installed"
+        )
+    try:
+        oid = ObjectId(image_id)
+    except InvalidId:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid image ID"
+        )
+    image = await database.db.images.find_one({"_id": oid}, {"category_id": 1, "phash": 1})
+    if not image:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Image not found"
+        )
+    if image.get("phash") is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Image has no perceptual hash yet; run python -m app.cli phash"
+        )
+    if not similarity_index.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Similarity index is still loading",
+            headers={"Retry-After": "10"}
+        )
+    matches = similarity_index.search(image["category_id"], image["phash"], max_distance, limit, exclude=oid)
+    distances = dict(matches)
+    docs = {
+        doc["_id"]: doc
+        async for doc in database.db.images.find({"_id": {"$in": list(distances)}})
+    }
+    similar = []
+    for match_id, distance in matches:
+        doc = docs.get(match_id)
+        # The index can briefly lag a delete
+        if doc:
+            doc["id"] = str(doc["_id"])
+            similar.append(SimilarImage(**doc, distance=distance))
+    return similar
+
 @router.get("/", response_model=PaginatedResponse)
 @router.get("", response_model=PaginatedResponse)  
 async def get_images(
     category: str = Query(...),
     year: int = Query(...),
     page: int = Query(1, ge=1),
-    per_page: int = Query(5, ge=1, le=20)
+    per_page: int = Query(5, ge=1, le=20),
+    tag: Optional[str] = Query(None)
 ):
+    cache_key = ("images", category, year, page, per_page, tag)
+    cached = response_cache.get(cache_key)
+    if not response_cache.is_miss(cached):
+        return cached
+    generation = response_cache.generation(cache_key)
     try:
         skip = (page - 1) * per_page
         query = {"category_id": category, "year": year}
+        if tag:
+            query["tags"] = tag
         
         total_count = await database.db.images.count_documents(query)
         cursor = database.db.images.find(query).skip(skip).limit(per_page)
@@ -40,15 +235,17 @@ async def get_images(
         images = []
         async for doc in cursor:
             # Convert ObjectId to string for JSON serialization
-            doc["_id"] = str(doc["_id"])
+            doc["id"] = str(doc["_id"])
             images.append(ImageMetadata(**doc))
         
-        return PaginatedResponse(
+        response = PaginatedResponse(
             total_count=total_count,
             page=page,
             per_page=per_page,
             items=images
         )
+        response_cache.set(cache_key, response, generation)
+        return response
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -0,0 +1,117 @@
+import asyncio
+import mimetypes
+import os
+import re
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.config import get_settings
+from app.services.storage import LOCAL_KEY, get_storage
+
+router = APIRouter()
+settings = get_settings()
+
+CHUNK_SIZE = 256 * 1024
+BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class FileRangeResponse(Response):
+    """Sends ``length`` bytes of a file from ``offset``.
+
+    Uses the ASGI zero-copy send extension (sendfile) when the server offers
+    it; otherwise reads chunks with ``os.pread`` off the event loop.
+    """
+
+    def __init__(self, path: str, offset: int, length: int, status_code: int, headers: dict, media_type: str):
+        headers = {**headers, "content-length": str(length)}
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        with open(self.path, "rb") as f:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.offset,
+                    "count": self.length,
+                })
+                return
+            position, end = self.offset, self.offset + self.length
+            while position < end:
+                chunk = await asyncio.to_thread(os.pread, f.fileno(), min(CHUNK_SIZE, end - position), position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": position < end})
+            if position < end:
+                # The file shrank under us; close the body so the client sees a short read
+                await send({"type": "http.response.body", "body": b""})
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """(start, end inclusive) for a single byte range; raises 416 if it can't be served.
+    Multiple or malformed ranges return None, so the whole file is sent instead."""
+    match = BYTE_RANGE.match(header.replace(" ", ""))
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        # Suffix range: the final N bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = size, -1
+    if start >= size or start > end:
+        raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                            detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+@router.api_route("/{key:path}", methods=["GET", "HEAD"])
+async def get_media(key: str, request: Request):
+    """A file from local storage. Keys are content hashes, so responses never change
+    and may be cached for as long as clients like."""
+    path = get_storage("local").path(key)
+    try:
+        if path is None:
+            raise FileNotFoundError(key)
+        stat = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+
+    etag = f'"{LOCAL_KEY.match(key).group(3)}"'
+    headers = {
+        "cache-control": f"public, max-age={settings.media_cache_max_age}, immutable",
+        "etag": etag,
+        "accept-ranges": "bytes",
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+    size = stat.st_size
+    byte_range = None
+    range_header = request.headers.get("range")
+    # If-Range names the version the client already has part of; a mismatch means start over
+    if range_header and request.headers.get("if-range", etag) == etag:
+        byte_range = _parse_range(range_header, size)
+    if byte_range is None:
+        return FileRangeResponse(str(path), 0, size, status.HTTP_200_OK, headers, media_type)
+    start, end = byte_range
+    headers["content-range"] = f"bytes {start}-{end}/{size}"
+    return FileRangeResponse(str(path), start, end - start + 1, status.HTTP_206_PARTIAL_CONTENT, headers, media_type)
@@ -0,0 +1,29 @@
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import FileResponse
+from app.config import get_settings
+from app.services.profiler import ProfileStore
+from app.utils.security import verify_api_key
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+settings = get_settings()
+
+profile_store = ProfileStore(settings.profile_dir, max_profiles=settings.profile_max_files)
+
+
+@router.get("/")
+async def list_profiles() -> List[dict]:
+    """Stored profiles, newest first"""
+    return profile_store.list()
+
+
+@router.get("/{name}")
+async def download_profile(name: str):
+    """One profile in folded-stack format (feed it to flamegraph.pl or speedscope)"""
+    path = profile_store.path(name)
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+    return FileResponse(path, media_type="text/plain", filename=name)
@@ -0,0 +1,146 @@
+from datetime import datetime
+from typing import List, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.database import database
+from app.models import Broadcast, BroadcastProgress, BroadcastRequest, SubscriberPage, Subscription
+from app.utils.security import verify_api_key
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+
+def _broadcast(doc: dict) -> Broadcast:
+    doc["id"] = str(doc.pop("_id"))
+    return Broadcast(**doc)
+
+
+@router.get("/", response_model=List[str])
+async def get_subscriptions(chat_id: int = Query(...)):
+    """Categories a chat follows"""
+    cursor = database.db.subscriptions.find({"chat_id": chat_id}, {"category_id": 1}).sort("category_id", 1)
+    return [doc["category_id"] async for doc in cursor]
+
+
+@router.put("/")
+async def subscribe(subscription: Subscription):
+    if not await database.db.categories.find_one({"id": subscription.category_id}, {"_id": 1}):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Category not found"
+        )
+    result = await database.db.subscriptions.update_one(
+        {"category_id": subscription.category_id, "chat_id": subscription.chat_id},
+        {"$setOnInsert": {"created_at": datetime.utcnow()}},
+        upsert=True
+    )
+    return {"created": result.upserted_id is not None}
+
+
+@router.delete("/")
+async def unsubscribe(chat_id: int = Query(...), category_id: Optional[str] = Query(None)):
+    """Stop following one category, or every category when none is given"""
+    query = {"chat_id": chat_id}
+    if category_id:
+        query["category_id"] = category_id
+    result = await database.db.subscriptions.delete_many(query)
+    return {"removed": result.deleted_count}
+
+
+@router.get("/subscribers", response_model=SubscriberPage)
+async def get_subscribers(
+    category_id: str = Query(...),
+    after: Optional[int] = Query(None, description="Last chat ID of the previous page"),
+    limit: int = Query(200, ge=1, le=1000)
+):
+    """Subscribers in ascending chat ID order, so a broadcast can resume after any chat"""
+    query = {"category_id": category_id}
+    if after is not None:
+        query["chat_id"] = {"$gt": after}
+    cursor = database.db.subscriptions.find(query, {"chat_id": 1, "_id": 0}).sort("chat_id", 1).limit(limit)
+    chat_ids = [doc["chat_id"] async for doc in cursor]
+    return SubscriberPage(chat_ids=chat_ids, next_after=chat_ids[-1] if len(chat_ids) == limit else None)
+
+
+@router.post("/broadcasts", response_model=Broadcast, status_code=status.HTTP_201_CREATED)
+async def create_broadcast(request: BroadcastRequest):
+    """Queue a new-images notification. Batches for a category/year whose
+    notification hasn't started yet are folded into that one."""
+    query = {"category_id": request.category_id, "year": request.year, "status": "pending"}
+    update = {
+        "$inc": {"count": request.count},
+        "$set": {"title": request.title},
+        "$setOnInsert": {
+            "checkpoint": None, "sent": 0, "failed": 0, "removed": 0, "created_at": datetime.utcnow()
+        },
+    }
+    try:
+        doc = await database.db.broadcasts.find_one_and_update(
+            query, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # A concurrent batch inserted the pending broadcast first; fold into it
+        doc = await database.db.broadcasts.find_one_and_update(
+            query, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    return _broadcast(doc)
+
+
+@router.get("/broadcasts", response_model=List[Broadcast])
+async def get_unfinished_broadcasts():
+    """Pending and interrupted broadcasts, oldest first"""
+    cursor = database.db.broadcasts.find({"status": {"$in": ["pending", "running"]}}).sort("created_at", 1)
+    return [_broadcast(doc) async for doc in cursor]
+
+
+def _broadcast_id(broadcast_id: str) -> ObjectId:
+    try:
+        return ObjectId(broadcast_id)
+    except InvalidId:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid broadcast ID"
+        )
+
+
+@router.post("/broadcasts/{broadcast_id}/start", response_model=Broadcast)
+async def start_broadcast(broadcast_id: str):
+    """Move a pending broadcast to running. Once it is running, new batches
+    queue a broadcast of their own, so the returned count is final."""
+    doc = await database.db.broadcasts.find_one_and_update(
+        {"_id": _broadcast_id(broadcast_id), "status": "pending"},
+        {"$set": {"status": "running"}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not doc:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No pending broadcast with this ID"
+        )
+    return _broadcast(doc)
+
+
+@router.patch("/broadcasts/{broadcast_id}", response_model=Broadcast)
+async def update_broadcast(broadcast_id: str, progress: BroadcastProgress):
+    """Record a delivered page: move the checkpoint and add to the counters"""
+    update = {"$inc": {"sent": progress.sent, "failed": progress.failed, "removed": progress.removed}}
+    changes = {}
+    if progress.checkpoint is not None:
+        changes["checkpoint"] = progress.checkpoint
+    if progress.status:
+        changes["status"] = progress.status
+    if changes:
+        update["$set"] = changes
+    doc = await database.db.broadcasts.find_one_and_update(
+        {"_id": _broadcast_id(broadcast_id)}, update, return_document=ReturnDocument.AFTER
+    )
+    if not doc:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Broadcast not found"
+        )
+    return _broadcast(doc)
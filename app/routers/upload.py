@@ -1,25 +1,151 @@
+import asyncio
 import os
-import aiofiles
 import logging
-from fastapi import APIRouter, UploadFile, Form, File, Depends, HTTPException, status
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, UploadFile, Form, File, Depends, Header, HTTPException, Response, status
 from app.database import database
-from app.models import ImageMetadata
-from app.services.cloudinary import upload_to_cloudinary
+from app.models import ImageMetadata, RemoteUpload
+from app.config import get_settings
+from app.services import idempotency
+from app.services import phash as perceptual_hash
+from app.services.similarity import similarity_index
+from app.services.storage import get_storage
+from app.services.telegram_files import download_file, resolve_file
 from app.utils.security import verify_api_key
 from datetime import datetime
-from typing import List, Optional
+from typing import Awaitable, Callable, List, Optional
 import tempfile
 
 router = APIRouter(dependencies=[Depends(verify_api_key)])
 logger = logging.getLogger(__name__)
+settings = get_settings()
+
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+ALLOWED_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+def _check_duplicates(category: str, phash: int):
+    """Refuse an upload that looks like an image already in its category"""
+    if not similarity_index.ready:
+        return
+    matches = similarity_index.search(category, phash, settings.duplicate_max_distance, limit=5)
+    if matches:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                # Other conflicts (an Idempotency-Key still in progress) have a plain string detail
+                "reason": "duplicate",
+                "message": "Looks like a near-duplicate of an image in this category; send allow_duplicate to store it anyway",
+                "duplicates": [{"id": str(oid), "distance": distance} for oid, distance in matches],
+            }
+        )
+
+async def _still_stored(stored: dict, category: str, year: int) -> bool:
+    """The image a stored upload result describes is still there, in the same category and year"""
+    try:
+        image_id = ObjectId(stored["id"])
+    except (KeyError, TypeError, InvalidId):
+        return False
+    return await database.db.images.find_one(
+        {"_id": image_id, "category_id": category, "year": year}, {"_id": 1}
+    ) is not None
+
+async def _store_image(
+    response: Response,
+    save: Callable[[], Awaitable[dict]],
+    phash: Callable[[], Awaitable[Optional[int]]],
+    category: str,
+    year: int,
+    tags: str,
+    uploaded_by: int,
+    idempotency_key: Optional[str],
+    allow_duplicate: bool
+) -> ImageMetadata:
+    """Store the file with ``save()`` and record it, once per Idempotency-Key.
+
+    The perceptual hash from ``phash()`` is checked for near-duplicates before
+    anything is stored, and kept on the image for /similar.
+    """
+    claimed_key = None
+    try:
+        if idempotency_key:
+            # The bot sends the photo's file_unique_id; the same photo may still go to another category/year.
+            # Remote and multipart uploads share the key, so falling back after a lost response can't duplicate.
+            scoped_key = f"{uploaded_by}:{category}:{year}:{idempotency_key}"
+            while True:
+                stored = await idempotency.claim(scoped_key)
+                if stored is None:
+                    claimed_key = scoped_key
+                    break
+                if await _still_stored(stored, category, year):
+                    response.headers["Idempotent-Replayed"] = "true"
+                    return ImageMetadata(**stored)
+                # Deleted or moved since: replaying would report an upload that stored nothing
+                await idempotency.discard(scoped_key, stored)
+
+        image_hash = await phash()
+        if image_hash is not None and not allow_duplicate:
+            _check_duplicates(category, image_hash)
+
+        storage = get_storage()
+        stored_file = await save()
+
+        # Prepare tags
+        tag_list = [tag.strip() for tag in tags.split(",")] if tags else []
+
+        # Create image document
+        uploaded_at = datetime.utcnow()
+        image_doc = {
+            "url": stored_file["url"],
+            "cloudinary_id": stored_file["key"],
+            "storage": storage.name,
+            "category_id": category,
+            "year": year,
+            "tags": tag_list,
+            "uploaded_by": uploaded_by,
+            "uploaded_at": uploaded_at,
+            "modified_at": uploaded_at
+        }
+        if image_hash is not None:
+            image_doc["phash"] = image_hash
+
+        # Save to database
+        result = await database.db.images.insert_one(image_doc)
+        if storage.shares_files and not await asyncio.to_thread(storage.existing, [stored_file["key"]]):
+            # A delete removed the shared file before this document existed to keep it; write it again
+            await save()
+        image_doc["id"] = str(result.inserted_id)
+        image = ImageMetadata(**image_doc)
+        if image_hash is not None:
+            # Visible to the next upload's duplicate check right away, even before the change stream
+            similarity_index.apply(added=[(category, result.inserted_id, image_hash)])
+
+        if claimed_key:
+            await idempotency.complete(claimed_key, image.model_dump())
+            claimed_key = None
+        return image
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.exception(f"Image upload failed: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Image upload failed"
+        )
+    finally:
+        if claimed_key:
+            await idempotency.release(claimed_key)
 
 @router.post("/", response_model=ImageMetadata)
 async def upload_image(
+    response: Response,
     file: UploadFile = File(...),
     category: str = Form(...),
     year: int = Form(...),
     tags: str = Form(""),
-    uploaded_by: int = Form(...)
+    uploaded_by: int = Form(...),
+    allow_duplicate: bool = Form(False),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     # Validate file type and size
     allowed_types = ["image/jpeg", "image/png", "image/jpg"]
@@ -28,55 +154,71 @@ async def upload_image(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid file type. Only JPG, JPEG, PNG are allowed."
         )
-    
+
     # Create a temporary file with a proper extension
     file_ext = os.path.splitext(file.filename)[1]
     with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
         content = await file.read()
-        
+
         # Check size (8 MB max)
-        if len(content) > 8 * 1024 * 1024:
+        if len(content) > MAX_UPLOAD_BYTES:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="File size exceeds 8 MB limit"
             )
-        
+
         temp_file.write(content)
         temp_file_path = temp_file.name
-    
+
     try:
-        # Upload to Cloudinary - ADD AWAIT HERE
-        upload_result = await upload_to_cloudinary(temp_file_path)
-        
-        # Prepare tags
-        tag_list = [tag.strip() for tag in tags.split(",")] if tags else []
-        
-        # Create image document
-        image_doc = {
-            "url": upload_result["url"],
-            "cloudinary_id": upload_result["public_id"],
-            "category_id": category,
-            "year": year,
-            "tags": tag_list,
-            "uploaded_by": uploaded_by,
-            "uploaded_at": datetime.utcnow()
-        }
-        
-        # Save to database
-        result = await database.db.images.insert_one(image_doc)
-        image_doc["_id"] = result.inserted_id
-        
-        return ImageMetadata(**image_doc)
-    except HTTPException as he:
-        raise he
-    except Exception as e:
-        logger.exception(f"Image upload failed: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Image upload failed"
+        return await _store_image(
+            response, lambda: get_storage().save(temp_file_path), lambda: perceptual_hash.phash_of(temp_file_path),
+            category, year, tags, uploaded_by, idempotency_key, allow_duplicate
         )
     finally:
         # Clean up temporary file
         if os.path.exists(temp_file_path):
             os.remove(temp_file_path)
-            logger.debug(f"Removed temp file: {temp_file_path}")
\ No newline at end of file
+            logger.debug(f"Removed temp file: {temp_file_path}")
+
+@router.post("/remote", response_model=ImageMetadata)
+async def upload_remote_image(
+    upload: RemoteUpload,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Upload a photo the bot received, by its Telegram file_id.
+
+    The file is resolved to a Telegram download URL that the storage backend
+    fetches directly; with Cloudinary the bytes never pass through the bot or
+    the API. The multipart endpoint remains for clients that can't use this.
+    """
+    async def save() -> dict:
+        remote = await resolve_file(upload.file_id)
+        ext = os.path.splitext(remote["file_path"])[1].lower()
+        if ext not in ALLOWED_EXTENSIONS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid file type. Only JPG, JPEG, PNG are allowed."
+            )
+        if remote["file_size"] and remote["file_size"] > MAX_UPLOAD_BYTES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="File size exceeds 8 MB limit"
+            )
+        return await get_storage().save_remote(remote["url"], ext)
+
+    async def phash() -> Optional[int]:
+        if not perceptual_hash.available():
+            return None
+        # A thumbnail hashes the same as the full photo and is a fraction of the download
+        try:
+            data = await download_file(upload.thumbnail_file_id or upload.file_id, MAX_UPLOAD_BYTES)
+        except HTTPException:
+            return None
+        return await perceptual_hash.phash_of(data)
+
+    return await _store_image(
+        response, save, phash, upload.category, upload.year, upload.tags, upload.uploaded_by,
+        idempotency_key, upload.allow_duplicate
+    )
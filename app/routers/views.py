@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends, status
+from app.models import ViewBatch
+from app.services.views import view_counter
+from app.utils.security import verify_api_key
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+
+@router.post("/", status_code=status.HTTP_202_ACCEPTED)
+async def record_views(batch: ViewBatch):
+    """Count views in memory; they reach MongoDB with the next periodic flush"""
+    accepted = sum(
+        view_counter.record(view.image_id, view.category_id, view.year, view.count)
+        for view in batch.views
+    )
+    return {"accepted": accepted}
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import os
+import zipfile
+from collections import deque
+from typing import AsyncIterator, List
+from urllib.parse import urlparse
+
+import httpx
+
+from app.config import get_settings
+from app.database import database
+from app.services.storage import get_storage
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+CHUNK_SIZE = 64 * 1024
+FETCH_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+
+
+class _StreamBuffer:
+    """Write-only sink for ZipFile. Without ``tell``/``seek`` ZipFile treats it as
+    unseekable and writes sizes in data descriptors after each entry instead of
+    seeking back, so the archive can be sent as it is produced."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _entry_name(index: int, doc: dict) -> str:
+    base = os.path.basename(doc.get("cloudinary_id") or str(doc["_id"]))
+    ext = os.path.splitext(urlparse(doc["url"]).path)[1] or ".jpg"
+    return f"{index:04d}-{base}{ext}"
+
+
+async def stream_archive(category: str, year: int, concurrency: int) -> AsyncIterator[bytes]:
+    """Yield a ZIP of every image in a category/year as it is built.
+
+    Originals are fetched ``concurrency`` at a time ahead of the entry being
+    written, so memory holds at most that many images plus one chunk of output
+    whatever the archive size. Images that can't be fetched are listed in
+    ``MISSING.txt`` at the end, since the status line has long been sent.
+    """
+    buffer = _StreamBuffer()
+    archive = zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED)
+    cursor = database.db.images.find(
+        {"category_id": category, "year": year},
+        {"url": 1, "cloudinary_id": 1, "storage": 1},
+    ).sort("uploaded_at", 1)
+    window: deque = deque()
+    missing = []
+
+    async with httpx.AsyncClient(timeout=FETCH_TIMEOUT, follow_redirects=True) as client:
+        async def fetch(doc: dict) -> bytes:
+            storage = get_storage(doc.get("storage") or "cloudinary")
+            return await storage.read(doc["cloudinary_id"], doc["url"], client)
+
+        async def write_entry(name: str, task: asyncio.Task):
+            try:
+                content = await task
+            except Exception as e:
+                logger.warning(f"Archive {category}/{year}: skipping {name}: {str(e)}")
+                missing.append(f"{name}: {str(e)}")
+                return
+            # ZIP timestamps can't predate 1980
+            info = zipfile.ZipInfo(name, date_time=(max(year, 1980), 1, 1, 0, 0, 0))
+            with archive.open(info, "w") as entry:
+                for start in range(0, len(content), CHUNK_SIZE):
+                    entry.write(content[start:start + CHUNK_SIZE])
+                    data = buffer.drain()
+                    if data:
+                        yield data
+
+        try:
+            index = 0
+            async for doc in cursor:
+                index += 1
+                window.append((_entry_name(index, doc), asyncio.create_task(fetch(doc))))
+                if len(window) >= concurrency:
+                    async for chunk in write_entry(*window.popleft()):
+                        yield chunk
+            while window:
+                async for chunk in write_entry(*window.popleft()):
+                    yield chunk
+            if missing:
+                archive.writestr("MISSING.txt", "\n".join(missing) + "\n")
+            archive.close()
+            yield buffer.drain()
+        finally:
+            # The client may disconnect mid-archive
+            for _, task in window:
+                task.cancel()
@@ -0,0 +1,321 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, status
+from pymongo import DeleteOne, ReturnDocument, UpdateOne
+
+from app.config import get_settings
+from app.database import database
+from app.models import BulkMoveRequest, BulkOperation, BulkSelection
+from app.services.changes import record_deletions
+from app.services.similarity import similarity_index
+from app.services.cloudinary import ADMIN_BATCH_SIZE
+from app.services.storage import delete_unreferenced, get_storage
+from app.services.views import forget_views, move_views
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Every uvicorn worker runs this module, so operations are claimed in MongoDB: the owner
+# renews its lease before each chunk, and another worker takes over once it lapses
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{ObjectId()}"
+RESUMABLE = ("preparing", "pending", "running")
+
+# Operations run in the background; keep references so tasks are not garbage collected
+_running: Dict[str, asyncio.Task] = {}
+_sweeper: Optional[asyncio.Task] = None
+
+
+def _selection_query(selection: BulkSelection) -> dict:
+    if selection.ids:
+        try:
+            return {"_id": {"$in": [ObjectId(image_id) for image_id in selection.ids]}}
+        except InvalidId:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid image ID"
+            )
+    if not selection.category:
+        # Never allow an empty filter to select the whole gallery
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide image IDs or at least a category"
+        )
+    query = {"category_id": selection.category}
+    if selection.year is not None:
+        query["year"] = selection.year
+    if selection.tag:
+        query["tags"] = selection.tag
+    return query
+
+
+def _to_model(op: dict) -> BulkOperation:
+    return BulkOperation(id=str(op["_id"]), **{k: v for k, v in op.items() if k != "_id"})
+
+
+async def create_operation(kind: str, selection: BulkSelection) -> BulkOperation:
+    """Snapshot the selected images into a work list and start processing it"""
+    query = _selection_query(selection)
+    target = {}
+    if isinstance(selection, BulkMoveRequest):
+        if selection.target_category:
+            target["category_id"] = selection.target_category
+        if selection.target_year is not None:
+            target["year"] = selection.target_year
+        if not target:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Provide a target category or year"
+            )
+
+    if selection.dry_run:
+        total = await database.db.images.count_documents(query)
+        return BulkOperation(id="", kind=kind, status="dry_run", total=total)
+
+    now = datetime.utcnow()
+    op = {
+        "_id": ObjectId(),
+        "kind": kind,
+        "status": "preparing",
+        # Kept so an operation interrupted while preparing can take its snapshot again
+        "selection": selection.model_dump(include={"ids", "category", "year", "tag"}),
+        "target": target,
+        "total": 0,
+        "processed": 0,
+        "affected": [],
+        "error": None,
+        "owner": WORKER_ID,
+        "lease_until": now + timedelta(seconds=settings.bulk_lease),
+        "created_at": now,
+    }
+    await database.db.bulk_operations.insert_one(op)
+    try:
+        op["total"] = await _snapshot(op, query)
+    except Exception as e:
+        # The caller is told it failed, so the sweep must not run it anyway
+        await _release(op["_id"], status="failed", error=f"Could not list the images: {e}")
+        raise
+    op["status"] = "pending"
+    start_operation(str(op["_id"]))
+    return _to_model(op)
+
+
+async def _snapshot(op: dict, query: dict) -> int:
+    """Write the work list that makes the operation resumable; each item is marked done once applied"""
+    # Leftovers of an attempt interrupted while preparing
+    await database.db.bulk_operation_items.delete_many({"op_id": op["_id"]})
+    total = 0
+    batch = []
+    projection = {"cloudinary_id": 1, "storage": 1, "category_id": 1, "year": 1}
+    async for doc in database.db.images.find(query, projection, batch_size=ADMIN_BATCH_SIZE):
+        batch.append({
+            "op_id": op["_id"],
+            "image_id": doc["_id"],
+            "cloudinary_id": doc.get("cloudinary_id"),
+            "storage": doc.get("storage") or "cloudinary",
+            "category_id": doc.get("category_id"),
+            "year": doc.get("year"),
+            "done": False,
+        })
+        if len(batch) >= ADMIN_BATCH_SIZE:
+            await database.db.bulk_operation_items.insert_many(batch)
+            total += len(batch)
+            batch = []
+            if not await _renew(op["_id"]):
+                raise RuntimeError("Lost the lease while preparing")
+    if batch:
+        await database.db.bulk_operation_items.insert_many(batch)
+        total += len(batch)
+
+    await database.db.bulk_operations.update_one(
+        {"_id": op["_id"], "owner": WORKER_ID}, {"$set": {"total": total, "status": "pending"}}
+    )
+    return total
+
+
+async def get_operation(op_id: str) -> Optional[BulkOperation]:
+    try:
+        op = await database.db.bulk_operations.find_one({"_id": ObjectId(op_id)})
+    except InvalidId:
+        return None
+    return _to_model(op) if op else None
+
+
+def start_operation(op_id: str, statuses: Iterable[str] = RESUMABLE):
+    """Run the operation here if no other worker holds it; ``statuses`` are the ones it may be resumed from"""
+    task = _running.get(op_id)
+    if task and not task.done():
+        return
+    _running[op_id] = asyncio.create_task(run_operation(ObjectId(op_id), tuple(statuses)))
+
+
+async def _claim(op_id: ObjectId, statuses: tuple) -> Optional[dict]:
+    now = datetime.utcnow()
+    return await database.db.bulk_operations.find_one_and_update(
+        {
+            "_id": op_id,
+            "status": {"$in": list(statuses)},
+            "$or": [{"owner": WORKER_ID}, {"lease_until": None}, {"lease_until": {"$lt": now}}],
+        },
+        {"$set": {"owner": WORKER_ID, "lease_until": now + timedelta(seconds=settings.bulk_lease)}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _renew(op_id: ObjectId) -> bool:
+    """Extend this worker's lease; False if another worker has taken the operation over"""
+    result = await database.db.bulk_operations.update_one(
+        {"_id": op_id, "owner": WORKER_ID},
+        {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=settings.bulk_lease)}},
+    )
+    return result.matched_count == 1
+
+
+async def _release(op_id: ObjectId, **changes):
+    await database.db.bulk_operations.update_one(
+        {"_id": op_id, "owner": WORKER_ID},
+        {"$set": {**changes, "owner": None, "lease_until": None}},
+    )
+
+
+async def run_operation(op_id: ObjectId, statuses: tuple = RESUMABLE):
+    op = await _claim(op_id, statuses)
+    if not op:
+        # Finished, or another worker is running it
+        return
+    try:
+        if op["status"] == "preparing":
+            if not op.get("selection"):
+                await _release(op_id, status="failed", error="Interrupted while preparing, start it again")
+                return
+            logger.info(f"Restarting bulk {op['kind']} {op_id} interrupted while preparing")
+            await _snapshot(op, _selection_query(BulkSelection(**op["selection"])))
+        await database.db.bulk_operations.update_one(
+            {"_id": op_id, "owner": WORKER_ID}, {"$set": {"status": "running", "error": None}}
+        )
+        while True:
+            if not await _renew(op_id):
+                logger.warning(f"Bulk {op['kind']} {op_id} was taken over by another worker")
+                return
+            items = await database.db.bulk_operation_items.find(
+                {"op_id": op_id, "done": False}
+            ).to_list(ADMIN_BATCH_SIZE)
+            if not items:
+                break
+            if op["kind"] == "delete":
+                applied = await _delete_chunk(items)
+            else:
+                applied = await _move_chunk(items, op["target"])
+
+            affected = {(item["category_id"], item["year"]) for item in applied}
+            if op["kind"] == "move":
+                affected |= {
+                    (op["target"].get("category_id", item["category_id"]), op["target"].get("year", item["year"]))
+                    for item in applied
+                }
+            await database.db.bulk_operation_items.update_many(
+                {"_id": {"$in": [item["_id"] for item in items]}},
+                {"$set": {"done": True}}
+            )
+            await database.db.bulk_operations.update_one(
+                {"_id": op_id, "owner": WORKER_ID},
+                {
+                    "$inc": {"processed": len(items)},
+                    "$addToSet": {"affected": {"$each": [
+                        {"category_id": category_id, "year": year} for category_id, year in affected
+                    ]}},
+                }
+            )
+        await _release(op_id, status="completed")
+        await database.db.bulk_operation_items.delete_many({"op_id": op_id})
+        logger.info(f"Bulk {op['kind']} {op_id} completed")
+    except asyncio.CancelledError:
+        # Shutting down: hand the operation straight to the next worker that sweeps
+        await _release(op_id)
+        raise
+    except Exception as e:
+        logger.exception(f"Bulk {op['kind']} {op_id} failed: {str(e)}")
+        await _release(op_id, status="failed", error=str(e))
+    finally:
+        _running.pop(str(op_id), None)
+
+
+async def _delete_chunk(items: list) -> list:
+    # Documents go first so an interrupted chunk leaves orphaned assets, never broken images;
+    # the work list still holds the storage keys, so a resume finishes the storage side
+    await database.db.images.bulk_write(
+        [DeleteOne({"_id": item["image_id"]}) for item in items],
+        ordered=False
+    )
+    await forget_views([item["image_id"] for item in items])
+    similarity_index.apply(removed=[item["image_id"] for item in items])
+    await record_deletions(
+        {"_id": item["image_id"], "category_id": item.get("category_id"), "year": item.get("year")}
+        for item in items
+    )
+    keys_by_storage = {}
+    for item in items:
+        if item.get("cloudinary_id"):
+            keys_by_storage.setdefault(item.get("storage") or "cloudinary", set()).add(item["cloudinary_id"])
+    for name, keys in keys_by_storage.items():
+        # Local files are content-addressed, so another image may still use the same file
+        removed = await delete_unreferenced(get_storage(name), keys)
+        if len(removed) < len(keys):
+            raise RuntimeError(f"{name} storage kept {len(keys) - len(removed)} files, resume to retry")
+    return items
+
+
+async def _move_chunk(items: list, target: dict) -> list:
+    # Storage keys don't depend on category or year, so a move only touches MongoDB
+    # modified_at puts the moved images into the change feed
+    changes = {**target, "modified_at": datetime.utcnow()}
+    await database.db.images.bulk_write(
+        [UpdateOne({"_id": item["image_id"]}, {"$set": changes}) for item in items],
+        ordered=False
+    )
+    await move_views([item["image_id"] for item in items], target)
+    if "category_id" in target:
+        similarity_index.move([item["image_id"] for item in items], target["category_id"])
+    return items
+
+
+async def resume_operations():
+    """Restart operations whose worker stopped renewing its lease, e.g. after a shutdown or crash"""
+    while True:
+        try:
+            async for op in database.db.bulk_operations.find(
+                {
+                    "status": {"$in": list(RESUMABLE)},
+                    "$or": [{"lease_until": None}, {"lease_until": {"$lt": datetime.utcnow()}}],
+                },
+                {"_id": 1},
+            ):
+                logger.info(f"Resuming bulk operation {op['_id']}")
+                start_operation(str(op["_id"]))
+        except Exception as e:
+            logger.error(f"Failed to resume bulk operations: {str(e)}")
+        await asyncio.sleep(settings.bulk_lease)
+
+
+def start_resuming():
+    global _sweeper
+    if _sweeper is None or _sweeper.done():
+        _sweeper = asyncio.create_task(resume_operations())
+
+
+async def stop_operations():
+    """Stop sweeping and release this worker's operations so another one picks them up"""
+    global _sweeper
+    tasks = list(_running.values())
+    if _sweeper:
+        tasks.append(_sweeper)
+        _sweeper = None
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,86 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+from app.config import get_settings
+
+settings = get_settings()
+
+
+class ResponseCache:
+    """Per-process cache for read endpoints, keyed by (kind, category_id, year, ...).
+
+    Entries expire after ``ttl`` seconds; the change watcher invalidates exact
+    category/year keys as soon as MongoDB reports a write, which is what makes a
+    long TTL safe. A handler takes ``generation(key)`` before it reads MongoDB
+    and passes it to ``set``, so a result read before an invalidation that
+    landed mid-read is not cached.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, ttl: float, max_entries: int = 2000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[Hashable, ...], Tuple[float, Any]]" = OrderedDict()
+        # Bumped by invalidations: per category, per cross-category kind, and _epoch for everything
+        self._generations: Dict[Hashable, int] = {}
+        self._epoch = 0
+
+    def get(self, key: Tuple[Hashable, ...]) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return self._MISSING
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return self._MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    @staticmethod
+    def _scope(key: Tuple[Hashable, ...]) -> Hashable:
+        # Facets and category listings span every category
+        return key[0] if key[0] in ("facets", "categories") else ("category", key[1])
+
+    def _bump(self, scope: Hashable):
+        self._generations[scope] = self._generations.get(scope, 0) + 1
+
+    def generation(self, key: Tuple[Hashable, ...]) -> Tuple[int, int]:
+        return self._epoch, self._generations.get(self._scope(key), 0)
+
+    def set(self, key: Tuple[Hashable, ...], value: Any, generation: Optional[Tuple[int, int]] = None):
+        """Store ``value``, unless ``key`` was invalidated since ``generation`` was taken"""
+        if generation is not None and generation != self.generation(key):
+            return
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def is_miss(self, value: Any) -> bool:
+        return value is self._MISSING
+
+    def invalidate(self, category_id: Optional[str] = None, year: Optional[int] = None):
+        """Drop entries for one category/year, a whole category, or everything"""
+        if category_id is None:
+            self._epoch += 1
+            self._entries.clear()
+            return
+        for scope in (("category", category_id), "facets", "categories"):
+            self._bump(scope)
+        for key in list(self._entries):
+            kind, key_category, key_year = key[0], key[1], key[2]
+            # Facets and category listings span every category
+            if kind in ("facets", "categories"):
+                del self._entries[key]
+            elif key_category == category_id and (year is None or key_year is None or key_year == year):
+                del self._entries[key]
+
+    def invalidate_categories(self):
+        self._bump("categories")
+        for key in list(self._entries):
+            if key[0] == "categories":
+                del self._entries[key]
+
+
+response_cache = ResponseCache(ttl=settings.api_cache_fallback_ttl)
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+from typing import Optional, Set
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.config import get_settings
+from app.database import database
+from app.services.cache import response_cache
+from app.services.similarity import similarity_index
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Change streams need a replica set; standalone servers reject $changeStream with this code
+CHANGE_STREAM_NOT_SUPPORTED = 40573
+
+
+class ChangeWatcher:
+    """Follow MongoDB change streams on ``images`` and ``categories``.
+
+    Every API worker runs its own watcher, so each one invalidates its own
+    response cache, and fans the same events out to connected listeners (the
+    bot subscribes through ``GET /api/v1/events``). While the stream is down the
+    cache falls back to a short TTL.
+    """
+
+    def __init__(self):
+        self.active = False
+        self._task: Optional[asyncio.Task] = None
+        self._resume_token = None
+        self._opened = False
+        self._listeners: Set[asyncio.Queue] = set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        self._set_active(False)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1000)
+        self._listeners.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._listeners.discard(queue)
+
+    def _set_active(self, active: bool):
+        changed = active != self.active
+        self.active = active
+        response_cache.ttl = settings.api_cache_ttl if active else settings.api_cache_fallback_ttl
+        similarity_index.live = active
+        if changed:
+            # Listeners size their own cache lifetimes on this
+            self._publish({"watching": active})
+
+    async def _run(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": ["images", "categories"]}}}]
+        delay = 1
+        while True:
+            try:
+                async with database.db.watch(
+                    pipeline,
+                    full_document="updateLookup",
+                    full_document_before_change="whenAvailable",
+                    resume_after=self._resume_token,
+                ) as stream:
+                    self._set_active(True)
+                    # Events may have been missed while the stream was down
+                    self._publish({"category_id": None, "year": None})
+                    if self._resume_token is None and self._opened:
+                        # Not resumed, so the index can't catch up from the stream either
+                        similarity_index.resync()
+                    self._opened = True
+                    logger.info("Watching MongoDB change streams for cache invalidation")
+                    delay = 1
+                    async for change in stream:
+                        self._resume_token = stream.resume_token
+                        if change["ns"]["coll"] == "images":
+                            similarity_index.note_change(change)
+                        for event in self._events_for(change):
+                            self._publish(event)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                self._set_active(False)
+                if e.code == CHANGE_STREAM_NOT_SUPPORTED:
+                    logger.warning("MongoDB is not a replica set; caches will expire on a short TTL instead")
+                    return
+                # The stored resume token may have rolled off the oplog
+                self._resume_token = None
+                logger.error(f"Change stream failed: {str(e)}")
+            except PyMongoError as e:
+                self._set_active(False)
+                logger.error(f"Change stream interrupted: {str(e)}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    @staticmethod
+    def _events_for(change: dict):
+        collection = change["ns"]["coll"]
+        if collection == "categories":
+            return [{"categories": True}]
+
+        events = []
+        for doc in (change.get("fullDocumentBeforeChange"), change.get("fullDocument")):
+            if doc and "category_id" in doc:
+                event = {"category_id": doc["category_id"], "year": doc.get("year")}
+                if event not in events:
+                    events.append(event)
+        # Deletes without a pre-image don't say what they touched
+        return events or [{"category_id": None, "year": None}]
+
+    def _publish(self, event: dict):
+        if event.get("categories"):
+            response_cache.invalidate_categories()
+        elif "category_id" in event:
+            response_cache.invalidate(event["category_id"], event["year"])
+        for queue in list(self._listeners):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A listener that stopped reading gets a full flush instead
+                self._drain(queue)
+                queue.put_nowait({"category_id": None, "year": None})
+
+    @staticmethod
+    def _drain(queue: asyncio.Queue):
+        while not queue.empty():
+            queue.get_nowait()
+
+
+change_watcher = ChangeWatcher()
@@ -0,0 +1,205 @@
+import base64
+import binascii
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Iterable, List, NamedTuple, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, status
+from pymongo import UpdateOne
+
+from app.config import get_settings
+from app.database import database
+from app.models import ImageMetadata
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Lines are sent in groups of this many rather than one write per line
+LINES_PER_CHUNK = 100
+
+# Sorts after every real ID, so (horizon, LAST_ID) means "everything up to the horizon"
+LAST_ID = ObjectId("f" * 24)
+
+
+class Position(NamedTuple):
+    """Where a consumer is in the feed.
+
+    ``modified_at``/``image_id`` is the last change it was sent. ``as_of`` is the
+    read horizon of the call that started its current sync. Deletes it has not
+    been sent happened after both, so the later of the two is what tombstone
+    expiry is checked against; during a multi-page pull the position can be
+    far older than ``as_of``.
+    """
+    modified_at: datetime
+    image_id: ObjectId
+    as_of: datetime
+
+
+def _millis(value: datetime) -> int:
+    return int(value.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def _from_millis(value: int) -> datetime:
+    # MongoDB keeps milliseconds, so this is exactly the stored value
+    return datetime.fromtimestamp(value / 1000, timezone.utc).replace(tzinfo=None)
+
+
+def encode_token(position: Position) -> str:
+    data = {"t": _millis(position.modified_at), "id": str(position.image_id), "a": _millis(position.as_of)}
+    raw = json.dumps(data, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_token(token: str) -> Position:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        data = json.loads(raw)
+        modified_at = _from_millis(data["t"])
+        # Tokens issued before "a" existed only know their position
+        as_of = _from_millis(data["a"]) if "a" in data else modified_at
+        return Position(modified_at, ObjectId(data["id"]), as_of)
+    except (binascii.Error, ValueError, KeyError, TypeError, InvalidId, OverflowError, OSError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid change token"
+        )
+
+
+async def record_deletions(docs: Iterable[dict]):
+    """Leave a tombstone for each deleted image so the change feed can report it.
+
+    Upserts, so repeating it for the same images (a resumed bulk delete) is harmless.
+    """
+    now = datetime.utcnow()
+    requests = [
+        UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {"modified_at": now, "category_id": doc.get("category_id"), "year": doc.get("year")}},
+            upsert=True,
+        )
+        for doc in docs
+    ]
+    if requests:
+        await database.db.image_tombstones.bulk_write(requests, ordered=False)
+
+
+async def forget_deletions(image_ids: List[ObjectId]):
+    """Drop tombstones of images that exist again (re-imported with the same ID)"""
+    await database.db.image_tombstones.delete_many({"_id": {"$in": image_ids}})
+
+
+def _after(position: Optional[Position], horizon: datetime) -> dict:
+    query = {"modified_at": {"$lte": horizon}}
+    if position is not None:
+        query["$or"] = [
+            {"modified_at": {"$gt": position.modified_at}},
+            {"modified_at": position.modified_at, "_id": {"$gt": position.image_id}},
+        ]
+    return query
+
+
+async def _next(cursor) -> Optional[dict]:
+    if cursor is None:
+        return None
+    try:
+        return await cursor.next()
+    except StopAsyncIteration:
+        return None
+
+
+def _image_line(doc: dict, token: str) -> dict:
+    doc["id"] = str(doc["_id"])
+    return {
+        "op": "insert" if doc["modified_at"] == doc.get("uploaded_at") else "update",
+        "id": doc["id"],
+        "token": token,
+        "image": ImageMetadata(**doc).model_dump(mode="json"),
+    }
+
+
+def _delete_line(doc: dict, token: str) -> dict:
+    return {
+        "op": "delete",
+        "id": str(doc["_id"]),
+        "token": token,
+        "category_id": doc.get("category_id"),
+        "year": doc.get("year"),
+    }
+
+
+def check_token_age(position: Position):
+    """Tombstones expire, so a consumer whose sync started longer ago may have missed deletes"""
+    oldest = datetime.utcnow() - timedelta(seconds=settings.change_tombstone_ttl)
+    # Deletes it hasn't been sent happened after both its position and the start of its sync
+    if max(position.modified_at, position.as_of) < oldest:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Change token is older than the tombstone history, sync again without since"
+        )
+
+
+async def stream_changes(since: Optional[Position], limit: int) -> AsyncIterator[bytes]:
+    """Yield NDJSON of up to ``limit`` changes after ``since``, oldest first.
+
+    Images and tombstones are read in (modified_at, _id) order through their
+    indexes and merged, ``change_feed_batch_size`` documents at a time, so memory
+    does not depend on how much changed. Every line carries the token to resume
+    after it; a final ``end`` line carries the token for the next call and says
+    whether ``limit`` cut the feed short. When it didn't, that token points at
+    the read horizon itself, so even a feed where nothing changed advances.
+
+    Changes younger than ``change_feed_settle`` seconds are held back: a write
+    stamped just before a read may not be visible to it yet, and must not end up
+    behind a token the consumer already has.
+    """
+    horizon = datetime.utcnow() - timedelta(seconds=settings.change_feed_settle)
+    order = [("modified_at", 1), ("_id", 1)]
+    batch_size = settings.change_feed_batch_size
+    images = database.db.images.find(_after(since, horizon), batch_size=batch_size).sort(order).limit(limit)
+    # A first full pull has no use for deletes of images it never saw
+    tombstones = None
+    if since is not None:
+        tombstones = database.db.image_tombstones.find(
+            _after(since, horizon), batch_size=batch_size
+        ).sort(order).limit(limit)
+
+    # A sync that finished its last call starts again from this read
+    as_of = since.as_of if since else horizon
+    token = encode_token(since) if since else None
+    sent = 0
+    lines: List[str] = []
+    try:
+        image = await _next(images)
+        tombstone = await _next(tombstones)
+        while sent < limit and (image is not None or tombstone is not None):
+            take_image = tombstone is None or (
+                image is not None
+                and (image["modified_at"], image["_id"]) <= (tombstone["modified_at"], tombstone["_id"])
+            )
+            doc = image if take_image else tombstone
+            token = encode_token(Position(doc["modified_at"], doc["_id"], as_of))
+            if take_image:
+                lines.append(json.dumps(_image_line(doc, token)))
+                image = await _next(images)
+            else:
+                lines.append(json.dumps(_delete_line(doc, token)))
+                tombstone = await _next(tombstones)
+            sent += 1
+            if len(lines) >= LINES_PER_CHUNK:
+                yield ("\n".join(lines) + "\n").encode()
+                lines = []
+
+        more = sent >= limit
+        if not more and (since is None or since.modified_at <= horizon):
+            # Everything up to the horizon has been sent, and settling means nothing older can still appear
+            token = encode_token(Position(horizon, LAST_ID, horizon))
+        lines.append(json.dumps({"op": "end", "token": token, "count": sent, "more": more}))
+        yield ("\n".join(lines) + "\n").encode()
+    finally:
+        # The consumer may disconnect mid-feed
+        for cursor in (images, tombstones):
+            if cursor is not None:
+                await cursor.close()
@@ -1,37 +1,110 @@
-import cloudinary
-import cloudinary.uploader
 from app.config import get_settings
+from app.services.tracing import tracer
 from fastapi import HTTPException, status
+from typing import Iterable, Iterator, List, Optional, Set
 import logging
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+_configured = False
+
 def configure_cloudinary():
+    # Imported here so the SDK is only loaded once an upload actually needs it
+    import cloudinary
+
+    global _configured
+    if not (settings.cloudinary_cloud_name and settings.cloudinary_api_key and settings.cloudinary_api_secret):
+        raise RuntimeError("Cloudinary credentials are not configured")
     cloudinary.config(
         cloud_name=settings.cloudinary_cloud_name,
         api_key=settings.cloudinary_api_key,
         api_secret=settings.cloudinary_api_secret,
         secure=True
     )
+    _configured = True
     logger.info("Cloudinary configured successfully")
 
+def _get_uploader():
+    import cloudinary.uploader
+
+    if not _configured:
+        configure_cloudinary()
+    return cloudinary.uploader
+
+def _get_admin_api():
+    import cloudinary.api
+
+    if not _configured:
+        configure_cloudinary()
+    return cloudinary.api
+
+# The Admin API accepts at most 100 public IDs per lookup or delete call
+ADMIN_BATCH_SIZE = 100
+
+def _chunks(items: List[str], size: int = ADMIN_BATCH_SIZE) -> Iterator[List[str]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def iter_cloudinary_resources(folder: str = "focus_gallery", page_size: int = 500) -> Iterator[List[dict]]:
+    """Yield the folder's image resources one API page at a time"""
+    admin_api = _get_admin_api()
+    next_cursor: Optional[str] = None
+    while True:
+        options = {"type": "upload", "resource_type": "image", "prefix": f"{folder}/", "max_results": page_size}
+        if next_cursor:
+            options["next_cursor"] = next_cursor
+        with tracer.span("cloudinary.resources", folder=folder):
+            result = admin_api.resources(**options)
+        yield result.get("resources", [])
+        next_cursor = result.get("next_cursor")
+        if not next_cursor:
+            break
+
+def find_existing_public_ids(public_ids: Iterable[str]) -> Set[str]:
+    admin_api = _get_admin_api()
+    existing = set()
+    for chunk in _chunks(list(public_ids)):
+        with tracer.span("cloudinary.resources_by_ids", count=len(chunk)):
+            result = admin_api.resources_by_ids(chunk, resource_type="image")
+        existing.update(resource["public_id"] for resource in result.get("resources", []))
+    return existing
+
+def delete_cloudinary_resources(public_ids: Iterable[str]) -> Set[str]:
+    """Delete assets in batches; returns the IDs Cloudinary no longer has"""
+    admin_api = _get_admin_api()
+    removed = set()
+    for chunk in _chunks(list(public_ids)):
+        with tracer.span("cloudinary.delete_resources", count=len(chunk)):
+            result = admin_api.delete_resources(chunk, resource_type="image")
+        removed.update(
+            public_id for public_id, outcome in result.get("deleted", {}).items()
+            if outcome in ("deleted", "not_found")
+        )
+    return removed
+
 async def upload_to_cloudinary(file_path: str, folder: str = "focus_gallery") -> dict:
+    """``file_path`` may also be an http(s) URL, which Cloudinary fetches itself"""
     try:
-        result = cloudinary.uploader.upload(
-            file_path,
-            folder=folder,
-            resource_type="image",
-            allowed_formats=["jpg", "jpeg", "png"],
-            transformation=[{"quality": "auto", "fetch_format": "auto"}]
-        )
+        with tracer.span("cloudinary.upload", folder=folder):
+            result = _get_uploader().upload(
+                file_path,
+                folder=folder,
+                resource_type="image",
+                allowed_formats=["jpg", "jpeg", "png"],
+                transformation=[{"quality": "auto", "fetch_format": "auto"}]
+            )
         return {
             "url": result.get("secure_url"),
             "public_id": result.get("public_id")
         }
     except Exception as e:
-        logger.error(f"Cloudinary upload failed: {str(e)}")
+        message = str(e)
+        if file_path.startswith(("http://", "https://")):
+            # Remote sources can carry credentials (Telegram file URLs embed the bot token)
+            message = message.replace(file_path, "<remote url>")
+        logger.error(f"Cloudinary upload failed: {message}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Image upload to Cloudinary failed"
-        )
\ No newline at end of file
+        )
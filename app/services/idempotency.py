@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from fastapi import HTTPException, status
+from pymongo.errors import DuplicateKeyError
+
+from app.config import get_settings
+from app.database import database
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+PENDING = "pending"
+COMPLETED = "completed"
+POLL_INTERVAL = 0.25
+
+# Requests waiting on a key claimed by this worker are woken directly instead of polling
+_local: Dict[str, asyncio.Event] = {}
+
+
+async def claim(key: str) -> Optional[dict]:
+    """Claim ``key`` for a new request, or return the stored result of the request that claimed it.
+
+    Returns None when the caller owns the key and must do the work, then call
+    ``complete`` or ``release``. A request that repeats one still in progress
+    waits up to ``idempotency_wait`` seconds for it to finish.
+    """
+    now = datetime.utcnow()
+    try:
+        await database.db.idempotency_keys.insert_one({"_id": key, "status": PENDING, "created_at": now})
+        _local[key] = asyncio.Event()
+        return None
+    except DuplicateKeyError:
+        pass
+
+    deadline = asyncio.get_running_loop().time() + settings.idempotency_wait
+    while True:
+        record = await database.db.idempotency_keys.find_one({"_id": key})
+        if record is None:
+            # The first attempt failed and released the key; this one takes over
+            return await claim(key)
+        if record["status"] == COMPLETED:
+            return record["response"]
+        if record["created_at"] < datetime.utcnow() - timedelta(seconds=settings.idempotency_lease):
+            # The worker holding the key died without finishing
+            taken = await database.db.idempotency_keys.find_one_and_update(
+                {"_id": key, "status": PENDING, "created_at": record["created_at"]},
+                {"$set": {"created_at": datetime.utcnow()}},
+            )
+            if taken is not None:
+                logger.warning(f"Taking over abandoned idempotency key {key}")
+                _local[key] = asyncio.Event()
+                return None
+            continue
+
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still in progress",
+                headers={"Retry-After": "5"},
+            )
+        event = _local.get(key)
+        try:
+            if event is not None:
+                await asyncio.wait_for(event.wait(), timeout=remaining)
+            else:
+                await asyncio.sleep(min(POLL_INTERVAL, remaining))
+        except asyncio.TimeoutError:
+            pass
+
+
+async def complete(key: str, response: dict):
+    """Store the result so repeats of the request get it back"""
+    await database.db.idempotency_keys.update_one(
+        {"_id": key},
+        {"$set": {"status": COMPLETED, "response": response, "created_at": datetime.utcnow()}},
+    )
+    _wake(key)
+
+
+async def discard(key: str, response: dict):
+    """Forget a stored result that no longer holds (its image was deleted or moved), so the request runs again"""
+    await database.db.idempotency_keys.delete_one(
+        {"_id": key, "status": COMPLETED, "response.id": response.get("id")}
+    )
+
+
+async def release(key: str):
+    """Give the key up after a failure so a retry does the work again"""
+    try:
+        await database.db.idempotency_keys.delete_one({"_id": key, "status": PENDING})
+    except Exception as e:
+        # The lease lets a later retry take the key over anyway
+        logger.error(f"Failed to release idempotency key {key}: {str(e)}")
+    _wake(key)
+
+
+def _wake(key: str):
+    event = _local.pop(key, None)
+    if event is not None:
+        event.set()
@@ -0,0 +1,185 @@
+import asyncio
+import itertools
+import logging
+import os
+import re
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Shared by the API middleware and the bot's handler wrapper, so it must not import app.config
+
+DEFAULT_INTERVAL = 0.005
+AWAITING = "<awaiting>"
+_STDLIB = sysconfig.get_paths()["stdlib"] + os.sep
+_NAME_RE = re.compile(r"^[0-9]+-[0-9]+-[\w.-]+\.folded$")
+
+
+class ProfileSession:
+    __slots__ = ("name", "label", "task", "loop", "thread_id", "started", "duration", "samples")
+
+    def __init__(self, name: str, label: str, task: asyncio.Task):
+        self.name = name
+        self.label = label
+        self.task = task
+        self.loop = task.get_loop()
+        self.thread_id = threading.get_ident()
+        self.started = time.monotonic()
+        self.duration = 0.0
+        self.samples: Counter = Counter()
+
+    def folded(self) -> str:
+        """Brendan Gregg's folded-stack format, readable by flamegraph.pl and speedscope"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+
+class SamplingProfiler:
+    """Wall-clock sampler for selected asyncio tasks.
+
+    A daemon thread wakes every ``interval`` seconds while at least one session
+    is open. If a profiled task is running on its loop it records the thread's
+    Python stack; if it is suspended it records the chain of awaiting coroutines
+    ending in ``<awaiting>``, so time spent waiting on Mongo or Cloudinary shows
+    up too. With no open session there is no thread and nothing to pay for.
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL):
+        self.interval = interval
+        self._sessions: Dict[asyncio.Task, ProfileSession] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._ids = itertools.count(1)
+        self._frame_names: Dict[Tuple[object, int], str] = {}
+
+    def start(self, label: str) -> ProfileSession:
+        """Begin profiling the current task"""
+        slug = re.sub(r"[^\w.-]+", "_", label).strip("_")[:60] or "profile"
+        name = f"{int(time.time() * 1000)}-{next(self._ids)}-{slug}.folded"
+        session = ProfileSession(name, label, asyncio.current_task())
+        with self._lock:
+            self._sessions[session.task] = session
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+                self._thread.start()
+        return session
+
+    def stop(self, session: ProfileSession) -> ProfileSession:
+        with self._lock:
+            self._sessions.pop(session.task, None)
+        session.duration = time.monotonic() - session.started
+        return session
+
+    def _sample_loop(self):
+        last = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            # CPU-bound code holds the GIL past the interval; weight by the time that really passed
+            now = time.monotonic()
+            weight = max(1, round((now - last) / self.interval))
+            last = now
+            with self._lock:
+                if not self._sessions:
+                    self._thread = None
+                    return
+                sessions = list(self._sessions.values())
+            frames = sys._current_frames()
+            for session in sessions:
+                try:
+                    stack = self._sample(session, frames)
+                except Exception:
+                    # The loop thread keeps running while we look; a torn read just drops the sample
+                    continue
+                session.samples[(session.label, *stack)] += weight
+
+    def _sample(self, session: ProfileSession, frames: dict) -> List[str]:
+        if asyncio.current_task(session.loop) is session.task:
+            stack = []
+            frame = frames.get(session.thread_id)
+            # Stop at the event loop's callback runner; above it is the same for every sample
+            while frame is not None and not frame.f_code.co_filename.endswith(os.path.join("asyncio", "events.py")):
+                stack.append(self._frame_name(frame.f_code, frame.f_lineno))
+                frame = frame.f_back
+            stack.reverse()
+            return stack
+
+        stack = []
+        awaitable = session.task.get_coro()
+        while awaitable is not None:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+            if frame is None:
+                break
+            stack.append(self._frame_name(frame.f_code, frame.f_lineno))
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+        stack.append(AWAITING)
+        return stack
+
+    def _frame_name(self, code, lineno: int) -> str:
+        key = (code, lineno)
+        name = self._frame_names.get(key)
+        if name is None:
+            filename = code.co_filename
+            marker = f"site-packages{os.sep}"
+            if marker in filename:
+                filename = filename.split(marker, 1)[1]
+            elif filename.startswith(_STDLIB):
+                filename = filename[len(_STDLIB):]
+            else:
+                filename = os.path.relpath(filename) if filename.startswith(os.getcwd()) else filename
+            name = self._frame_names[key] = f"{code.co_qualname} ({filename}:{lineno})"
+        return name
+
+
+class ProfileStore:
+    """Bounded on-disk ring buffer of folded-stack profiles; the oldest file goes first"""
+
+    def __init__(self, directory: str, max_profiles: int = 50):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def save(self, session: ProfileSession) -> str:
+        """Write a finished session (blocking; call it from a worker thread)"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, session.name), "w") as f:
+                f.write(session.folded())
+            for name in self._names()[:-self.max_profiles]:
+                os.remove(os.path.join(self.directory, name))
+        logger.info(
+            f"Saved profile {session.name} ({session.duration * 1000:.0f} ms, "
+            f"{sum(session.samples.values())} samples)"
+        )
+        return session.name
+
+    def list(self) -> List[dict]:
+        profiles = []
+        for name in reversed(self._names()):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            profiles.append({"name": name, "size": stat.st_size, "created_at": stat.st_mtime})
+        return profiles
+
+    def path(self, name: str) -> Optional[str]:
+        """Full path of a stored profile, or None for an unknown or unsafe name"""
+        if not _NAME_RE.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    def _names(self) -> List[str]:
+        try:
+            names = [name for name in os.listdir(self.directory) if _NAME_RE.match(name)]
+        except FileNotFoundError:
+            return []
+        # Names start with a millisecond timestamp and a sequence number
+        return sorted(names, key=lambda name: tuple(int(part) for part in name.split("-", 2)[:2]))
+
+
+profiler = SamplingProfiler()
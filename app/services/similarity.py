@@ -0,0 +1,314 @@
+"""In-memory index of perceptual hashes for "more like this" and duplicate checks.
+
+Every image with a ``phash`` is held per category in parallel arrays: the
+hashes as uint64 and the ObjectIds split into a uint32 and a uint64 (20 bytes
+per image, so 1M images take about 20 MB). A query XORs the target with the whole category
+and counts bits in one vectorized pass. The index is loaded once at startup;
+this worker's uploads, deletes and moves update it directly, and other writers
+reach it through the change stream. Without change streams it is rebuilt every
+``similarity_refresh_interval`` seconds, and when the stream restarts without a
+resume token (so events were lost) it is rebuilt right away.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+
+from app.config import get_settings
+from app.database import database
+from app.services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+LOAD_BATCH_SIZE = 10000
+CHANGE_DELAY = 0.2  # seconds of change events applied as one batch
+SCAN_REMOVALS = 8  # up to this many IDs are found by comparing directly rather than by binary search
+
+if np is not None:
+    _M1, _M2, _M4, _H01 = (
+        np.uint64(mask) for mask in (0x5555555555555555, 0x3333333333333333, 0x0F0F0F0F0F0F0F0F, 0x0101010101010101)
+    )
+
+
+def hamming_distances(hashes: "np.ndarray", target: int) -> "np.ndarray":
+    """Bits differing between each uint64 in ``hashes`` and ``target``"""
+    diff = np.bitwise_xor(hashes, np.uint64(target & 0xFFFFFFFFFFFFFFFF))
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(diff)
+    # numpy < 2.0: SWAR popcount, in place on the fresh XOR result
+    shifted = diff >> np.uint64(1)
+    shifted &= _M1
+    diff -= shifted
+    shifted = diff >> np.uint64(2)
+    shifted &= _M2
+    diff &= _M2
+    diff += shifted
+    diff += diff >> np.uint64(4)
+    diff &= _M4
+    diff *= _H01
+    diff >>= np.uint64(56)
+    return diff.astype(np.uint8)
+
+
+def _split(image_ids: List[ObjectId]) -> Tuple["np.ndarray", "np.ndarray"]:
+    """ObjectIds as (4-byte timestamps, 8-byte remainders), so lookups compare integers"""
+    raw = np.frombuffer(b"".join(oid.binary for oid in image_ids), dtype=np.uint8).reshape(-1, 12)
+    return raw[:, :4].copy().view(">u4").ravel().astype(np.uint32), raw[:, 4:].copy().view(">u8").ravel().astype(np.uint64)
+
+
+def _join(stamp, tail) -> ObjectId:
+    return ObjectId(int(stamp).to_bytes(4, "big") + int(tail).to_bytes(8, "big"))
+
+
+class HashArray:
+    """One category's hashes and image IDs in parallel arrays, grown by doubling"""
+
+    __slots__ = ("hashes", "stamps", "tails", "size")
+
+    def __init__(self, capacity: int = 1024):
+        self.hashes = np.empty(capacity, dtype=np.uint64)
+        self.stamps = np.empty(capacity, dtype=np.uint32)
+        self.tails = np.empty(capacity, dtype=np.uint64)
+        self.size = 0
+
+    def add(self, image_ids: List[ObjectId], hashes: List[int]):
+        """Append images that aren't in the array yet"""
+        if not image_ids:
+            return
+        stamps, tails = _split(image_ids)
+        needed = self.size + len(image_ids)
+        if needed > len(self.hashes):
+            capacity = max(needed, 2 * len(self.hashes))
+            for name in self.__slots__[:3]:
+                column = getattr(self, name)
+                grown = np.empty(capacity, dtype=column.dtype)
+                grown[:self.size] = column[:self.size]
+                setattr(self, name, grown)
+        self.hashes[self.size:needed] = np.array(hashes, dtype=np.int64).view(np.uint64)
+        self.stamps[self.size:needed] = stamps
+        self.tails[self.size:needed] = tails
+        self.size = needed
+
+    def remove(self, image_ids: List[ObjectId]) -> List[Tuple[ObjectId, int]]:
+        """Drop the given images; returns the (image_id, phash) pairs that were present"""
+        if not image_ids or not self.size:
+            return []
+        stamps, tails = _split(image_ids)
+        if len(tails) <= SCAN_REMOVALS:
+            mask = np.zeros(self.size, dtype=bool)
+            for stamp, tail in zip(stamps, tails):
+                hits = self.tails[:self.size] == tail
+                hits[hits] = self.stamps[:self.size][hits] == stamp
+                mask |= hits
+        else:
+            order = np.argsort(tails)
+            stamps, tails = stamps[order], tails[order]
+            # One binary search per stored image against the sorted IDs to remove
+            positions = np.minimum(np.searchsorted(tails, self.tails[:self.size]), len(tails) - 1)
+            mask = tails[positions] == self.tails[:self.size]
+            mask[mask] = stamps[positions[mask]] == self.stamps[:self.size][mask]
+        if not mask.any():
+            return []
+        removed = [
+            (_join(stamp, tail), int(value))
+            for stamp, tail, value in zip(
+                self.stamps[:self.size][mask], self.tails[:self.size][mask], self.hashes[:self.size][mask].view(np.int64)
+            )
+        ]
+        keep = ~mask
+        kept = int(keep.sum())
+        for name in self.__slots__[:3]:
+            column = getattr(self, name)
+            column[:kept] = column[:self.size][keep]
+        self.size = kept
+        return removed
+
+    def search(
+        self, target: int, max_distance: int, limit: int, exclude: Optional[ObjectId] = None
+    ) -> List[Tuple[ObjectId, int]]:
+        distances = hamming_distances(self.hashes[:self.size], target)
+        candidates = np.flatnonzero(distances <= max_distance)
+        if exclude is not None:
+            stamp, tail = _split([exclude])
+            candidates = candidates[(self.tails[candidates] != tail[0]) | (self.stamps[candidates] != stamp[0])]
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(distances[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(distances[candidates], kind="stable")]
+        return [(_join(self.stamps[index], self.tails[index]), int(distances[index])) for index in candidates]
+
+
+Change = Tuple[List[ObjectId], List[Tuple[str, ObjectId, int]]]  # (removed, added)
+
+
+class SimilarityIndex:
+    def __init__(self):
+        self._categories: Dict[str, "HashArray"] = {}
+        self.ready = False
+        # Set by the change watcher; while False the index is rebuilt periodically instead
+        self.live = False
+        self._replay: Optional[List[Change]] = None
+        self._pending: List[Change] = []
+        self._drain_handle: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stale = False
+        self._wakeup = asyncio.Event()
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    def start(self):
+        if self.available and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def __len__(self) -> int:
+        return sum(hashes.size for hashes in self._categories.values())
+
+    # ---- updates ----
+
+    def apply(self, removed: Iterable[ObjectId] = (), added: Iterable[Tuple[str, ObjectId, int]] = ()):
+        """Remove images and add ``(category_id, image_id, phash)``; repeating a change is harmless"""
+        if not self.available:
+            return
+        change = (list(removed), list(added))
+        self._apply(self._categories, change)
+        if self._replay is not None:
+            self._replay.append(change)
+
+    def move(self, image_ids: Iterable[ObjectId], category_id: str):
+        """Re-file images under another category, keeping their hashes"""
+        if not self.available:
+            return
+        image_ids = list(image_ids)
+        moved = []
+        for hashes in self._categories.values():
+            moved += hashes.remove(image_ids)
+        self.apply(added=[(category_id, oid, phash) for oid, phash in moved])
+
+    def resync(self):
+        """Changes were missed (the change stream lost its place); reload everything from MongoDB"""
+        if not self.available:
+            return
+        self._stale = True
+        self._wakeup.set()
+
+    def note_change(self, change: dict):
+        """Queue a change stream event on ``images``; events are applied in batches"""
+        if not self.available:
+            return
+        doc = change.get("fullDocument")
+        oid = change.get("documentKey", {}).get("_id")
+        if oid is None:
+            return
+        added = [(doc["category_id"], oid, doc["phash"])] if doc and doc.get("phash") is not None else []
+        self._pending.append(([oid], added))
+        if self._drain_handle is None:
+            self._drain_handle = asyncio.get_running_loop().call_later(CHANGE_DELAY, self._drain)
+
+    def _drain(self):
+        self._drain_handle = None
+        changes, self._pending = self._pending, []
+        # Later events for an image win over earlier ones
+        latest = {}
+        for removed, added in changes:
+            latest[removed[0]] = added
+        self.apply(latest.keys(), [entry for added in latest.values() for entry in added])
+
+    @staticmethod
+    def _apply(categories: Dict[str, "HashArray"], change: Change):
+        removed, added = change
+        # Removing what is about to be added makes repeats and moves between categories harmless
+        image_ids = list(removed) + [oid for _, oid, _ in added]
+        if image_ids:
+            for hashes in categories.values():
+                hashes.remove(image_ids)
+        by_category: Dict[str, Tuple[list, list]] = {}
+        for category_id, oid, phash in added:
+            column_ids, column_hashes = by_category.setdefault(category_id, ([], []))
+            column_ids.append(oid)
+            column_hashes.append(phash)
+        for category_id, (column_ids, column_hashes) in by_category.items():
+            categories.setdefault(category_id, HashArray()).add(column_ids, column_hashes)
+
+    # ---- loading ----
+
+    async def rebuild(self):
+        """Read every hash from MongoDB; changes made meanwhile are replayed on the new arrays"""
+        started = time.monotonic()
+        self._replay = []
+        try:
+            categories: Dict[str, HashArray] = {}
+            columns: Dict[str, Tuple[list, list]] = {}
+
+            def flush(category_id: str):
+                categories.setdefault(category_id, HashArray()).add(*columns.pop(category_id))
+
+            with tracer.span("similarity.rebuild"):
+                cursor = database.db.images.find(
+                    {"phash": {"$ne": None}}, {"category_id": 1, "phash": 1}, batch_size=LOAD_BATCH_SIZE
+                )
+                async for doc in cursor:
+                    column_ids, column_hashes = columns.setdefault(doc["category_id"], ([], []))
+                    column_ids.append(doc["_id"])
+                    column_hashes.append(doc["phash"])
+                    if len(column_ids) >= LOAD_BATCH_SIZE:
+                        flush(doc["category_id"])
+                for category_id in list(columns):
+                    flush(category_id)
+            for change in self._replay:
+                self._apply(categories, change)
+            self._categories = categories
+            self.ready = True
+        finally:
+            self._replay = None
+        logger.info(
+            f"Similarity index loaded {len(self)} hashes in {len(self._categories)} categories "
+            f"in {(time.monotonic() - started) * 1000:.0f} ms"
+        )
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self.ready or not self.live or self._stale:
+                stale, self._stale = self._stale, False
+                try:
+                    await self.rebuild()
+                except PyMongoError as e:
+                    logger.error(f"Similarity index load failed: {str(e)}")
+                    if not self.ready or stale:
+                        self._stale = self._stale or stale
+                        await asyncio.sleep(30)
+                        continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.similarity_refresh_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    # ---- queries ----
+
+    def search(
+        self, category_id: str, phash: int, max_distance: int, limit: int, exclude: Optional[ObjectId] = None
+    ) -> List[Tuple[ObjectId, int]]:
+        """Images of a category within ``max_distance`` bits of ``phash``, closest first"""
+        hashes = self._categories.get(category_id)
+        if hashes is None or not hashes.size:
+            return []
+        return hashes.search(phash, max_distance, limit, exclude)
+
+
+# Shared instance, loaded at startup
+similarity_index = SimilarityIndex()
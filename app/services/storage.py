@@ -0,0 +1,335 @@
+"""Where image files live.
+
+Image documents keep the storage key in ``cloudinary_id`` (the field predates
+other backends) and the backend's name in ``storage``; documents without it
+are on Cloudinary. ``settings.storage_backend`` picks the backend new uploads
+go to, so existing images keep working after a switch.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+import httpx
+from fastapi import HTTPException, status
+
+from app.config import get_settings
+from app.database import database
+from app.services.cloudinary import (
+    delete_cloudinary_resources,
+    find_existing_public_ids,
+    iter_cloudinary_resources,
+    upload_to_cloudinary,
+)
+from app.services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+HASH_CHUNK_SIZE = 1024 * 1024
+REMOTE_FETCH_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+ASIDE_PREFIX = ".del-"
+
+
+class StorageBackend:
+    """Blocking methods (``delete``, ``existing``, ``iter_objects``) are meant for
+    ``asyncio.to_thread`` or the CLI, like the Cloudinary Admin API calls they wrap."""
+
+    name = ""
+    # Identical uploads share one stored file, so deleting one image's file needs a reference check
+    shares_files = False
+
+    async def save(self, file_path: str) -> dict:
+        """Store a file; returns ``{"url", "key"}``"""
+        raise NotImplementedError
+
+    async def save_remote(self, url: str, suffix: str) -> dict:
+        """Store the file at ``url``. This default streams it through a temporary
+        file; backends that can fetch URLs themselves override it."""
+        fd, temp_path = tempfile.mkstemp(suffix=suffix)
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                with tracer.span("storage.fetch_remote"):
+                    async with httpx.AsyncClient(timeout=REMOTE_FETCH_TIMEOUT) as client:
+                        async with client.stream("GET", url) as response:
+                            response.raise_for_status()
+                            async for chunk in response.aiter_bytes():
+                                temp_file.write(chunk)
+            return await self.save(temp_path)
+        except httpx.HTTPError as e:
+            # The message would contain the URL, which may carry credentials
+            logger.error(f"Remote fetch failed: {type(e).__name__}")
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail="Could not fetch the remote file"
+            )
+        finally:
+            os.remove(temp_path)
+
+    async def read(self, key: str, url: str, client: httpx.AsyncClient) -> bytes:
+        raise NotImplementedError
+
+    def delete(self, keys: Iterable[str], referenced: Optional[Callable[[List[str]], Set[str]]] = None) -> Set[str]:
+        """Returns the keys that need no retry: deleted, already gone, or kept because
+        ``referenced`` says an image still uses them. Backends that share files call it
+        once the files can no longer be reused; see ``delete_unreferenced``."""
+        raise NotImplementedError
+
+    def recover(self, min_age: float) -> int:
+        """Undo deletes interrupted more than ``min_age`` seconds ago; returns the files put back"""
+        return 0
+
+    def existing(self, keys: Iterable[str]) -> Set[str]:
+        raise NotImplementedError
+
+    def iter_objects(self, page_size: int = 500) -> Iterator[List[dict]]:
+        """Yield ``{"key", "created_at"}`` pages of everything stored"""
+        raise NotImplementedError
+
+
+class CloudinaryStorage(StorageBackend):
+    name = "cloudinary"
+
+    def __init__(self, folder: str = "focus_gallery"):
+        self.folder = folder
+
+    async def save(self, file_path: str) -> dict:
+        result = await upload_to_cloudinary(file_path, self.folder)
+        return {"url": result["url"], "key": result["public_id"]}
+
+    async def save_remote(self, url: str, suffix: str) -> dict:
+        # Cloudinary downloads the file itself, so no image bytes pass through the API
+        result = await upload_to_cloudinary(url, self.folder)
+        return {"url": result["url"], "key": result["public_id"]}
+
+    async def read(self, key: str, url: str, client: httpx.AsyncClient) -> bytes:
+        with tracer.span("cloudinary.fetch_original"):
+            # Read the stream ourselves: a body cached on the Response would live until the
+            # next garbage collection
+            async with client.stream("GET", url) as response:
+                response.raise_for_status()
+                return b"".join([chunk async for chunk in response.aiter_bytes()])
+
+    def delete(self, keys: Iterable[str], referenced: Optional[Callable[[List[str]], Set[str]]] = None) -> Set[str]:
+        # Every upload gets its own public ID, so nothing else can start using these
+        return delete_cloudinary_resources(keys)
+
+    def existing(self, keys: Iterable[str]) -> Set[str]:
+        return find_existing_public_ids(keys)
+
+    def iter_objects(self, page_size: int = 500) -> Iterator[List[dict]]:
+        for resources in iter_cloudinary_resources(self.folder, page_size):
+            yield [
+                {
+                    "key": resource["public_id"],
+                    "created_at": datetime.fromisoformat(resource["created_at"].replace("Z", "+00:00")),
+                }
+                for resource in resources
+            ]
+
+
+# <2 hex>/<2 hex>/<sha256><ext>; anything else is rejected before touching the disk
+LOCAL_KEY = re.compile(r"^([0-9a-f]{2})/([0-9a-f]{2})/(\1\2[0-9a-f]{60})(\.[a-z0-9]{1,5})$")
+
+
+class LocalStorage(StorageBackend):
+    """Files under ``root`` at content-addressed paths, served by ``/media``.
+
+    A file's key is the SHA-256 of its content, so it never changes once written
+    (which lets ``/media`` cache it forever) and identical uploads share one file.
+    Callers must therefore only delete keys no image document references.
+    """
+
+    name = "local"
+    shares_files = True
+
+    def __init__(self, root: str, base_url: str):
+        self.root = Path(root)
+        self.base_url = base_url.rstrip("/")
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/media/{key}"
+
+    def path(self, key: str) -> Optional[Path]:
+        """Filesystem path of a key, or None if it isn't a valid key"""
+        if not LOCAL_KEY.match(key):
+            return None
+        return self.root / key
+
+    def _store(self, file_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        hex_digest = digest.hexdigest()
+        ext = os.path.splitext(file_path)[1].lower()
+        ext = ".jpg" if ext in ("", ".jpeg") else ext
+        key = f"{hex_digest[:2]}/{hex_digest[2:4]}/{hex_digest}{ext}"
+        destination = self.root / key
+        if destination.exists():
+            try:
+                # Reusing the file counts as writing it, so reconcile doesn't take it for an old orphan
+                os.utime(destination)
+                return key
+            except FileNotFoundError:
+                # Deleted since the check; write it again
+                pass
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        # Copy next to the destination and rename, so a reader never sees a partial file
+        fd, temp_path = tempfile.mkstemp(dir=destination.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as temp_file, open(file_path, "rb") as source:
+                shutil.copyfileobj(source, temp_file, HASH_CHUNK_SIZE)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, destination)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return key
+
+    async def save(self, file_path: str) -> dict:
+        try:
+            with tracer.span("storage.local_save"):
+                key = await asyncio.to_thread(self._store, file_path)
+        except OSError as e:
+            logger.error(f"Local storage write failed: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Image upload to local storage failed"
+            )
+        return {"url": self.url(key), "key": key}
+
+    async def read(self, key: str, url: str, client: httpx.AsyncClient) -> bytes:
+        path = self.path(key)
+        if path is None:
+            raise FileNotFoundError(key)
+        with tracer.span("storage.local_read"):
+            return await asyncio.to_thread(path.read_bytes)
+
+    def delete(self, keys: Iterable[str], referenced: Optional[Callable[[List[str]], Set[str]]] = None) -> Set[str]:
+        removed = set()
+        aside = {}
+        for key in keys:
+            path = self.path(key)
+            if path is None:
+                continue
+            # Moved aside first, so no upload can reuse the file while references are checked:
+            # one that finds it gone writes it again, and one that reused it earlier has either
+            # saved its image by the time ``referenced`` runs or checks the file after saving
+            moved = path.with_name(f"{ASIDE_PREFIX}{path.name}")
+            try:
+                os.rename(path, moved)
+            except FileNotFoundError:
+                removed.add(key)
+                continue
+            except OSError as e:
+                logger.error(f"Failed to delete {key}: {str(e)}")
+                continue
+            aside[key] = (path, moved)
+        try:
+            keep = referenced(list(aside)) if referenced and aside else set()
+        except BaseException:
+            for path, moved in aside.values():
+                os.replace(moved, path)
+            raise
+        for key, (path, moved) in aside.items():
+            try:
+                if key in keep:
+                    logger.info(f"Keeping {key}: another image uses the same file")
+                    os.replace(moved, path)
+                else:
+                    os.remove(moved)
+            except OSError as e:
+                logger.error(f"Failed to delete {key}: {str(e)}")
+                continue
+            removed.add(key)
+        return removed
+
+    def recover(self, min_age: float) -> int:
+        """Put back files a crashed delete left set aside, so reconcile checks them like any other"""
+        cutoff = time.time() - min_age
+        recovered = 0
+        for directory, _, files in os.walk(self.root):
+            for filename in files:
+                if not filename.startswith(ASIDE_PREFIX):
+                    continue
+                moved = Path(directory, filename)
+                path = moved.with_name(filename[len(ASIDE_PREFIX):])
+                if not LOCAL_KEY.match(path.relative_to(self.root).as_posix()):
+                    continue
+                try:
+                    # The rename set ctime; a delete in progress holds its files for one query only
+                    if os.stat(moved).st_ctime > cutoff:
+                        continue
+                    os.replace(moved, path)
+                except FileNotFoundError:
+                    continue
+                recovered += 1
+        return recovered
+
+    def existing(self, keys: Iterable[str]) -> Set[str]:
+        return {key for key in keys if (path := self.path(key)) is not None and path.is_file()}
+
+    def iter_objects(self, page_size: int = 500) -> Iterator[List[dict]]:
+        page = []
+        for directory, _, files in os.walk(self.root):
+            for filename in files:
+                key = Path(directory, filename).relative_to(self.root).as_posix()
+                if not LOCAL_KEY.match(key):
+                    continue
+                try:
+                    mtime = os.stat(os.path.join(directory, filename)).st_mtime
+                except FileNotFoundError:
+                    continue
+                page.append({"key": key, "created_at": datetime.fromtimestamp(mtime, timezone.utc)})
+                if len(page) >= page_size:
+                    yield page
+                    page = []
+        if page:
+            yield page
+
+
+_backends: Dict[str, StorageBackend] = {}
+
+
+async def referenced_keys(keys: Iterable[str]) -> Set[str]:
+    """Storage keys at least one image document uses"""
+    return set(await database.db.images.distinct("cloudinary_id", {"cloudinary_id": {"$in": list(keys)}}))
+
+
+async def delete_unreferenced(storage: StorageBackend, keys: Iterable[str]) -> Set[str]:
+    """``storage.delete`` on a worker thread; files shared between uploads are kept if an
+    image still uses them once they are set aside"""
+    loop = asyncio.get_running_loop()
+
+    def referenced(candidates: List[str]) -> Set[str]:
+        return asyncio.run_coroutine_threadsafe(referenced_keys(candidates), loop).result()
+
+    return await asyncio.to_thread(storage.delete, list(keys), referenced if storage.shares_files else None)
+
+
+def get_storage(name: Optional[str] = None) -> StorageBackend:
+    """The backend called ``name``; the configured one for new uploads by default"""
+    name = name or settings.storage_backend
+    if name not in _backends:
+        if name == "cloudinary":
+            _backends[name] = CloudinaryStorage()
+        elif name == "local":
+            _backends[name] = LocalStorage(settings.local_storage_dir, settings.public_base_url)
+        else:
+            raise ValueError(f"Unknown storage backend: {name}")
+    return _backends[name]
+
+
+def storage_filter(name: str) -> dict:
+    """Query matching image documents kept by the named backend"""
+    if name == "cloudinary":
+        return {"storage": {"$in": [None, "cloudinary"]}}
+    return {"storage": name}
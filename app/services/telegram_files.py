@@ -0,0 +1,68 @@
+import logging
+
+import httpx
+from fastapi import HTTPException, status
+
+from app.config import get_settings
+from app.services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+GET_FILE_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+
+
+async def resolve_file(file_id: str) -> dict:
+    """Turn a Telegram file_id into ``{"url", "file_path", "file_size"}``.
+
+    The download URL embeds the bot token and stays valid for about an hour,
+    so it is only handed to the storage backend and never logged or returned.
+    """
+    api_url = settings.telegram_api_url.rstrip("/")
+    try:
+        with tracer.span("telegram.get_file"):
+            async with httpx.AsyncClient(timeout=GET_FILE_TIMEOUT) as client:
+                response = await client.get(
+                    f"{api_url}/bot{settings.bot_token}/getFile", params={"file_id": file_id}
+                )
+        body = response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        logger.error(f"Telegram getFile failed: {type(e).__name__}")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Could not reach Telegram to resolve the file"
+        )
+    if not body.get("ok") or not body.get("result", {}).get("file_path"):
+        logger.warning(f"Telegram getFile rejected {file_id}: {body.get('description')}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Telegram file not found or too big to download"
+        )
+    result = body["result"]
+    return {
+        "url": f"{api_url}/file/bot{settings.bot_token}/{result['file_path']}",
+        "file_path": result["file_path"],
+        "file_size": result.get("file_size"),
+    }
+
+
+async def download_file(file_id: str, max_bytes: int) -> bytes:
+    """Fetch a (small) Telegram file into memory, e.g. a thumbnail to hash"""
+    remote = await resolve_file(file_id)
+    if remote["file_size"] and remote["file_size"] > max_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File size exceeds 8 MB limit"
+        )
+    try:
+        with tracer.span("telegram.download_file"):
+            async with httpx.AsyncClient(timeout=GET_FILE_TIMEOUT) as client:
+                response = await client.get(remote["url"])
+                response.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.error(f"Telegram file download failed: {type(e).__name__}")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Could not download the file from Telegram"
+        )
+    return response.content
@@ -0,0 +1,215 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from typing import Dict, Iterator, List, Optional
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Shared by the API and the bot (each process configures the tracer once), so it must not import app.config
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+EXPORT_BATCH_SIZE = 200
+EXPORT_QUEUE_SIZE = 10000
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "sampled", "start", "end", "attributes", "error")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, sampled: bool, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.sampled = sampled
+        self.start = time.time()
+        self.end = 0.0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        """W3C trace context header for calls made under this span"""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self, service: str) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": service,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round((self.end - self.start) * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class SpanExporter:
+    """Hands finished spans to a writer thread in batches so request paths never block on I/O"""
+
+    def __init__(self, target: str):
+        self.target = target
+        self.dropped = 0
+        self._queue: "queue.Queue[dict]" = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: dict):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.error(f"Failed to export {len(batch)} spans to {self.target}: {str(e)}")
+
+    def _write(self, batch: List[dict]):
+        if self.target.startswith(("http://", "https://")):
+            request = urllib.request.Request(
+                self.target,
+                data=json.dumps(batch).encode(),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            urllib.request.urlopen(request, timeout=5).close()
+        else:
+            with open(self.target, "a") as f:
+                f.writelines(json.dumps(span) + "\n" for span in batch)
+
+
+class Tracer:
+    """Minimal W3C-trace-context tracer.
+
+    A trace starts at a Telegram update (or an incoming request without a
+    ``traceparent``), is sampled once at its root, and the decision travels with
+    the header. Spans under an unsampled root are never created, so tracing off
+    costs a context variable lookup per instrumented call.
+    """
+
+    def __init__(self):
+        self.service = "unknown"
+        self.sample_rate = 0.0
+        self.exporter: Optional[SpanExporter] = None
+
+    def configure(self, service: str, export_target: Optional[str], sample_rate: float):
+        self.service = service
+        self.sample_rate = sample_rate if export_target else 0.0
+        self.exporter = SpanExporter(export_target) if export_target else None
+
+    @staticmethod
+    def current() -> Optional[Span]:
+        return _current.get()
+
+    @contextlib.contextmanager
+    def trace(self, name: str, traceparent: Optional[str] = None, **attributes) -> Iterator[Optional[Span]]:
+        """Root span for one unit of work, continuing the caller's trace when a header is given"""
+        match = _TRACEPARENT_RE.match(traceparent) if traceparent else None
+        if match:
+            trace_id, parent_id, flags = match.groups()
+            sampled = bool(int(flags, 16) & 1) and self.exporter is not None
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        span = Span(trace_id, parent_id, name, sampled, attributes)
+        with self._activate(span):
+            yield span
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        """Child of the current span; does nothing outside a sampled trace"""
+        parent = _current.get()
+        if parent is None or not parent.sampled:
+            yield None
+            return
+        with self._activate(Span(parent.trace_id, parent.span_id, name, True, attributes)) as span:
+            yield span
+
+    def start_span(self, name: str, parent: Span, **attributes) -> Span:
+        """Span that is ended explicitly with ``finish`` and never becomes current"""
+        return Span(parent.trace_id, parent.span_id, name, True, attributes)
+
+    def finish(self, span: Span, error: Optional[str] = None):
+        span.end = time.time()
+        span.error = error
+        if span.sampled and self.exporter is not None:
+            self.exporter.export(span.to_dict(self.service))
+
+    def traceparent(self) -> Optional[str]:
+        span = _current.get()
+        return span.traceparent if span is not None else None
+
+    @contextlib.contextmanager
+    def _activate(self, span: Span) -> Iterator[Span]:
+        token = _current.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            self.finish(span, error)
+
+
+class MongoCommandTracer(monitoring.CommandListener):
+    """Span per MongoDB command. Motor runs pymongo on an executor but copies the
+    caller's context, so the current span is visible in ``started``."""
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        self._spans: Dict[tuple, Span] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        parent = self.tracer.current()
+        if parent is None or not parent.sampled:
+            return
+        target = event.command.get(event.command_name)
+        span = self.tracer.start_span(
+            f"mongo.{event.command_name}",
+            parent,
+            database=event.database_name,
+            collection=target if isinstance(target, str) else None,
+        )
+        with self._lock:
+            self._spans[(event.request_id, event.connection_id)] = span
+
+    def succeeded(self, event):
+        self._end(event, None)
+
+    def failed(self, event):
+        self._end(event, str(event.failure.get("errmsg", event.failure)))
+
+    def _end(self, event, error: Optional[str]):
+        with self._lock:
+            span = self._spans.pop((event.request_id, event.connection_id), None)
+        if span is not None:
+            self.tracer.finish(span, error)
+
+
+tracer = Tracer()
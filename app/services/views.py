@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from app.config import get_settings
+from app.database import database
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class ViewCounter:
+    """Write-behind view counts.
+
+    Views are summed in memory per image and flushed every ``flush_interval``
+    seconds as one unordered ``bulk_write`` of ``$inc`` upserts into
+    ``image_views``, so recording a view never touches MongoDB. Each API worker
+    flushes its own counts; ``$inc`` makes them add up. A failed flush keeps its
+    counts for the next one, and at most ``max_pending`` images are held.
+    """
+
+    def __init__(self, flush_interval: float, max_pending: int):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        # image id -> [count, category_id, year]
+        self._pending: Dict[ObjectId, list] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Task] = None
+
+    def record(self, image_id: str, category_id: str, year: int, count: int = 1) -> bool:
+        try:
+            oid = ObjectId(image_id)
+        except (InvalidId, TypeError):
+            return False
+        self._add(oid, count, category_id, year)
+        return True
+
+    def _add(self, oid: ObjectId, count: int, category_id: str, year: int):
+        entry = self._pending.get(oid)
+        if entry is not None:
+            entry[0] += count
+        elif len(self._pending) < self.max_pending:
+            self._pending[oid] = [count, category_id, year]
+        else:
+            self.dropped += count
+
+    async def flush(self) -> int:
+        """Write pending counts; returns how many images were updated"""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        items = list(pending.items())
+        requests = [
+            # category/year only describe a new counter; bulk moves keep existing ones current
+            UpdateOne(
+                {"_id": oid},
+                {"$inc": {"views": count}, "$setOnInsert": {"category_id": category_id, "year": year}},
+                upsert=True,
+            )
+            for oid, (count, category_id, year) in items
+        ]
+        try:
+            await database.db.image_views.bulk_write(requests, ordered=False)
+            return len(requests)
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            logger.error(f"View flush: {len(failed)} of {len(requests)} counters failed")
+            retry = [items[index] for index in failed]
+        except PyMongoError as e:
+            logger.error(f"View flush failed, keeping {len(items)} counters for the next one: {str(e)}")
+            retry = items
+        for oid, (count, category_id, year) in retry:
+            self._add(oid, count, category_id, year)
+        return 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._flushing:
+            # Cancelling a flush mid-write would lose the counts it has taken out of _pending
+            await asyncio.gather(self._flushing, return_exceptions=True)
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self._flushing = asyncio.create_task(self.flush())
+            try:
+                # Shielded so stopping waits for the flush instead of cutting it off
+                await asyncio.shield(self._flushing)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"View flush failed: {str(e)}")
+
+
+async def forget_views(image_ids: List[ObjectId]):
+    """Drop counters of deleted images"""
+    await database.db.image_views.delete_many({"_id": {"$in": image_ids}})
+
+
+async def move_views(image_ids: List[ObjectId], target: dict):
+    """Keep counters under the category/year their images moved to"""
+    await database.db.image_views.update_many({"_id": {"$in": image_ids}}, {"$set": target})
+
+
+view_counter = ViewCounter(settings.view_flush_interval, settings.view_max_pending)
@@ -0,0 +1,440 @@
+"""Replay synthetic users through the bot's real conversation handlers.
+
+Builds the Application from ``bot.main.build_application`` and points it at two
+local stand-ins running in a background thread: a fake Telegram Bot API and a
+fake backend. Each synthetic user walks /browse -> category -> year -> pages, or
+(for a share of admin users) /upload -> category -> year -> photo -> stop.
+Browsing users also subscribe to their category, so every finished upload
+batch is broadcast to them.
+
+Reports update throughput, per-step handler latency percentiles, send-queue
+latency and memory growth:
+
+    python -m benchmarks.bot_load --users 2000 --concurrency 200
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List
+
+TOKEN = "123456:LOADTEST"
+CATEGORIES = [{"id": "easter", "name": "Easter"}, {"id": "gc-day", "name": "GC day"}]
+YEARS = [2024, 2023]
+IMAGES_PER_YEAR = 40
+PHOTO_BYTES = b"\xff\xd8\xff\xe0" + b"\x00" * 2048 + b"\xff\xd9"
+
+
+# ---- stand-in services ----
+
+def fake_backend_app(latency: float):
+    from fastapi import FastAPI, HTTPException, Request
+
+    app = FastAPI()
+
+    async def pause():
+        if latency:
+            await asyncio.sleep(latency)
+
+    @app.get("/api/v1/categories/")
+    async def categories():
+        await pause()
+        return CATEGORIES
+
+    @app.get("/api/v1/images/years")
+    async def years(category: str):
+        await pause()
+        return YEARS
+
+    @app.get("/api/v1/images/facets")
+    async def facets():
+        await pause()
+        return [
+            {"category_id": cat["id"], "year": year, "count": IMAGES_PER_YEAR, "tags": []}
+            for cat in CATEGORIES for year in YEARS
+        ]
+
+    @app.get("/api/v1/images")
+    async def images(category: str, year: int, page: int = 1, per_page: int = 5):
+        await pause()
+        start = (page - 1) * per_page
+        items = [
+            {
+                "id": f"{index:024x}",
+                "url": f"https://example.invalid/{category}/{year}/{index}.jpg",
+                "cloudinary_id": f"focus_gallery/{category}-{year}-{index}",
+                "category_id": category,
+                "year": year,
+                "tags": [],
+                "uploaded_by": 1,
+                "uploaded_at": "2024-04-01T00:00:00",
+            }
+            for index in range(start, min(start + per_page, IMAGES_PER_YEAR))
+        ]
+        return {"total_count": IMAGES_PER_YEAR, "page": page, "per_page": per_page, "items": items}
+
+    @app.post("/api/v1/images/")
+    async def upload(request: Request):
+        form = await request.form()
+        await form["file"].read()
+        await pause()
+        return {
+            "id": "0" * 24, "url": "https://example.invalid/new.jpg", "cloudinary_id": "focus_gallery/new",
+            "category_id": form["category"], "year": int(form["year"]), "tags": [],
+            "uploaded_by": int(form["uploaded_by"]), "uploaded_at": "2024-04-01T00:00:00",
+        }
+
+    @app.post("/api/v1/images/remote")
+    async def upload_remote(request: Request):
+        body = await request.json()
+        await pause()
+        return {
+            "id": "0" * 24, "url": "https://example.invalid/new.jpg", "cloudinary_id": "focus_gallery/new",
+            "category_id": body["category"], "year": body["year"], "tags": [],
+            "uploaded_by": body["uploaded_by"], "uploaded_at": "2024-04-01T00:00:00",
+        }
+
+    subscriptions: Dict[str, set] = defaultdict(set)
+    broadcasts: Dict[str, dict] = {}
+
+    @app.put("/api/v1/subscriptions/")
+    async def subscribe(request: Request):
+        body = await request.json()
+        created = body["chat_id"] not in subscriptions[body["category_id"]]
+        subscriptions[body["category_id"]].add(body["chat_id"])
+        return {"created": created}
+
+    @app.delete("/api/v1/subscriptions/")
+    async def unsubscribe(chat_id: int, category_id: str = None):
+        removed = 0
+        for category, chats in subscriptions.items():
+            if category_id in (None, category) and chat_id in chats:
+                chats.discard(chat_id)
+                removed += 1
+        return {"removed": removed}
+
+    @app.get("/api/v1/subscriptions/subscribers")
+    async def subscribers(category_id: str, after: int = None, limit: int = 200):
+        chat_ids = sorted(chat for chat in subscriptions[category_id] if after is None or chat > after)[:limit]
+        return {"chat_ids": chat_ids, "next_after": chat_ids[-1] if len(chat_ids) == limit else None}
+
+    @app.post("/api/v1/subscriptions/broadcasts", status_code=201)
+    async def create_broadcast(request: Request):
+        body = await request.json()
+        pending = next(
+            (b for b in broadcasts.values()
+             if (b["category_id"], b["year"], b["status"]) == (body["category_id"], body["year"], "pending")),
+            None
+        )
+        if pending:
+            pending["count"] += body["count"]
+            return pending
+        broadcast_id = f"{len(broadcasts):024x}"
+        broadcasts[broadcast_id] = {
+            **body, "id": broadcast_id, "status": "pending", "checkpoint": None,
+            "sent": 0, "failed": 0, "removed": 0, "created_at": "2024-04-01T00:00:00",
+        }
+        return broadcasts[broadcast_id]
+
+    @app.get("/api/v1/subscriptions/broadcasts")
+    async def unfinished_broadcasts():
+        return [b for b in broadcasts.values() if b["status"] != "completed"]
+
+    @app.post("/api/v1/subscriptions/broadcasts/{broadcast_id}/start")
+    async def start_broadcast(broadcast_id: str):
+        broadcast = broadcasts.get(broadcast_id)
+        if not broadcast or broadcast["status"] != "pending":
+            raise HTTPException(status_code=404, detail="No pending broadcast with this ID")
+        broadcast["status"] = "running"
+        return broadcast
+
+    @app.patch("/api/v1/subscriptions/broadcasts/{broadcast_id}")
+    async def update_broadcast(broadcast_id: str, request: Request):
+        body = await request.json()
+        broadcast = broadcasts[broadcast_id]
+        for counter in ("sent", "failed", "removed"):
+            broadcast[counter] += body.get(counter, 0)
+        broadcast.update({key: body[key] for key in ("checkpoint", "status") if body.get(key) is not None})
+        return broadcast
+
+    return app
+
+
+def fake_telegram_app():
+    from fastapi import FastAPI, Request, Response
+
+    app = FastAPI()
+    message_ids = itertools.count(1)
+
+    def message(chat_id: int, **extra) -> dict:
+        return {
+            "message_id": next(message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            **extra,
+        }
+
+    @app.api_route("/bot{token}/{method}", methods=["GET", "POST"])
+    async def call(token: str, method: str, request: Request):
+        params = {**request.query_params, **(await request.form())}
+        chat_id = int(params.get("chat_id", 0))
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Focus", "username": "focus_load_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            result = message(chat_id, text=params.get("text", ""))
+        elif method == "sendMediaGroup":
+            media = json.loads(params["media"])
+            result = [
+                message(chat_id, photo=[{
+                    "file_id": f"cached-{index}-{next(message_ids)}",
+                    "file_unique_id": f"u{index}", "width": 1280, "height": 960,
+                }])
+                for index, _ in enumerate(media)
+            ]
+        elif method == "getFile":
+            result = {
+                "file_id": params["file_id"], "file_unique_id": params["file_id"],
+                "file_size": len(PHOTO_BYTES), "file_path": f"photos/{params['file_id']}.jpg",
+            }
+        else:
+            # answerCallbackQuery, answerInlineQuery, ...
+            result = True
+        return {"ok": True, "result": result}
+
+    @app.get("/file/bot{token}/{path:path}")
+    async def download(token: str, path: str):
+        return Response(PHOTO_BYTES, media_type="image/jpeg")
+
+    return app
+
+
+def serve_in_thread(apps: Dict[int, object]) -> List[object]:
+    import uvicorn
+
+    servers = [uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning")) for port, app in apps.items()]
+    for server in servers:
+        threading.Thread(target=server.run, daemon=True).start()
+    while not all(server.started for server in servers):
+        time.sleep(0.05)
+    return servers
+
+
+# ---- synthetic updates ----
+
+class UpdateFactory:
+    def __init__(self):
+        self.update_ids = itertools.count(1)
+        self.ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def message(self, user_id: int, text: str = None, photo: bool = False) -> dict:
+        msg = {
+            "message_id": next(self.ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+        }
+        if text:
+            msg["text"] = text
+            if text.startswith("/"):
+                msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        if photo:
+            file_id = f"upload-{user_id}-{next(self.ids)}"
+            msg["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960}]
+        return {"update_id": next(self.update_ids), "message": msg}
+
+    def callback(self, user_id: int, data: str, buttons: List[tuple] = ()) -> dict:
+        keyboard = [[{"text": text, "callback_data": callback_data}] for text, callback_data in buttons]
+        return {
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": str(next(self.ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": next(self.ids),
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "menu",
+                    "reply_markup": {"inline_keyboard": keyboard or [[{"text": "x", "callback_data": data}]]},
+                },
+            },
+        }
+
+
+def browse_script(factory: UpdateFactory, user_id: int, pages: int):
+    category = CATEGORIES[user_id % len(CATEGORIES)]
+    yield "subscribe", factory.message(user_id, f"/subscribe {category['name']}")
+    yield "browse_start", factory.message(user_id, "/browse")
+    yield "category", factory.callback(
+        user_id, f"category_{category['id']}", [(category["name"], f"category_{category['id']}")]
+    )
+    yield "year", factory.callback(user_id, f"year_{YEARS[0]}")
+    for _ in range(pages):
+        yield "next_page", factory.callback(user_id, "next_page")
+    yield "cancel", factory.message(user_id, "/cancel")
+
+
+def upload_script(factory: UpdateFactory, user_id: int):
+    category = CATEGORIES[0]
+    yield "upload_start", factory.message(user_id, "/upload")
+    yield "upload_category", factory.callback(
+        user_id, f"cat_{category['id']}", [(category["name"], f"cat_{category['id']}")]
+    )
+    yield "upload_year", factory.message(user_id, str(YEARS[0]))
+    yield "upload_photo", factory.message(user_id, photo=True)
+    yield "upload_stop", factory.callback(user_id, "stop_upload")
+
+
+# ---- measurement ----
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(samples: List[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+async def run(args) -> None:
+    from telegram import Update
+    from bot.broadcast import broadcast_stats, broadcaster
+    from bot.main import build_application
+    from bot.scheduler import scheduler
+    from bot.sessions import session_metrics
+
+    application = build_application(
+        TOKEN,
+        base_url=f"http://127.0.0.1:{args.telegram_port}/bot",
+        base_file_url=f"http://127.0.0.1:{args.telegram_port}/file/bot",
+    )
+    await application.initialize()
+    # Starts the job queue so conversation timeouts run as in production
+    await application.start()
+    scheduler.start()
+    broadcaster.start(application.bot)
+
+    factory = UpdateFactory()
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run_user(user_id: int, uploader: bool):
+        nonlocal errors
+        script = upload_script(factory, user_id) if uploader else browse_script(factory, user_id, args.pages)
+        async with semaphore:
+            for step, data in script:
+                update = Update.de_json(data, application.bot)
+                started = time.perf_counter()
+                try:
+                    await application.process_update(update)
+                except Exception:
+                    errors += 1
+                latencies[step].append(time.perf_counter() - started)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_user(user_id, user_id <= args.uploaders) for user_id in range(1, args.users + 1)
+    ))
+    elapsed = time.perf_counter() - started
+    rss_after = rss_mb()
+
+    drain_started = time.perf_counter()
+    while args.drain:
+        metrics = scheduler.metrics()
+        if not metrics["queued_interactive"] and not metrics["queued_bulk"]:
+            break
+        if time.perf_counter() - drain_started > args.drain_timeout:
+            print(f"send queue not drained after {args.drain_timeout}s")
+            break
+        await asyncio.sleep(0.1)
+    if args.drain:
+        print(f"send queue drained in {time.perf_counter() - drain_started:.1f}s")
+
+    total_updates = sum(len(samples) for samples in latencies.values())
+    print(f"users: {args.users} ({args.uploaders} uploading), concurrency {args.concurrency}")
+    print(f"updates: {total_updates} in {elapsed:.2f}s -> {total_updates / elapsed:.0f} updates/s, {errors} errors")
+    print(f"{'step':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for step, samples in latencies.items():
+        print(
+            f"{step:<16}{len(samples):>8}"
+            f"{statistics.median(samples) * 1000:>10.2f}"
+            f"{percentile(samples, 0.95) * 1000:>10.2f}"
+            f"{percentile(samples, 0.99) * 1000:>10.2f}"
+            f"{max(samples) * 1000:>10.2f}"
+        )
+    print("send queue:", ", ".join(f"{name}={value:.0f}" for name, value in scheduler.metrics().items()))
+    print(f"rss: {rss_before:.1f} MB -> {rss_after:.1f} MB "
+          f"({(rss_after - rss_before) * 1000 / args.users:.1f} KB per user)")
+    print("broadcasts: " + ", ".join(f"{name}={value}" for name, value in broadcast_stats.items()))
+    print(f"user_data entries: {len(application.user_data)}")
+    print("sessions: " + ", ".join(
+        f"{name}={gauge['live']} ({gauge['bytes'] / 1024:.1f} KB)" for name, gauge in session_metrics().items()
+    ))
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"tracemalloc: current {current / 2**20:.1f} MB, peak {peak / 2**20:.1f} MB")
+        for stat in tracemalloc.take_snapshot().statistics("lineno")[:5]:
+            print(f"  {stat}")
+
+    await broadcaster.stop()
+    await scheduler.stop()
+    await application.stop()
+    await application.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--uploaders", type=int, default=50, help="The first N users run the upload flow")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--pages", type=int, default=3, help="Next-page clicks per browsing user")
+    parser.add_argument("--backend-latency-ms", type=float, default=0.0)
+    parser.add_argument("--backend-port", type=int, default=8791)
+    parser.add_argument("--telegram-port", type=int, default=8792)
+    parser.add_argument("--drain", action="store_true", help="Wait for the send queue to empty (paced at ~30 msg/s)")
+    parser.add_argument("--drain-timeout", type=float, default=300.0)
+    parser.add_argument("--tracemalloc", action="store_true", help="Report top allocation sites (slower)")
+    args = parser.parse_args()
+
+    # bot.api and bot.helpers read these at import/call time
+    os.environ["BOT_BACKEND_URL"] = f"http://127.0.0.1:{args.backend_port}/api/v1"
+    os.environ["BOT_BACKEND_API_KEY"] = "load-test"
+    os.environ["BOT_ADMIN_IDS"] = ",".join(str(user_id) for user_id in range(1, args.uploaders + 1))
+
+    import logging
+    import warnings
+    logging.disable(logging.WARNING)
+    # per_message=False is intended; the conversations are tracked per user
+    warnings.filterwarnings("ignore", message="If 'per_message=False'")
+
+    serve_in_thread({
+        args.backend_port: fake_backend_app(args.backend_latency_ms / 1000),
+        args.telegram_port: fake_telegram_app(),
+    })
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Measure perceptual-hash index queries at gallery scale.
+
+Fills one category of ``app.services.similarity`` with random 64-bit hashes
+(the worst case: every query scans all of them), plants near-duplicates of
+the query hashes, and times ``search`` with numpy's ``bitwise_count`` and with
+the SWAR popcount used on numpy < 2.0. A pure-Python scan of the same
+data is timed on a slice for comparison. Nothing touches MongoDB.
+
+    python -m benchmarks.similarity_index --images 1000000 --queries 200
+"""
+import argparse
+import os
+import statistics
+import time
+from typing import Callable, List
+
+import numpy as np
+from bson import ObjectId
+
+
+def percentile(samples: List[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def report(name: str, samples: List[float]):
+    print(f"{name:<22}{statistics.median(samples) * 1000:>10.2f}{percentile(samples, 0.95) * 1000:>10.2f}"
+          f"{percentile(samples, 0.99) * 1000:>10.2f}{max(samples) * 1000:>10.2f}")
+
+
+def time_queries(search: Callable[[int], list], targets: List[int]) -> List[float]:
+    samples = []
+    for target in targets:
+        started = time.perf_counter()
+        search(target)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--max-distance", type=int, default=14)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--python-slice", type=int, default=100_000, help="Images scanned by the pure-Python baseline")
+    args = parser.parse_args()
+
+    # app.config wants these; the index itself never connects to anything
+    for name in ("BOT_BACKEND_API_KEY", "BOT_TOKEN", "MONGODB_URL"):
+        os.environ.setdefault(name, "benchmark")
+    from app.services import similarity
+    from app.services.similarity import HashArray, SimilarityIndex
+
+    rng = np.random.default_rng(42)
+    hashes = rng.integers(np.iinfo(np.int64).min, np.iinfo(np.int64).max, args.images, dtype=np.int64)
+    # Plant a near-duplicate (3 bits flipped) of every query hash
+    targets = [int(value) for value in hashes[:args.queries]]
+    hashes[-args.queries:] = hashes[:args.queries] ^ 0b10101
+
+    ids = [ObjectId() for _ in range(args.images)]
+    values = hashes.tolist()
+    # Filled in batches the way a rebuild fills it from MongoDB
+    started = time.perf_counter()
+    arrays = HashArray()
+    for start in range(0, args.images, similarity.LOAD_BATCH_SIZE):
+        end = start + similarity.LOAD_BATCH_SIZE
+        arrays.add(ids[start:end], values[start:end])
+    build = time.perf_counter() - started
+    index = SimilarityIndex()
+    index._categories["bench"] = arrays
+    index.ready = True
+    megabytes = sum(getattr(arrays, name).nbytes for name in ("hashes", "stamps", "tails")) / 2**20
+    print(f"images: {len(index)} in one category, loaded in {build:.2f}s, {megabytes:.1f} MB of arrays")
+
+    def search(target: int) -> list:
+        return index.search("bench", target, args.max_distance, args.limit)
+
+    found = sum(1 for target in targets if search(target))
+    print(f"queries: {args.queries}, max distance {args.max_distance}, {found} found their planted duplicate")
+    print(f"{'query':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    if hasattr(np, "bitwise_count"):
+        report("bitwise_count", time_queries(search, targets))
+        bitwise_count = np.bitwise_count
+        del np.bitwise_count
+        try:
+            report("SWAR (numpy < 2.0)", time_queries(search, targets))
+        finally:
+            np.bitwise_count = bitwise_count
+    else:
+        report("SWAR (numpy < 2.0)", time_queries(search, targets))
+
+    unsigned = [value & 0xFFFFFFFFFFFFFFFF for value in hashes[:args.python_slice].tolist()]
+    scale = args.images / len(unsigned)
+
+    def python_scan(target: int) -> list:
+        target &= 0xFFFFFFFFFFFFFFFF
+        return [i for i, value in enumerate(unsigned) if (value ^ target).bit_count() <= args.max_distance]
+
+    samples = [sample * scale for sample in time_queries(python_scan, targets[:10])]
+    report("pure Python (scaled)", samples)
+
+    # Incremental updates between queries: one upload, one 1000-image bulk delete
+    started = time.perf_counter()
+    index.apply(added=[("bench", ObjectId(), targets[0])])
+    added = time.perf_counter() - started
+    started = time.perf_counter()
+    index.apply(removed=ids[:1000])
+    removed = time.perf_counter() - started
+    print(f"updates: add 1 in {added * 1000:.2f} ms, remove 1000 in {removed * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
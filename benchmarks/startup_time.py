@@ -0,0 +1,63 @@
+"""Measure how long the API takes to answer its first request after a cold start.
+
+Starts uvicorn once per run in each startup mode and polls ``/`` until it answers.
+MongoDB settings are read from ``.env`` as usual, so point ``MONGODB_URL`` at the
+database you want to measure against (a remote Atlas cluster shows the gain best).
+
+    python -m benchmarks.startup_time --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+MODES = ("eager", "background")
+
+
+def time_to_first_response(mode: str, port: int, timeout: float) -> float:
+    env = dict(os.environ, STARTUP_MODE=mode)
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {proc.returncode} in {mode} mode")
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/", timeout=0.5).status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.TransportError:
+                pass
+            time.sleep(0.01)
+        raise TimeoutError(f"No response within {timeout}s in {mode} mode")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    results = {}
+    for mode in MODES:
+        samples = [time_to_first_response(mode, args.port, args.timeout) for _ in range(args.runs)]
+        results[mode] = statistics.median(samples)
+        print(f"{mode:>10}: median {results[mode] * 1000:.0f} ms "
+              f"(min {min(samples) * 1000:.0f} ms, max {max(samples) * 1000:.0f} ms, {args.runs} runs)")
+
+    gain = results["eager"] - results["background"]
+    print(f"{'gain':>10}: {gain * 1000:.0f} ms ({gain / results['eager'] * 100:.0f}% faster first response)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Stand-in trace collector and viewer.
+
+Collect spans POSTed by the bot and the API (BOT_TRACE_EXPORT / TRACE_EXPORT set
+to http://127.0.0.1:4318/) into a JSONL file:
+
+    python -m benchmarks.trace_collector collect --port 4318 --out traces.jsonl
+
+Print the slowest traces as waterfalls, from that file or one written directly
+by an exporter:
+
+    python -m benchmarks.trace_collector show traces.jsonl --slowest 5
+"""
+import argparse
+import json
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+
+def collect(port: int, out: str) -> None:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            spans = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with open(out, "a") as f:
+                f.writelines(json.dumps(span) + "\n" for span in spans)
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    print(f"collecting spans on :{port} into {out}")
+    ThreadingHTTPServer(("0.0.0.0", port), Handler).serve_forever()
+
+
+def load(path: str) -> Dict[str, List[dict]]:
+    traces = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            span = json.loads(line)
+            traces[span["trace_id"]].append(span)
+    return traces
+
+
+def show(path: str, slowest: int, width: int = 40) -> None:
+    traces = load(path)
+
+    def extent(spans):
+        start = min(span["start"] for span in spans)
+        end = max(span["start"] + span["duration_ms"] / 1000 for span in spans)
+        return start, end
+
+    ranked = sorted(traces.values(), key=lambda spans: extent(spans)[1] - extent(spans)[0], reverse=True)
+    for spans in ranked[:slowest]:
+        start, end = extent(spans)
+        total = max(end - start, 1e-9)
+        print(f"trace {spans[0]['trace_id']}  {total * 1000:.1f} ms, {len(spans)} spans")
+        children = defaultdict(list)
+        ids = {span["span_id"] for span in spans}
+        for span in spans:
+            children[span["parent_id"] if span["parent_id"] in ids else None].append(span)
+
+        def walk(parent_id, depth):
+            for span in sorted(children[parent_id], key=lambda span: span["start"]):
+                offset = int((span["start"] - start) / total * width)
+                length = max(1, int(span["duration_ms"] / 1000 / total * width))
+                bar = " " * offset + "█" * min(length, width - offset)
+                error = f"  !! {span['error']}" if span.get("error") else ""
+                label = f"{'  ' * depth}{span['service']}: {span['name']}"
+                print(f"  {bar:<{width}} {span['duration_ms']:>9.1f} ms  {label}{error}")
+                walk(span["span_id"], depth + 1)
+
+        walk(None, 0)
+        print()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    collect_parser = commands.add_parser("collect", help="Receive spans over HTTP")
+    collect_parser.add_argument("--port", type=int, default=4318)
+    collect_parser.add_argument("--out", default="traces.jsonl")
+    show_parser = commands.add_parser("show", help="Print trace waterfalls")
+    show_parser.add_argument("path")
+    show_parser.add_argument("--slowest", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "collect":
+        collect(args.port, args.out)
+    else:
+        show(args.path, args.slowest)
+
+
+if __name__ == "__main__":
+    main()
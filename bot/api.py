@@ -1,10 +1,15 @@
+import asyncio
 import httpx
 import os
 import logging
-from typing import Optional
+from collections import OrderedDict
+from typing import List, Optional, Union
 from pathlib import Path
+from urllib.parse import urlencode
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from app.services.tracing import tracer
+from bot.circuit import CircuitOpenError, get_breaker
 
 # Load environment variables from project root
 project_root = Path(__file__).parent.parent
@@ -16,13 +21,92 @@ logger = logging.getLogger(__name__)
 # API configuration
 BACKEND_URL = os.getenv("BOT_BACKEND_URL", "http://127.0.0.1:8000/api/v1")
 API_KEY = os.getenv("BOT_BACKEND_API_KEY")
+# Where users' browsers reach the API, for links the bot hands out
+PUBLIC_BACKEND_URL = os.getenv("BOT_PUBLIC_BACKEND_URL", BACKEND_URL)
+# Send uploads as Telegram file references the backend fetches itself; 0 always downloads and re-uploads
+REMOTE_UPLOADS = os.getenv("BOT_REMOTE_UPLOADS", "1") != "0"
 
 # ---- Cache storage ----
 _cache = {
     "categories": {"data": None, "timestamp": None},
     "years": {},  # keyed by category_id
+    "pages": OrderedDict(),  # image pages keyed by (category, year, page, per_page, tag)
 }
 CACHE_DURATION = timedelta(minutes=5)
+MAX_CACHED_PAGES = 200
+
+# Reads fail fast instead of hanging on a sleeping backend; the circuit breaker does the rest
+READ_TIMEOUT = httpx.Timeout(5.0, connect=3.0)
+
+# ---- Retry policy for 429/503 responses ----
+MAX_RETRIES = 2
+MAX_RETRY_AFTER = 10  # seconds; longer waits are returned to the caller instead
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+async def _request(
+    client: httpx.AsyncClient, method: str, url: str, endpoint: Optional[str] = None, **kwargs
+) -> httpx.Response:
+    """Send a request through the endpoint's circuit breaker, waiting out Retry-After when the backend sheds load"""
+    breaker = get_breaker(endpoint or url)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Backend circuit for {breaker.name} is open")
+    succeeded = False
+    try:
+        with tracer.span(f"backend {method} {endpoint or url}") as span:
+            if span is not None:
+                # The API continues this trace, so its spans nest under this call
+                kwargs["headers"] = {**kwargs.get("headers", {}), "traceparent": span.traceparent}
+            response = await _send_with_retries(client, method, url, **kwargs)
+            if span is not None:
+                span.attributes["status"] = response.status_code
+        succeeded = response.status_code < 500
+        return response
+    finally:
+        # Every outcome is reported, including cancellation and errors building the request,
+        # so a half-open probe always resolves
+        if succeeded:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+
+
+async def _send_with_retries(client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+    for attempt in range(MAX_RETRIES + 1):
+        response = await client.request(method, url, **kwargs)
+        if response.status_code not in (429, 503) or attempt == MAX_RETRIES:
+            break
+        delay = _retry_after(response)
+        if delay is None or delay > MAX_RETRY_AFTER:
+            break
+        logger.warning(f"Backend returned {response.status_code} for {url}, retrying in {delay}s")
+        await asyncio.sleep(delay)
+    return response
+
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Shared client so calls reuse pooled connections instead of a new TLS handshake each"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(follow_redirects=True, timeout=READ_TIMEOUT)
+    return _client
+
+
+async def close_client():
+    if _client is not None:
+        await _client.aclose()
 
 
 def _get_headers():
@@ -32,72 +116,338 @@ def _get_headers():
     return headers
 
 
-async def get_categories():
+async def get_categories(force: bool = False):
     now = datetime.now()
-    # Return cached categories if still fresh
+    # Return cached categories if still fresh (the warm-up job forces a refresh before expiry)
     if (
-        _cache["categories"]["data"]
+        not force
+        and _cache["categories"]["data"]
         and _cache["categories"]["timestamp"]
         and now - _cache["categories"]["timestamp"] < CACHE_DURATION
     ):
         return _cache["categories"]["data"]
 
-    async with httpx.AsyncClient(follow_redirects=True) as client:
-        response = await client.get(f"{BACKEND_URL}/categories/", headers=_get_headers())
-        if response.status_code != 200:
-            logger.error(f"Failed to fetch categories: {response.status_code} - {response.text}")
-            # fallback to last cached
-            return _cache["categories"]["data"]
+    try:
+        client = _get_client()
+        response = await _request(
+            client, "GET", f"{BACKEND_URL}/categories/", endpoint="categories", headers=_get_headers()
+        )
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        logger.warning(f"Serving stale categories: {str(e)}")
+        return _cache["categories"]["data"]
+    if response.status_code != 200:
+        logger.error(f"Failed to fetch categories: {response.status_code} - {response.text}")
+        # fallback to last cached
+        return _cache["categories"]["data"]
 
-        data = response.json()
-        _cache["categories"]["data"] = data
-        _cache["categories"]["timestamp"] = now
-        return data
+    data = response.json()
+    _cache["categories"]["data"] = data
+    _cache["categories"]["timestamp"] = now
+    return data
 
 
-async def get_years(category_id: str):
+async def get_years(category_id: str, force: bool = False):
     now = datetime.now()
-    if category_id in _cache["years"]:
+    if not force and category_id in _cache["years"]:
         entry = _cache["years"][category_id]
         if entry["data"] and entry["timestamp"] and now - entry["timestamp"] < CACHE_DURATION:
             return entry["data"]
 
-    async with httpx.AsyncClient(follow_redirects=True) as client:
-        response = await client.get(
-            f"{BACKEND_URL}/images/years", 
+    try:
+        client = _get_client()
+        response = await _request(
+            client, "GET", f"{BACKEND_URL}/images/years", endpoint="years",
             params={"category": category_id},
             headers=_get_headers()
         )
-        if response.status_code != 200:
-            logger.error(f"Failed to fetch years: {response.status_code} - {response.text}")
-            return _cache["years"].get(category_id, {}).get("data")
-
-        data = response.json()
-        _cache["years"][category_id] = {"data": data, "timestamp": now}
-        return data
-
-
-async def get_images(category_id: str, year: int, page: int, per_page: int = 5):
-    async with httpx.AsyncClient(follow_redirects=True) as client:
-        response = await client.get(
-            f"{BACKEND_URL}/images",
-            params={
-                "category": category_id,
-                "year": year,
-                "page": page,
-                "per_page": per_page
-            },
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        logger.warning(f"Serving stale years for {category_id}: {str(e)}")
+        return _cache["years"].get(category_id, {}).get("data")
+    if response.status_code != 200:
+        logger.error(f"Failed to fetch years: {response.status_code} - {response.text}")
+        return _cache["years"].get(category_id, {}).get("data")
+
+    data = response.json()
+    _cache["years"][category_id] = {"data": data, "timestamp": now}
+    return data
+
+
+async def get_images(
+    category_id: str, year: int, page: int, per_page: int = 5, tag: Optional[str] = None, force: bool = False
+):
+    now = datetime.now()
+    page_key = (category_id, year, page, per_page, tag)
+    entry = _cache["pages"].get(page_key)
+    if not force and entry and now - entry["timestamp"] < CACHE_DURATION:
+        _cache["pages"].move_to_end(page_key)
+        return entry["data"]
+
+    params = {
+        "category": category_id,
+        "year": year,
+        "page": page,
+        "per_page": per_page
+    }
+    if tag:
+        params["tag"] = tag
+
+    try:
+        client = _get_client()
+        response = await _request(
+            client, "GET", f"{BACKEND_URL}/images", endpoint="images",
+            params=params,
+            headers=_get_headers()
+        )
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        logger.warning(f"Serving stale page {page_key}: {str(e)}")
+        return entry["data"] if entry else None
+    if response.status_code != 200:
+        logger.error(f"Failed to fetch images: {response.status_code} - {response.text}")
+        return entry["data"] if entry and response.status_code >= 500 else None
+
+    data = response.json()
+    _cache["pages"][page_key] = {"data": data, "timestamp": now}
+    _cache["pages"].move_to_end(page_key)
+    while len(_cache["pages"]) > MAX_CACHED_PAGES:
+        _cache["pages"].popitem(last=False)
+    return data
+
+
+async def get_facets():
+    """Fetch image counts and tags for every category/year pair"""
+    try:
+        client = _get_client()
+        response = await _request(
+            client, "GET", f"{BACKEND_URL}/images/facets", endpoint="facets", headers=_get_headers()
+        )
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        logger.warning(f"Failed to fetch facets: {str(e)}")
+        return None
+    if response.status_code != 200:
+        logger.error(f"Failed to fetch facets: {response.status_code} - {response.text}")
+        return None
+    return response.json()
+
+
+async def bulk_operation(kind: str, payload: dict) -> Optional[dict]:
+    """Start (or with dry_run, preview) a bulk "delete" or "move" on the backend"""
+    try:
+        client = _get_client()
+        response = await _request(
+            client, "POST", f"{BACKEND_URL}/images/bulk/{kind}", endpoint="bulk",
+            json=payload,
+            headers=_get_headers(),
+            timeout=30.0
+        )
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        logger.error(f"Bulk {kind} failed: {str(e)}")
+        return None
+    if response.status_code not in (200, 202):
+        logger.error(f"Bulk {kind} failed: {response.status_code} - {response.text}")
+        return None
+    return response.json()
+
+
+async def resume_bulk_operation(op_id: str) -> Optional[dict]:
+    """Restart a failed or interrupted bulk operation from where it stopped"""
+    try:
+        client = _get_client()
+        response = await _request(
+            client, "POST", f"{BACKEND_URL}/images/bulk/{op_id}/resume", endpoint="bulk", headers=_get_headers()
+        )
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        logger.error(f"Failed to resume bulk operation: {str(e)}")
+        return None
+    if response.status_code != 202:
+        logger.error(f"Failed to resume bulk operation: {response.status_code} - {response.text}")
+        return None
+    return response.json()
+
+
+async def get_bulk_operation(op_id: str) -> Optional[dict]:
+    try:
+        client = _get_client()
+        response = await _request(
+            client, "GET", f"{BACKEND_URL}/images/bulk/{op_id}", endpoint="bulk", headers=_get_headers()
+        )
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        logger.error(f"Failed to fetch bulk operation: {str(e)}")
+        return None
+    if response.status_code != 200:
+        logger.error(f"Failed to fetch bulk operation: {response.status_code} - {response.text}")
+        return None
+    return response.json()
+
+
+async def report_views(views: list) -> bool:
+    """Send a batch of aggregated view counts; False means the batch should be kept and retried"""
+    try:
+        client = _get_client()
+        response = await _request(
+            client, "POST", f"{BACKEND_URL}/images/views/", endpoint="views",
+            json={"views": views},
             headers=_get_headers()
         )
-        if response.status_code != 200:
-            logger.error(f"Failed to fetch images: {response.status_code} - {response.text}")
-            return None
-        return response.json()
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        logger.warning(f"Failed to report views: {str(e)}")
+        return False
+    if response.status_code != 202:
+        logger.error(f"Failed to report views: {response.status_code} - {response.text}")
+        # A rejected batch would be rejected again; only retry overload and server errors
+        return response.status_code < 500 and response.status_code != 429
+    return True
+
+
+async def _subscriptions_request(method: str, path: str, action: str, **kwargs) -> Optional[httpx.Response]:
+    """Call a subscriptions endpoint; None (logged) on network errors and unexpected statuses"""
+    try:
+        response = await _request(
+            _get_client(), method, f"{BACKEND_URL}/subscriptions/{path}", endpoint="subscriptions",
+            headers=_get_headers(), **kwargs
+        )
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        logger.error(f"Failed to {action}: {str(e)}")
+        return None
+    if response.status_code not in (200, 201, 404):
+        logger.error(f"Failed to {action}: {response.status_code} - {response.text}")
+        return None
+    return response
+
+
+async def subscribe(chat_id: int, category_id: str) -> Optional[bool]:
+    """True once subscribed, False if the category doesn't exist, None on failure"""
+    response = await _subscriptions_request(
+        "PUT", "", "subscribe", json={"chat_id": chat_id, "category_id": category_id}
+    )
+    if response is None:
+        return None
+    return response.status_code == 200
+
+
+async def unsubscribe(chat_id: int, category_id: Optional[str] = None) -> Optional[int]:
+    """Drop one subscription, or all of a chat's; returns how many were removed"""
+    params = {"chat_id": chat_id}
+    if category_id:
+        params["category_id"] = category_id
+    response = await _subscriptions_request("DELETE", "", "unsubscribe", params=params)
+    return response.json()["removed"] if response is not None and response.status_code == 200 else None
+
+
+async def get_subscriptions(chat_id: int) -> Optional[List[str]]:
+    response = await _subscriptions_request("GET", "", "fetch subscriptions", params={"chat_id": chat_id})
+    return response.json() if response is not None and response.status_code == 200 else None
+
+
+async def get_subscribers(category_id: str, after: Optional[int], limit: int) -> Optional[dict]:
+    params = {"category_id": category_id, "limit": limit}
+    if after is not None:
+        params["after"] = after
+    response = await _subscriptions_request("GET", "subscribers", "fetch subscribers", params=params)
+    return response.json() if response is not None and response.status_code == 200 else None
+
+
+async def create_broadcast(category_id: str, year: int, count: int, title: str) -> Optional[dict]:
+    response = await _subscriptions_request(
+        "POST", "broadcasts", "queue broadcast",
+        json={"category_id": category_id, "year": year, "count": count, "title": title}
+    )
+    return response.json() if response is not None and response.status_code == 201 else None
+
+
+async def get_unfinished_broadcasts() -> Optional[List[dict]]:
+    response = await _subscriptions_request("GET", "broadcasts", "fetch broadcasts")
+    return response.json() if response is not None and response.status_code == 200 else None
+
+
+async def start_broadcast(broadcast_id: str) -> Union[dict, bool, None]:
+    """The broadcast as started, False if it was no longer pending, None on failure"""
+    response = await _subscriptions_request("POST", f"broadcasts/{broadcast_id}/start", "start broadcast")
+    if response is None:
+        return None
+    return response.json() if response.status_code == 200 else False
+
 
+async def update_broadcast(broadcast_id: str, progress: dict) -> Optional[dict]:
+    response = await _subscriptions_request(
+        "PATCH", f"broadcasts/{broadcast_id}", "record broadcast progress", json=progress
+    )
+    return response.json() if response is not None and response.status_code == 200 else None
 
-async def upload_image(file_path: str, data: dict) -> Optional[httpx.Response]:
+
+async def get_similar_images(image_id: str, limit: int = 5) -> Optional[List[dict]]:
+    """Look-alikes of an image, closest first; None if the backend can't say"""
+    try:
+        response = await _request(
+            _get_client(), "GET", f"{BACKEND_URL}/images/{image_id}/similar", endpoint="similar",
+            params={"limit": limit}, headers=_get_headers()
+        )
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        logger.error(f"Failed to fetch similar images: {str(e)}")
+        return None
+    if response.status_code != 200:
+        logger.error(f"Failed to fetch similar images: {response.status_code} - {response.text}")
+        return None
+    return response.json()
+
+
+def archive_url(category_id: str, year: int) -> str:
+    return f"{PUBLIC_BACKEND_URL}/images/archive?{urlencode({'category': category_id, 'year': year})}"
+
+
+async def download_archive(category_id: str, year: int, destination: str, max_bytes: int) -> bool:
+    """Stream a category/year ZIP to disk; False if it failed or would exceed ``max_bytes``"""
+    written = 0
+    try:
+        client = _get_client()
+        async with client.stream(
+            "GET", f"{BACKEND_URL}/images/archive",
+            params={"category": category_id, "year": year},
+            headers=_get_headers(),
+            timeout=httpx.Timeout(10.0, read=120.0),
+        ) as response:
+            if response.status_code != 200:
+                logger.error(f"Failed to download archive: {response.status_code}")
+                return False
+            with open(destination, "wb") as f:
+                async for chunk in response.aiter_bytes():
+                    written += len(chunk)
+                    if written > max_bytes:
+                        return False
+                    f.write(chunk)
+    except httpx.HTTPError as e:
+        logger.error(f"Failed to download archive: {str(e)}")
+        return False
+    return True
+
+
+def cache_timestamp(kind: str, key=None) -> Optional[datetime]:
+    """When a cached categories/years/pages entry was last fetched from the backend"""
+    entry = _cache["categories"] if kind == "categories" else _cache[kind].get(key)
+    return entry["timestamp"] if entry else None
+
+
+def invalidate_categories():
+    _cache["categories"] = {"data": None, "timestamp": None}
+
+
+def invalidate(category_id: Optional[str] = None):
+    """Forget cached years and pages for one category, or everything"""
+    if category_id is None:
+        invalidate_categories()
+        _cache["years"].clear()
+        _cache["pages"].clear()
+    else:
+        _cache["years"].pop(category_id, None)
+        for key in [key for key in _cache["pages"] if key[0] == category_id]:
+            del _cache["pages"][key]
+
+
+async def upload_image(file_path: str, data: dict, idempotency_key: Optional[str] = None) -> Optional[httpx.Response]:
     url = f"{BACKEND_URL}/images/"
     headers = _get_headers()
+    if idempotency_key:
+        # A retried upload then returns the first attempt's result instead of uploading twice
+        headers["Idempotency-Key"] = idempotency_key
 
     if not API_KEY:
         logger.error("BOT_BACKEND_API_KEY is not set in environment")
@@ -111,18 +461,52 @@ async def upload_image(file_path: str, data: dict) -> Optional[httpx.Response]:
                 "year": str(data["year"]),
                 "tags": data.get("tags", ""),
                 "uploaded_by": str(data["uploaded_by"]),
+                "allow_duplicate": "true" if data.get("allow_duplicate") else "false",
             }
 
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    url,
-                    data=form_data,
-                    files=files,
-                    headers=headers,
-                    timeout=30.0,
-                )
-                logger.info(f"Upload response: {response.status_code} - {response.text}")
-                return response
+            client = _get_client()
+            response = await _request(
+                client, "POST", url, endpoint="upload",
+                data=form_data,
+                files=files,
+                headers=headers,
+                timeout=30.0,
+            )
+            logger.info(f"Upload response: {response.status_code} - {response.text}")
+            return response
     except Exception as e:
         logger.error(f"Error uploading image: {str(e)}")
         return None
+
+
+async def upload_remote(
+    file_id: str, data: dict, idempotency_key: Optional[str] = None, thumbnail_file_id: Optional[str] = None
+) -> Optional[httpx.Response]:
+    """Ask the backend to fetch a photo from Telegram itself; None if it couldn't be asked"""
+    if not API_KEY:
+        logger.error("BOT_BACKEND_API_KEY is not set in environment")
+        return None
+    headers = _get_headers()
+    if idempotency_key:
+        headers["Idempotency-Key"] = idempotency_key
+    payload = {
+        "file_id": file_id,
+        "category": data["category"],
+        "year": data["year"],
+        "tags": data.get("tags", ""),
+        "uploaded_by": data["uploaded_by"],
+        "thumbnail_file_id": thumbnail_file_id,
+        "allow_duplicate": data.get("allow_duplicate", False),
+    }
+    try:
+        response = await _request(
+            _get_client(), "POST", f"{BACKEND_URL}/images/remote", endpoint="upload_remote",
+            json=payload,
+            headers=headers,
+            timeout=30.0,
+        )
+        logger.info(f"Remote upload response: {response.status_code}")
+        return response
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        logger.error(f"Error requesting remote upload: {str(e)}")
+        return None
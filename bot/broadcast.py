@@ -0,0 +1,203 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden
+from telegram.ext import ContextTypes, JobQueue
+
+from bot import api
+from bot.scheduler import PRIORITY_BULK, scheduler
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_DEBOUNCE = 60.0  # quiet seconds after the last photo before an upload batch is announced
+RETRY_DELAY = 30.0  # seconds before retrying after the backend failed us
+POLL_INTERVAL = 300.0  # also look for broadcasts queued elsewhere or left over from a restart
+SUBSCRIBER_PAGE = 200  # chats sent to, and checkpointed, per round
+
+broadcast_stats = {"queued": 0, "sent": 0, "failed": 0, "removed": 0, "last_error": None}
+
+# (category_id, year) -> [category name, photos uploaded since the last notification]
+_batches: Dict[Tuple[str, int], list] = {}
+_job_queue: Optional[JobQueue] = None
+
+
+def _job_name(key: Tuple[str, int]) -> str:
+    return f"notify_{key[0]}_{key[1]}"
+
+
+def _schedule_flush(key: Tuple[str, int], delay: float):
+    if _job_queue is None:
+        return
+    for job in _job_queue.get_jobs_by_name(_job_name(key)):
+        job.schedule_removal()
+    _job_queue.run_once(_flush_job, delay, data=key, name=_job_name(key))
+
+
+def notify_upload(job_queue: JobQueue, category_id: str, category_name: str, year: int, count: int = 1):
+    """Count uploaded photos; subscribers hear about them once the batch goes quiet"""
+    global _job_queue
+    _job_queue = job_queue
+    key = (category_id, year)
+    batch = _batches.setdefault(key, [category_name, 0])
+    batch[1] += count
+    _schedule_flush(key, NOTIFY_DEBOUNCE)
+
+
+def end_upload_batch(category_id: str, year: int):
+    """The uploader is done: announce now instead of waiting out the debounce"""
+    if (category_id, year) in _batches:
+        _schedule_flush((category_id, year), 0)
+
+
+async def _flush(key: Tuple[str, int]) -> bool:
+    batch = _batches.pop(key, None)
+    if batch is None:
+        return True
+    category_name, count = batch
+    if await api.create_broadcast(key[0], key[1], count, f"{category_name} {key[1]}") is None:
+        # Keep the photos counted, together with any uploaded meanwhile
+        pending = _batches.setdefault(key, [category_name, 0])
+        pending[1] += count
+        return False
+    broadcast_stats["queued"] += 1
+    broadcaster.wake()
+    return True
+
+
+async def _flush_job(context: ContextTypes.DEFAULT_TYPE):
+    key = context.job.data
+    if not await _flush(key):
+        _schedule_flush(key, RETRY_DELAY)
+
+
+async def flush_upload_batches():
+    """Queue every batch still waiting out its debounce, e.g. on shutdown"""
+    for key in list(_batches):
+        await _flush(key)
+
+
+def _message(broadcast: dict) -> str:
+    count = broadcast["count"]
+    return (
+        f"🆕 {count} new photo{'s' if count != 1 else ''} in {broadcast['title']}\n\n"
+        "Use /browse to see them, or /unsubscribe to stop these messages."
+    )
+
+
+def _chat_gone(error: BaseException) -> bool:
+    """The bot can never message this chat again (blocked, kicked, deleted account)"""
+    return isinstance(error, Forbidden) or (
+        isinstance(error, BadRequest) and "chat not found" in error.message.lower()
+    )
+
+
+class Broadcaster:
+    """Delivers queued broadcasts to subscribers through the send scheduler.
+
+    Broadcasts live in the backend, so nothing is lost with the bot. Subscribers
+    are read in ascending chat ID pages and the checkpoint is saved after each
+    page, so a restarted bot resumes where it stopped; a chat in the page that
+    was interrupted may get the message twice. The scheduler keeps the bulk
+    sends within Telegram's limits and behind interactive replies, and handles
+    RetryAfter; chats that blocked the bot are unsubscribed.
+    """
+
+    def __init__(self):
+        self._bot: Optional[Bot] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    def start(self, bot: Bot):
+        self._bot = bot
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            delay = POLL_INTERVAL
+            try:
+                broadcasts = await api.get_unfinished_broadcasts()
+                if broadcasts is None:
+                    delay = RETRY_DELAY
+                for broadcast in broadcasts or []:
+                    if not await self._deliver(broadcast):
+                        delay = RETRY_DELAY
+                        break
+            except Exception as e:
+                logger.exception(f"Broadcast delivery failed: {str(e)}")
+                broadcast_stats["last_error"] = f"{type(e).__name__}: {e}"
+                delay = RETRY_DELAY
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send_page(self, chat_ids: List[int], text: str) -> dict:
+        futures = [
+            scheduler.submit(
+                chat_id,
+                [(lambda chat_id=chat_id: self._bot.send_message(chat_id=chat_id, text=text), 1)],
+                priority=PRIORITY_BULK
+            )
+            for chat_id in chat_ids
+        ]
+        progress = {"checkpoint": chat_ids[-1], "sent": 0, "failed": 0, "removed": 0}
+        for chat_id, result in zip(chat_ids, await asyncio.gather(*futures, return_exceptions=True)):
+            if not isinstance(result, BaseException):
+                progress["sent"] += 1
+            elif _chat_gone(result) and await api.unsubscribe(chat_id) is not None:
+                progress["removed"] += 1
+            else:
+                progress["failed"] += 1
+        return progress
+
+    async def _deliver(self, broadcast: dict) -> bool:
+        """Send one broadcast to the end; False if the backend failed and it should be retried later"""
+        if broadcast["status"] == "pending":
+            # From here on, new uploads queue a broadcast of their own instead of changing
+            # this one; the started copy has every batch folded in before that point
+            started = await api.start_broadcast(broadcast["id"])
+            if started is None:
+                return False
+            if started is False:
+                # Started by an earlier attempt; the next poll picks it up as running
+                return True
+            broadcast = started
+        text = _message(broadcast)
+        after = broadcast["checkpoint"]
+        while True:
+            page = await api.get_subscribers(broadcast["category_id"], after, SUBSCRIBER_PAGE)
+            if page is None:
+                return False
+            progress = {}
+            if page["chat_ids"]:
+                progress = await self._send_page(page["chat_ids"], text)
+            if page["next_after"] is None:
+                progress["status"] = "completed"
+            if await api.update_broadcast(broadcast["id"], progress) is None:
+                return False
+            for counter in ("sent", "failed", "removed"):
+                broadcast_stats[counter] += progress.get(counter, 0)
+            if page["next_after"] is None:
+                logger.info(f"Broadcast {broadcast['id']} for {broadcast['title']} completed")
+                return True
+            after = page["next_after"]
+
+
+# Shared instance started with the application
+broadcaster = Broadcaster()
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from bot import api
+
+logger = logging.getLogger(__name__)
+
+INDEX_TTL = 600  # seconds before the facet index is refreshed in the background
+PAGE_TTL = 600  # seconds a cached result page stays fresh
+INLINE_PAGE_SIZE = 20  # backend maximum per_page
+MAX_CACHED_PAGES = 500
+MAX_FILE_IDS = 20000
+PREFETCH_LIMIT = 30  # facets whose first page is loaded on every refresh
+
+
+@dataclass
+class FacetEntry:
+    category_id: str
+    category_name: str
+    year: int
+    count: int
+    tags: List[str] = field(default_factory=list)
+    # Lowercased words a query token can prefix-match
+    terms: Tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class Selection:
+    category_id: str
+    category_name: str
+    year: int
+    tag: Optional[str] = None
+
+
+class GalleryIndex:
+    """In-memory index of categories, years and tags used to answer inline queries.
+
+    Facets are loaded with one backend call and refreshed in the background, result
+    pages are cached per selection, and Telegram file_ids seen while browsing are
+    remembered so inline results can reuse already-uploaded photos.
+    """
+
+    def __init__(self):
+        self.facets: List[FacetEntry] = []
+        self.loaded_at: Optional[float] = None
+        self.pages: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.file_ids: "OrderedDict[str, str]" = OrderedDict()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._prefetch_task: Optional[asyncio.Task] = None
+        self._stale = False
+
+    # ---- facet index ----
+
+    async def refresh(self) -> bool:
+        categories = await api.get_categories()
+        facets = await api.get_facets()
+        if categories is None or facets is None:
+            logger.warning("Gallery index refresh failed, keeping previous index")
+            return False
+
+        names = {cat["id"]: cat["name"] for cat in categories}
+        entries = []
+        for facet in facets:
+            name = names.get(facet["category_id"], facet["category_id"])
+            tags = facet.get("tags") or []
+            terms = {facet["category_id"].lower(), str(facet["year"])}
+            terms.update(word.lower() for word in name.split())
+            terms.update(word.lower() for word in facet["category_id"].split("-"))
+            terms.update(tag.lower() for tag in tags)
+            entries.append(FacetEntry(
+                category_id=facet["category_id"],
+                category_name=name,
+                year=facet["year"],
+                count=facet["count"],
+                tags=tags,
+                terms=tuple(terms),
+            ))
+        entries.sort(key=lambda entry: (-entry.year, entry.category_name))
+        self.facets = entries
+        self.loaded_at = time.monotonic()
+        self._stale = False
+        logger.info(f"Gallery index refreshed: {len(entries)} category/year facets")
+
+        # Warm first pages without holding up the caller
+        self._prefetch_task = asyncio.create_task(self._prefetch(entries[:PREFETCH_LIMIT]))
+        return True
+
+    async def _prefetch(self, entries: List[FacetEntry]):
+        for entry in entries:
+            await self.get_page(Selection(entry.category_id, entry.category_name, entry.year), 1)
+
+    async def ensure_fresh(self):
+        """Load the index on first use; afterwards refresh it without blocking callers"""
+        if self.loaded_at is None:
+            await self.refresh()
+        elif self._stale or time.monotonic() - self.loaded_at > INDEX_TTL:
+            if self._refresh_task is None or self._refresh_task.done():
+                self._refresh_task = asyncio.create_task(self.refresh())
+
+    def resolve(self, query: str) -> List[Selection]:
+        """Match every query token by prefix against category names, years and tags"""
+        tokens = [token.lower() for token in query.split() if token.strip()]
+        selections = []
+        for entry in self.facets:
+            tag = None
+            matched = True
+            for token in tokens:
+                terms = [term for term in entry.terms if term.startswith(token)]
+                if not terms:
+                    matched = False
+                    break
+                # A token that only matches tags narrows the results to that tag
+                tag_hits = [t for t in entry.tags if t.lower() in terms]
+                if tag_hits and len(tag_hits) == len(terms):
+                    tag = tag_hits[0]
+            if matched:
+                selections.append(Selection(entry.category_id, entry.category_name, entry.year, tag))
+        return selections
+
+    # ---- result pages ----
+
+    async def get_page(self, selection: Selection, page: int) -> Optional[dict]:
+        key = (selection.category_id, selection.year, selection.tag, page)
+        cached = self.pages.get(key)
+        if cached and time.monotonic() - cached[0] < PAGE_TTL:
+            self.pages.move_to_end(key)
+            return cached[1]
+
+        data = await api.get_images(
+            selection.category_id, selection.year, page, INLINE_PAGE_SIZE, tag=selection.tag
+        )
+        if data is None:
+            # Serve a stale page rather than nothing
+            return cached[1] if cached else None
+
+        self.pages[key] = (time.monotonic(), data)
+        self.pages.move_to_end(key)
+        while len(self.pages) > MAX_CACHED_PAGES:
+            self.pages.popitem(last=False)
+        return data
+
+    def invalidate(self, category_id: Optional[str] = None, year: Optional[int] = None):
+        """Drop cached pages (all of them, one category, or one category/year)"""
+        for key in list(self.pages):
+            if category_id is None or (key[0] == category_id and (year is None or key[1] == year)):
+                del self.pages[key]
+        # Counts and tags may have changed as well
+        self._stale = True
+
+    def invalidate_facets(self):
+        """Category names changed; rebuild the index on the next query"""
+        self._stale = True
+
+    # ---- Telegram file_id cache ----
+
+    def remember_file_id(self, url: str, file_id: str):
+        self.file_ids[url] = file_id
+        self.file_ids.move_to_end(url)
+        while len(self.file_ids) > MAX_FILE_IDS:
+            self.file_ids.popitem(last=False)
+
+    def file_id_for(self, url: str) -> Optional[str]:
+        return self.file_ids.get(url)
+
+
+# Shared instance used by the handlers
+gallery_index = GalleryIndex()
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import re
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
+from bot import api
+from bot.broadcast import broadcast_stats
+from bot.helpers import is_admin
+from bot.circuit import breaker_states
+from bot.invalidation import invalidate_caches
+from bot.profiling import profile_store, profiled_users
+from bot.scheduler import scheduler
+from bot.sessions import SESSION_TIMEOUT, bulk_confirmations, session_metrics
+from bot.warmup import warmup_metrics
+
+logger = logging.getLogger(__name__)
+
+OBJECT_ID = re.compile(r"^[0-9a-f]{24}$")
+POLL_INTERVAL = 1.0
+POLL_TIMEOUT = 300
+
+DELETE_USAGE = (
+    "Usage:\n"
+    "/delete <image id> [<image id> ...]\n"
+    "/delete <category> [<year>]"
+)
+MOVE_USAGE = (
+    "Usage:\n"
+    "/move <image id> [<image id> ...] to <category> [<year>]\n"
+    "/move <category> [<year>] to <category> [<year>]"
+)
+
+
+def _parse_selection(args):
+    """Turn command arguments into a bulk selection payload"""
+    if not args:
+        return None
+    if all(OBJECT_ID.match(arg) for arg in args):
+        return {"ids": args}
+    if len(args) > 2 or (len(args) == 2 and not args[1].isdigit()):
+        return None
+    selection = {"category": args[0]}
+    if len(args) == 2:
+        selection["year"] = int(args[1])
+    return selection
+
+
+def _parse_target(args):
+    target = {}
+    for arg in args:
+        if arg.isdigit() and "target_year" not in target:
+            target["target_year"] = int(arg)
+        elif not arg.isdigit() and "target_category" not in target:
+            target["target_category"] = arg
+        else:
+            return None
+    return target or None
+
+
+async def _preview(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str, payload: dict):
+    preview = await api.bulk_operation(kind, {**payload, "dry_run": True})
+    if preview is None:
+        await update.message.reply_text("❌ Could not check the selection. Please try again.")
+        return
+    if not preview["total"]:
+        await update.message.reply_text("No images match that selection.")
+        return
+
+    confirmation = bulk_confirmations.start(update.effective_user.id)
+    confirmation.kind = kind
+    confirmation.payload = payload
+    verb = "Delete" if kind == "delete" else "Move"
+    keyboard = [[
+        InlineKeyboardButton(f"✅ {verb} {preview['total']} images", callback_data="bulk_confirm"),
+        InlineKeyboardButton("❌ Cancel", callback_data="bulk_cancel")
+    ]]
+    await update.message.reply_text(
+        f"⚠️ This will {verb.lower()} {preview['total']} images. Continue?",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Delete images by ID or by category/year (admins only)"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("🚫 You are not authorized to use this command.")
+        return
+    payload = _parse_selection(context.args)
+    if payload is None:
+        await update.message.reply_text(DELETE_USAGE)
+        return
+    await _preview(update, context, "delete", payload)
+
+
+async def move_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Move images to another category/year (admins only)"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("🚫 You are not authorized to use this command.")
+        return
+    args = context.args or []
+    if "to" not in args:
+        await update.message.reply_text(MOVE_USAGE)
+        return
+    split = args.index("to")
+    payload = _parse_selection(args[:split])
+    target = _parse_target(args[split + 1:])
+    if payload is None or target is None:
+        await update.message.reply_text(MOVE_USAGE)
+        return
+    await _preview(update, context, "move", {**payload, **target})
+
+
+async def _follow_operation(message, op: dict):
+    """Wait for a bulk operation to finish, then refresh caches and report"""
+    waited = 0.0
+    while op["status"] in ("preparing", "pending", "running") and waited < POLL_TIMEOUT:
+        await asyncio.sleep(POLL_INTERVAL)
+        waited += POLL_INTERVAL
+        op = await api.get_bulk_operation(op["id"]) or op
+
+    # The backend's event stream does this too, but only when change streams are available
+    for key in op["affected"]:
+        invalidate_caches(key["category_id"], key["year"])
+
+    verb = "Deleted" if op["kind"] == "delete" else "Moved"
+    if op["status"] == "completed":
+        await message.edit_text(f"✅ {verb} {op['processed']} images.")
+    elif op["status"] == "failed":
+        # Plain text: the error comes straight from the backend and may contain Markdown characters
+        keyboard = [[InlineKeyboardButton("🔁 Resume", callback_data=f"bulk_resume:{op['id']}")]]
+        await message.edit_text(
+            f"❌ Stopped after {op['processed']}/{op['total']} images: {op['error']}",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    else:
+        await message.edit_text(
+            f"⏳ Still running ({op['processed']}/{op['total']}). Operation `{op['id']}`.",
+            parse_mode='Markdown'
+        )
+
+
+async def handle_bulk_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start or cancel the previewed bulk operation"""
+    query = update.callback_query
+    await query.answer()
+
+    pending = bulk_confirmations.end(update.effective_user.id)
+    if query.data == "bulk_cancel" or pending is None:
+        await query.edit_message_text("Bulk operation cancelled.")
+        return
+    if not is_admin(update.effective_user.id):
+        await query.edit_message_text("🚫 You are not authorized to do this.")
+        return
+
+    kind, payload = pending.kind, pending.payload
+    op = await api.bulk_operation(kind, payload)
+    if op is None:
+        await query.edit_message_text("❌ Failed to start the bulk operation.")
+        return
+
+    await query.edit_message_text(f"⏳ Working on {op['total']} images...")
+    # Poll in the background so other updates keep flowing
+    context.application.create_task(_follow_operation(query.message, op), update=update)
+
+
+async def handle_bulk_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Pick a failed bulk operation up where it stopped"""
+    query = update.callback_query
+    await query.answer()
+    if not is_admin(update.effective_user.id):
+        await query.edit_message_text("🚫 You are not authorized to do this.")
+        return
+
+    op = await api.resume_bulk_operation(query.data.split(":", 1)[1])
+    if op is None:
+        await query.edit_message_text("❌ Failed to resume the bulk operation.")
+        return
+
+    await query.edit_message_text(f"⏳ Resuming at {op['processed']}/{op['total']} images...")
+    # The reply is the operation as it was before the restart, so poll at least once
+    context.application.create_task(_follow_operation(query.message, {**op, "status": "pending"}), update=update)
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show bot runtime metrics (admins only)"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("🚫 You are not authorized to use this command.")
+        return
+    lines = ["📊 Send queue:"]
+    lines += [f"- {name}: {value:.0f}" for name, value in scheduler.metrics().items()]
+    lines.append("\n🔌 Backend circuits:")
+    lines += [f"- {name}: {state}" for name, state in breaker_states().items()] or ["- no calls yet"]
+    warmup = warmup_metrics()
+    lines.append("\n🔥 Cache warm-up:")
+    lines.append(f"- runs: {warmup['runs']}, refreshed: {warmup['refreshed']}, failed: {warmup['failed']}")
+    lines.append(
+        f"- duration: last {warmup['last_ms']:.0f} ms, p50 {warmup['p50_ms']:.0f} ms, max {warmup['max_ms']:.0f} ms"
+    )
+    if warmup["next_in_s"] is not None:
+        lines.append(f"- next run in {warmup['next_in_s']:.0f}s")
+    if warmup["last_error"]:
+        lines.append(f"- last error: {warmup['last_error']}")
+    lines.append(f"\n🧠 Sessions (expire after {SESSION_TIMEOUT}s idle):")
+    lines += [
+        f"- {name}: {gauge['live']} live, {gauge['bytes'] / 1024:.1f} KB, {gauge['evicted']} expired"
+        for name, gauge in session_metrics().items()
+    ]
+    lines.append("\n🔔 Broadcasts:")
+    lines.append(
+        f"- queued: {broadcast_stats['queued']}, sent: {broadcast_stats['sent']}, "
+        f"failed: {broadcast_stats['failed']}, unsubscribed: {broadcast_stats['removed']}"
+    )
+    if broadcast_stats["last_error"]:
+        lines.append(f"- last error: {broadcast_stats['last_error']}")
+    await update.message.reply_text("\n".join(lines))
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Profile your own updates: /profile on, /profile off, /profile (list recent profiles)"""
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        await update.message.reply_text("🚫 You are not authorized to use this command.")
+        return
+    action = context.args[0].lower() if context.args else "list"
+    if action == "on":
+        profiled_users.add(user_id)
+        await update.message.reply_text("🔬 Profiling your updates. Send /profile off to stop.")
+    elif action == "off":
+        profiled_users.discard(user_id)
+        await update.message.reply_text("Profiling stopped.")
+    else:
+        profiles = profile_store.list()[:10]
+        lines = [f"🔬 Recent profiles in {profile_store.directory}:"]
+        lines += [f"- {profile['name']} ({profile['size']} bytes)" for profile in profiles] or ["- none yet"]
+        await update.message.reply_text("\n".join(lines))
+
+
+def get_admin_handlers():
+    return [
+        CommandHandler("stats", stats_command),
+        CommandHandler("profile", profile_command),
+        CommandHandler("delete", delete_command),
+        CommandHandler("move", move_command),
+        CallbackQueryHandler(handle_bulk_confirmation, pattern=r"^bulk_(confirm|cancel)$"),
+        CallbackQueryHandler(handle_bulk_resume, pattern=r"^bulk_resume:[0-9a-f]{24}$"),
+    ]
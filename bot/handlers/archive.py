@@ -0,0 +1,63 @@
+import logging
+import os
+import tempfile
+from telegram import Update
+from telegram.ext import ContextTypes, CommandHandler
+from bot import api
+from bot.gallery_index import gallery_index
+
+logger = logging.getLogger(__name__)
+
+# Bots may send documents up to 50 MB; only try when the archive is likely to fit
+DOCUMENT_MAX_IMAGES = 25
+DOCUMENT_MAX_BYTES = 48 * 1024 * 1024
+
+USAGE = "Usage: /archive <category> <year>\nExample: /archive easter 2024"
+
+
+async def archive_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send a ZIP of a category/year, or a download link when it is too big for Telegram"""
+    args = context.args or []
+    if not any(arg.isdigit() for arg in args):
+        await update.message.reply_text(USAGE)
+        return
+
+    await gallery_index.ensure_fresh()
+    years = {int(arg) for arg in args if arg.isdigit()}
+    matches = [s for s in gallery_index.resolve(" ".join(args)) if s.year in years and s.tag is None]
+    if not matches:
+        await update.message.reply_text("❌ No images found for that category and year.")
+        return
+    selection = matches[0]
+    count = next(
+        (entry.count for entry in gallery_index.facets
+         if entry.category_id == selection.category_id and entry.year == selection.year),
+        0
+    )
+    title = f"{selection.category_name} {selection.year}"
+    link = api.archive_url(selection.category_id, selection.year)
+
+    if count > DOCUMENT_MAX_IMAGES:
+        await update.message.reply_text(f"📦 {title} ({count} photos):\n{link}")
+        return
+
+    status_message = await update.message.reply_text(f"⏳ Packing {count} photos from {title}...")
+    fd, path = tempfile.mkstemp(suffix=".zip")
+    os.close(fd)
+    try:
+        if await api.download_archive(selection.category_id, selection.year, path, DOCUMENT_MAX_BYTES):
+            with open(path, "rb") as f:
+                await update.message.reply_document(
+                    document=f,
+                    filename=f"{selection.category_id}-{selection.year}.zip",
+                    caption=f"📦 {title}"
+                )
+            await status_message.delete()
+        else:
+            await status_message.edit_text(f"📦 {title} could not be sent here, download it instead:\n{link}")
+    finally:
+        os.remove(path)
+
+
+def get_archive_handlers():
+    return [CommandHandler("archive", archive_command)]
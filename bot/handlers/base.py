@@ -2,6 +2,7 @@ from telegram import Update
 from telegram.ext import ContextTypes, CommandHandler, ConversationHandler
 from bot import api
 from bot.helpers import is_admin
+from bot.sessions import end_sessions
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send welcome message with admin status"""
@@ -11,7 +12,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Hi {user.first_name}! {admin_status}\n\n"
         "Use /upload to add new images (admins only)\n"
         "Use /browse to view images\n"
-        "Use /categories to see available categories"
+        "Use /archive easter 2024 to download a whole year as a ZIP\n"
+        "Use /categories to see available categories\n"
+        "Use /subscribe to hear about new photos in a category\n"
+        f"Type @{context.bot.username} easter 2024 in any chat to search inline"
     )
 
 async def id_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -37,9 +41,7 @@ async def list_categories(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel any ongoing operation"""
     # Clear all conversation data
-    keys_to_remove = ['category_id', 'category_name', 'year', 'page', 'upload_data']
-    for key in keys_to_remove:
-        context.user_data.pop(key, None)
+    end_sessions(update.effective_user.id)
     
     await update.message.reply_text("Operation cancelled.")
     return ConversationHandler.END
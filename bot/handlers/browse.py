@@ -1,18 +1,20 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from telegram.ext import ContextTypes, CallbackQueryHandler, ConversationHandler
 from bot import api
+from bot.gallery_index import gallery_index
+from bot.scheduler import scheduler
+from bot.sessions import browse_sessions
+from bot.views import record_views
 from bot.states import SELECTING_CATEGORY, SELECTING_YEAR, VIEWING_IMAGES
 
 async def start_browse(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the browsing process"""
-    # Clear any previous browsing data
-    context.user_data.pop('category_id', None)
-    context.user_data.pop('category_name', None)
-    context.user_data.pop('year', None)
-    context.user_data.pop('page', None)
+    # Replace any previous browsing data
+    browse_sessions.start(update.effective_user.id)
     
     categories = await api.get_categories()
     if not categories:
+        browse_sessions.end(update.effective_user.id)
         # Handle both message and callback query cases
         if update.message:
             await update.message.reply_text("❌ No categories available.")
@@ -50,25 +52,29 @@ async def category_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Handle cancel action
     if query.data == "cancel_browse":
+        browse_sessions.end(update.effective_user.id)
         await query.edit_message_text("Browsing cancelled.")
         return ConversationHandler.END
     
+    session = browse_sessions.get(update.effective_user.id)
     # Check if this is a callback from navigation or initial selection
     if query.data.startswith("category_"):
+        if session is None:
+            session = browse_sessions.start(update.effective_user.id)
         category_id = query.data.split('_')[1]
-        context.user_data['category_id'] = category_id
-        context.user_data['category_name'] = next(
+        session.category_id = category_id
+        session.category_name = next(
             (button.text for row in query.message.reply_markup.inline_keyboard 
              for button in row if button.callback_data == query.data), 
             category_id
         )
     
-    # Ensure category_id exists in context
-    if 'category_id' not in context.user_data:
+    # Ensure a category was chosen
+    if session is None or session.category_id is None:
         await query.edit_message_text("Category not found. Please start over.")
         return await start_browse(update, context)
     
-    category_id = context.user_data['category_id']
+    category_id = session.category_id
     
     years = await api.get_years(category_id)
     if not years:
@@ -79,7 +85,7 @@ async def category_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await query.edit_message_text(
-            f"No images available for category: {context.user_data['category_name']}",
+            f"No images available for category: {session.category_name}",
             reply_markup=reply_markup
         )
         return SELECTING_CATEGORY
@@ -98,7 +104,7 @@ async def category_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     await query.edit_message_text(
-        f"📅 Select a year for category: {context.user_data['category_name']}",
+        f"📅 Select a year for category: {session.category_name}",
         reply_markup=reply_markup
     )
     return SELECTING_YEAR
@@ -110,23 +116,30 @@ async def year_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Handle cancel action
     if query.data == "cancel_browse":
+        browse_sessions.end(update.effective_user.id)
         await query.edit_message_text("Browsing cancelled.")
         return ConversationHandler.END
     
-    year = int(query.data.split('_')[1])
-    context.user_data['year'] = year
-    context.user_data['page'] = 1
+    session = browse_sessions.get(update.effective_user.id)
+    if session is not None:
+        session.year = int(query.data.split('_')[1])
+        session.page = 1
     
     return await show_images(update, context)
 
+def _send_text(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str, reply_markup=None):
+    """Queue a message through the send scheduler"""
+    scheduler.submit(chat_id, [(lambda: context.bot.send_message(chat_id, text, reply_markup=reply_markup), 1)])
+
 async def show_images(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show images for the current page"""
     query = update.callback_query
     if query:
         await query.answer()
     
-    # Check if required data exists in context
-    if 'category_id' not in context.user_data or 'year' not in context.user_data:
+    # Sessions expire along with the conversation
+    session = browse_sessions.get(update.effective_user.id)
+    if session is None or session.category_id is None or session.year is None:
         chat_id = query.message.chat_id if query and query.message else update.effective_chat.id
         await context.bot.send_message(
             chat_id,
@@ -134,9 +147,10 @@ async def show_images(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ConversationHandler.END
     
-    category_id = context.user_data['category_id']
-    year = context.user_data['year']
-    page = context.user_data.get('page', 1)
+    category_id = session.category_id
+    category_name = session.category_name
+    year = session.year
+    page = session.page
     per_page = 5
     
     data = await api.get_images(category_id, year, page, per_page)
@@ -151,11 +165,7 @@ async def show_images(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await context.bot.send_message(
-            chat_id,
-            "❌ Failed to load images.",
-            reply_markup=reply_markup
-        )
+        _send_text(context, chat_id, "❌ Failed to load images.", reply_markup)
         return VIEWING_IMAGES
     
     images = data['items']
@@ -173,11 +183,7 @@ async def show_images(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await context.bot.send_message(
-            chat_id,
-            "No images found for this selection.",
-            reply_markup=reply_markup
-        )
+        _send_text(context, chat_id, "No images found for this selection.", reply_markup)
         return VIEWING_IMAGES
     
     chat_id = query.message.chat_id if query and query.message else update.effective_chat.id
@@ -186,16 +192,23 @@ async def show_images(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for img in images:
         media_group.append(InputMediaPhoto(
             media=img['url'],
-            caption=f"📅 {year} | {context.user_data['category_name']}\n" +
+            caption=f"📅 {year} | {category_name}\n" +
                     (f"🏷️ Tags: {', '.join(img['tags'])}\n" if img['tags'] else "") +
                     f"🔼 Uploaded at: {img['uploaded_at']}"
             if len(media_group) == 0 else img['url']
         ))
     
-    await context.bot.send_media_group(
-        chat_id=chat_id,
-        media=media_group
-    )
+    async def send_media():
+        messages = await context.bot.send_media_group(
+            chat_id=chat_id,
+            media=media_group
+        )
+        # Remember Telegram's file_ids so inline results can reuse the uploaded photos
+        for img, message in zip(images, messages):
+            if message.photo:
+                gallery_index.remember_file_id(img['url'], message.photo[-1].file_id)
+        # Counted once delivered, so pages merged away by the scheduler don't count
+        record_views(images)
     
     keyboard_buttons = []
     if page > 1:
@@ -209,37 +222,88 @@ async def show_images(update: Update, context: ContextTypes.DEFAULT_TYPE):
         InlineKeyboardButton("❌ Cancel", callback_data="cancel_browse")
     ]
     
+    # "More like this", one button per photo in the album
+    similar_buttons = [
+        InlineKeyboardButton(f"🔍 {number}", callback_data=f"similar_{img['id']}")
+        for number, img in enumerate(images, start=1)
+    ]
+    
     # Create keyboard layout
-    keyboard = []
+    keyboard = [similar_buttons]
     if keyboard_buttons:
         keyboard.append(keyboard_buttons)
     keyboard.append(navigation_buttons)
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text=f"📷 Page {page}/{total_pages} | Total images: {total_count}",
-        reply_markup=reply_markup
+    async def send_navigation():
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"📷 Page {page}/{total_pages} | Total images: {total_count}",
+            reply_markup=reply_markup
+        )
+    
+    # Queued rather than awaited: if the user pages on before this is sent,
+    # the newer page replaces it instead of both going out
+    scheduler.submit(
+        chat_id,
+        [(send_media, len(media_group)), (send_navigation, 1)],
+        merge_key=("browse", chat_id, update.effective_user.id)
     )
     
     return VIEWING_IMAGES
 
+async def show_similar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send the photos that look most like the chosen one"""
+    query = update.callback_query
+    await query.answer()
+    chat_id = query.message.chat_id if query.message else update.effective_chat.id
+    
+    images = await api.get_similar_images(query.data.split('_', 1)[1])
+    if images is None:
+        _send_text(context, chat_id, "❌ Similar photos aren't available for this one right now.")
+        return VIEWING_IMAGES
+    if not images:
+        _send_text(context, chat_id, "No similar photos found.")
+        return VIEWING_IMAGES
+    
+    media_group = [
+        InputMediaPhoto(
+            media=img['url'],
+            caption=f"🔍 {len(images)} similar photo{'s' if len(images) > 1 else ''}" if number == 0 else None
+        )
+        for number, img in enumerate(images)
+    ]
+    
+    async def send_media():
+        if len(media_group) == 1:
+            # Albums need at least two photos
+            messages = [await context.bot.send_photo(chat_id, images[0]['url'], caption=media_group[0].caption)]
+        else:
+            messages = await context.bot.send_media_group(chat_id=chat_id, media=media_group)
+        for img, message in zip(images, messages):
+            if message.photo:
+                gallery_index.remember_file_id(img['url'], message.photo[-1].file_id)
+        record_views(images)
+    
+    scheduler.submit(chat_id, [(send_media, len(media_group))])
+    return VIEWING_IMAGES
+
 async def handle_pagination(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle pagination button presses"""
     query = update.callback_query
     await query.answer()
     
-    if query.data == "prev_page":
-        context.user_data['page'] -= 1
-        return await show_images(update, context)
-    elif query.data == "next_page":
-        context.user_data['page'] += 1
+    session = browse_sessions.get(update.effective_user.id)
+    if query.data in ("prev_page", "next_page"):
+        if session is not None:
+            session.page = max(session.page + (1 if query.data == "next_page" else -1), 1)
         return await show_images(update, context)
     elif query.data == "back_years":
         # Clear the current image data but keep category info
-        context.user_data.pop('year', None)
-        context.user_data.pop('page', None)
+        if session is not None:
+            session.year = None
+            session.page = 1
         
         # Check if we have a message to edit
         if query.message:
@@ -248,13 +312,7 @@ async def handle_pagination(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # If no message, start fresh
             return await start_browse(update, context)
     elif query.data == "back_categories":
-        # Clear all browsing data
-        context.user_data.pop('category_id', None)
-        context.user_data.pop('category_name', None)
-        context.user_data.pop('year', None)
-        context.user_data.pop('page', None)
-        
-        # Check if we have a message to edit
+        # start_browse replaces the session, clearing all browsing data
         if query.message:
             # Send a new message instead of trying to edit
             await query.message.reply_text("Returning to categories...")
@@ -263,14 +321,21 @@ async def handle_pagination(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # If no message, start fresh
             return await start_browse(update, context)
     elif query.data == "cancel_browse":
+        browse_sessions.end(update.effective_user.id)
         await query.edit_message_text("Browsing cancelled.")
         return ConversationHandler.END
     
     return VIEWING_IMAGES
 
+async def browse_timed_out(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Drop the session as soon as the conversation times out"""
+    if update.effective_user:
+        browse_sessions.end(update.effective_user.id)
+
 def get_browse_handlers():
     return [
         CallbackQueryHandler(category_selected, pattern="^category_"),
         CallbackQueryHandler(year_selected, pattern="^year_"),
+        CallbackQueryHandler(show_similar, pattern="^similar_"),
         CallbackQueryHandler(handle_pagination)
     ]
\ No newline at end of file
@@ -0,0 +1,81 @@
+import hashlib
+import logging
+from typing import Tuple
+from telegram import Update, InlineQueryResultCachedPhoto, InlineQueryResultPhoto
+from telegram.ext import ContextTypes, InlineQueryHandler
+from bot.gallery_index import gallery_index
+
+logger = logging.getLogger(__name__)
+
+INLINE_CACHE_TIME = 300  # seconds Telegram may reuse an answer for the same query
+
+
+def _caption(selection, img):
+    caption = f"📅 {selection.year} | {selection.category_name}"
+    if img.get('tags'):
+        caption += f"\n🏷️ Tags: {', '.join(img['tags'])}"
+    return caption
+
+
+def _result(selection, img):
+    result_id = hashlib.md5(img['url'].encode()).hexdigest()
+    file_id = gallery_index.file_id_for(img['url'])
+    if file_id:
+        return InlineQueryResultCachedPhoto(
+            id=result_id,
+            photo_file_id=file_id,
+            caption=_caption(selection, img)
+        )
+    return InlineQueryResultPhoto(
+        id=result_id,
+        photo_url=img['url'],
+        thumbnail_url=img['url'],
+        caption=_caption(selection, img)
+    )
+
+
+def _parse_offset(offset: str) -> Tuple[int, int]:
+    index, _, page = offset.partition(":")
+    if index.isdigit() and page.isdigit():
+        return int(index), max(int(page), 1)
+    return 0, 1
+
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer `@bot <category> <year> <tag>` queries from the in-memory gallery index"""
+    query = update.inline_query
+    await gallery_index.ensure_fresh()
+
+    selections = gallery_index.resolve(query.query)
+    if not selections:
+        await query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
+
+    # Best match first (facets are ordered by most recent year); the offset is
+    # "<selection>:<page>" so scrolling continues into the other matches
+    index, page = _parse_offset(query.offset)
+    while index < len(selections):
+        selection = selections[index]
+        data = await gallery_index.get_page(selection, page)
+        if data and data['items']:
+            break
+        index, page = index + 1, 1
+    else:
+        await query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
+
+    if page * data['per_page'] < data['total_count']:
+        next_offset = f"{index}:{page + 1}"
+    elif index + 1 < len(selections):
+        next_offset = f"{index + 1}:1"
+    else:
+        next_offset = ""
+    await query.answer(
+        [_result(selection, img) for img in data['items']],
+        cache_time=INLINE_CACHE_TIME,
+        next_offset=next_offset
+    )
+
+
+def get_inline_handlers():
+    return [InlineQueryHandler(inline_query)]
@@ -0,0 +1,75 @@
+import logging
+from typing import List, Optional
+from telegram import Update
+from telegram.ext import ContextTypes, CommandHandler
+from bot import api
+
+logger = logging.getLogger(__name__)
+
+
+def _find_category(categories: List[dict], name: str) -> Optional[dict]:
+    name = name.strip().lower()
+    return next(
+        (cat for cat in categories if cat["id"].lower() == name or cat["name"].lower() == name),
+        None
+    )
+
+
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Follow a category: /subscribe <category>; without one, list what can be followed"""
+    chat_id = update.effective_chat.id
+    categories = await api.get_categories()
+    if not categories:
+        await update.message.reply_text("❌ Failed to fetch categories.")
+        return
+
+    if not context.args:
+        subscribed = set(await api.get_subscriptions(chat_id) or [])
+        lines = ["🔔 Get a message when new photos are added to a category.", "Usage: /subscribe <category>\n"]
+        lines += [f"{'✅' if cat['id'] in subscribed else '▫️'} {cat['name']}" for cat in categories]
+        await update.message.reply_text("\n".join(lines))
+        return
+
+    category = _find_category(categories, " ".join(context.args))
+    if category is None:
+        await update.message.reply_text("❌ No such category. Send /subscribe to see them all.")
+        return
+    result = await api.subscribe(chat_id, category["id"])
+    if result is None:
+        await update.message.reply_text("❌ Could not subscribe right now, please try again later.")
+    elif result is False:
+        await update.message.reply_text("❌ That category no longer exists.")
+    else:
+        logger.info(f"Chat {chat_id} subscribed to {category['id']}")
+        await update.message.reply_text(
+            f"🔔 You'll be told when new photos are added to {category['name']}.\n"
+            "Send /unsubscribe to stop."
+        )
+
+
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stop following a category: /unsubscribe <category>, or every category without one"""
+    chat_id = update.effective_chat.id
+    category = None
+    if context.args:
+        category = _find_category(await api.get_categories() or [], " ".join(context.args))
+        if category is None:
+            await update.message.reply_text("❌ No such category.")
+            return
+
+    removed = await api.unsubscribe(chat_id, category["id"] if category else None)
+    if removed is None:
+        await update.message.reply_text("❌ Could not unsubscribe right now, please try again later.")
+    elif not removed:
+        await update.message.reply_text("You weren't subscribed.")
+    elif category:
+        await update.message.reply_text(f"🔕 Unsubscribed from {category['name']}.")
+    else:
+        await update.message.reply_text("🔕 Unsubscribed from every category.")
+
+
+def get_subscription_handlers():
+    return [
+        CommandHandler("subscribe", subscribe_command),
+        CommandHandler("unsubscribe", unsubscribe_command),
+    ]
@@ -5,12 +5,18 @@ from telegram.ext import ContextTypes, CallbackQueryHandler, MessageHandler, fil
 from bot import api
 from telegram.error import TimedOut
 import asyncio
+from typing import Optional
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from bot.broadcast import end_upload_batch, notify_upload
 from bot.helpers import is_admin
+from bot.invalidation import invalidate_caches
+from bot.sessions import upload_sessions
 from bot.states import UPLOAD_SELECT_CATEGORY, UPLOAD_GET_YEAR, UPLOAD_GET_IMAGES, UPLOAD_NEXT_ACTION
 
 logger = logging.getLogger(__name__)
 
+SESSION_EXPIRED = "⌛ Your upload session expired. Send /upload to start again."
+
 async def start_upload_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     logger.info(f"Upload flow started by user {user.id}")
@@ -20,15 +26,12 @@ async def start_upload_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
     
     # Initialize upload state
-    context.user_data['upload_state'] = {
-        'category_id': None,
-        'category_name': None,
-        'year': None
-    }
+    upload_sessions.start(user.id)
     
     # Fetch categories
     categories = await api.get_categories()
     if not categories:
+        upload_sessions.end(user.id)
         await update.message.reply_text("❌ No categories available.")
         return ConversationHandler.END
     
@@ -50,6 +53,11 @@ async def handle_upload_category(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     await query.answer()
     
+    upload_state = upload_sessions.get(update.effective_user.id)
+    if upload_state is None:
+        await query.edit_message_text(SESSION_EXPIRED)
+        return ConversationHandler.END
+    
     # Extract category ID safely
     try:
         # Changed pattern to more generic "cat_"
@@ -60,23 +68,28 @@ async def handle_upload_category(update: Update, context: ContextTypes.DEFAULT_T
         for row in query.message.reply_markup.inline_keyboard:
             for button in row:
                 if button.callback_data == query.data:
-                    context.user_data['upload_state']['category_id'] = category_id
-                    context.user_data['upload_state']['category_name'] = button.text
+                    upload_state.category_id = category_id
+                    upload_state.category_name = button.text
                     break
     except Exception as e:
         logger.error(f"Error processing category selection: {str(e)}")
         await query.edit_message_text("❌ Error processing your selection. Please try again.")
         return ConversationHandler.END
     
-    logger.info(f"Category selected: {context.user_data['upload_state']['category_name']} (ID: {category_id})")
+    logger.info(f"Category selected: {upload_state.category_name} (ID: {category_id})")
     
     await query.edit_message_text(
-        f"✅ Category selected: {context.user_data['upload_state']['category_name']}\n\n"
+        f"✅ Category selected: {upload_state.category_name}\n\n"
         "📅 Now please enter the year for these images (e.g., 2025):"
     )
     return UPLOAD_GET_YEAR
 
 async def handle_upload_year(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    upload_state = upload_sessions.get(update.effective_user.id)
+    if upload_state is None:
+        await update.message.reply_text(SESSION_EXPIRED)
+        return ConversationHandler.END
+    
     try:
         year = int(update.message.text)
         if year < 2000 or year > 2100:
@@ -85,7 +98,7 @@ async def handle_upload_year(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("⚠️ Please enter a valid year between 2000 and 2100.")
         return UPLOAD_GET_YEAR
     
-    context.user_data['upload_state']['year'] = year
+    upload_state.year = year
     logger.info(f"Year set to: {year}")
     
     await update.message.reply_text(
@@ -95,6 +108,20 @@ async def handle_upload_year(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
     return UPLOAD_GET_IMAGES
 
+def _needs_fallback(response) -> bool:
+    """Remote upload unavailable (old backend, backend or Telegram trouble): send the bytes instead"""
+    return response is None or response.status_code in (404, 405) or response.status_code >= 500
+
+def _is_duplicate(response) -> bool:
+    """The backend refused the photo as a near-duplicate, not for some other conflict"""
+    if response is None or response.status_code != 409:
+        return False
+    try:
+        detail = response.json().get("detail")
+    except ValueError:
+        return False
+    return isinstance(detail, dict) and detail.get("reason") == "duplicate"
+
 @retry(
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=1, min=4, max=10),
@@ -103,9 +130,72 @@ async def handle_upload_year(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def download_with_retry(file, destination):
     await file.download_to_drive(destination)
 
+async def _upload_photo(context: ContextTypes.DEFAULT_TYPE, upload_state, user_id: int,
+                        file_id: str, file_unique_id: str, thumbnail_id: Optional[str],
+                        allow_duplicate: bool = False):
+    """Upload one photo, by reference if possible; returns the backend response or None"""
+    temp_file = None
+    data = {
+        "category": upload_state.category_id,
+        "year": upload_state.year,
+        "tags": "",
+        "uploaded_by": user_id,
+        "allow_duplicate": allow_duplicate
+    }
+    try:
+        response = None
+        if api.REMOTE_UPLOADS:
+            # The backend fetches the photo from Telegram, so it is never downloaded here
+            response = await api.upload_remote(
+                file_id, data, idempotency_key=file_unique_id, thumbnail_file_id=thumbnail_id
+            )
+        
+        if _needs_fallback(response):
+            file = await context.bot.get_file(file_id)
+            temp_file = f"temp_{file.file_id}.jpg"
+            
+            # Use retry mechanism for download
+            await download_with_retry(file, temp_file)
+            logger.info(f"Downloaded image to: {temp_file}")
+            
+            logger.debug(f"Sending upload request with data: {data}")
+            response = await api.upload_image(temp_file, data, idempotency_key=file_unique_id)
+        
+        if response and response.status_code == 200:
+            logger.info(f"Uploaded image successfully: {response.json().get('id')}")
+            # Cached pages for this category now live until expiry; don't wait for the event stream
+            invalidate_caches(upload_state.category_id, upload_state.year)
+            # Subscribers get one message per batch, once the uploads stop
+            notify_upload(context.job_queue, upload_state.category_id, upload_state.category_name, upload_state.year)
+        elif _is_duplicate(response):
+            logger.info(f"Upload refused as a near-duplicate: {response.text}")
+        else:
+            error_msg = response.text if response else "No response"
+            logger.error(f"Upload failed: {error_msg}")
+        return response
+    finally:
+        if temp_file and os.path.exists(temp_file):
+            os.remove(temp_file)
+            logger.debug(f"Removed temp file: {temp_file}")
+
+def _next_action_keyboard(duplicate: bool = False) -> InlineKeyboardMarkup:
+    keyboard = [
+        [InlineKeyboardButton("📤 Upload more for same category/year", callback_data="more_same")],
+        [InlineKeyboardButton("🔄 Change category/year", callback_data="change_settings")],
+        [InlineKeyboardButton("🚫 Stop uploading", callback_data="stop_upload")]
+    ]
+    if duplicate:
+        keyboard.insert(0, [InlineKeyboardButton("📥 Upload it anyway", callback_data="upload_duplicate")])
+    return InlineKeyboardMarkup(keyboard)
+
 async def handle_upload_images(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info("Image upload handler triggered")
     
+    upload_state = upload_sessions.get(update.effective_user.id)
+    if upload_state is None:
+        await update.message.reply_text(SESSION_EXPIRED)
+        return ConversationHandler.END
+    
     photos = update.message.photo
     if not photos:
         await update.message.reply_text("⚠️ Please send actual images.")
@@ -113,36 +203,20 @@ async def handle_upload_images(update: Update, context: ContextTypes.DEFAULT_TYP
 
     uploaded_count = 0
     failed_count = 0
-    upload_state = context.user_data['upload_state']
-    user = update.effective_user
+    upload_state.duplicate = None
 
-    # Process each photo (use highest quality version)
+    # Upload the highest quality version; the smallest is enough for the backend's duplicate check
     photo = photos[-1]
-    temp_file = None
+    thumbnail_id = photos[0].file_id if len(photos) > 1 else None
     try:
-        file = await context.bot.get_file(photo.file_id)
-        temp_file = f"temp_{file.file_id}.jpg"
-        
-        # Use retry mechanism for download
-        await download_with_retry(file, temp_file)
-        logger.info(f"Downloaded image to: {temp_file}")
-
-        data = {
-            "category": upload_state['category_id'],
-            "year": upload_state['year'],
-            "tags": "",
-            "uploaded_by": user.id
-        }
-        
-        logger.debug(f"Sending upload request with data: {data}")
-        response = await api.upload_image(temp_file, data)
-        
-        if response and response.status_code == 200:
+        response = await _upload_photo(
+            context, upload_state, update.effective_user.id, photo.file_id, photo.file_unique_id, thumbnail_id
+        )
+        if response is not None and response.status_code == 200:
             uploaded_count += 1
-            logger.info(f"Uploaded image successfully: {response.json().get('id')}")
+        elif _is_duplicate(response):
+            upload_state.duplicate = (photo.file_id, photo.file_unique_id, thumbnail_id)
         else:
-            error_msg = response.text if response else "No response"
-            logger.error(f"Upload failed: {error_msg}")
             failed_count += 1
             
     except TimedOut:
@@ -154,36 +228,49 @@ async def handle_upload_images(update: Update, context: ContextTypes.DEFAULT_TYP
     except Exception as e:
         logger.exception(f"Image upload error: {str(e)}")
         failed_count += 1
-    finally:
-        if temp_file and os.path.exists(temp_file):
-            os.remove(temp_file)
-            logger.debug(f"Removed temp file: {temp_file}")
     
     # Show results
     result_message = f"📤 Upload results:\n- ✅ Success: {uploaded_count}\n- ❌ Failed: {failed_count}"
+    if upload_state.duplicate:
+        result_message += f"\n- ♻️ Skipped: looks like a photo already in {upload_state.category_name} {upload_state.year}"
     await update.message.reply_text(result_message)
     
-    # Next action keyboard
-    keyboard = [
-        [InlineKeyboardButton("📤 Upload more for same category/year", callback_data="more_same")],
-        [InlineKeyboardButton("🔄 Change category/year", callback_data="change_settings")],
-        [InlineKeyboardButton("🚫 Stop uploading", callback_data="stop_upload")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await update.message.reply_text(
         "What would you like to do next?",
-        reply_markup=reply_markup
+        reply_markup=_next_action_keyboard(upload_state.duplicate is not None)
     )
     return UPLOAD_NEXT_ACTION
 
+async def _upload_duplicate(query, context: ContextTypes.DEFAULT_TYPE, upload_state, user_id: int):
+    """Store the photo last refused as a near-duplicate, because the admin asked to"""
+    duplicate, upload_state.duplicate = upload_state.duplicate, None
+    if duplicate is None:
+        await query.edit_message_text("Nothing left to upload.", reply_markup=_next_action_keyboard())
+        return UPLOAD_NEXT_ACTION
+    try:
+        response = await _upload_photo(context, upload_state, user_id, *duplicate, allow_duplicate=True)
+    except Exception as e:
+        logger.exception(f"Image upload error: {str(e)}")
+        response = None
+    text = "✅ Uploaded." if response is not None and response.status_code == 200 else "❌ Upload failed."
+    await query.edit_message_text(f"{text} What would you like to do next?", reply_markup=_next_action_keyboard())
+    return UPLOAD_NEXT_ACTION
+
 async def handle_upload_next_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
     choice = query.data
+    # Keeps the session alive while the admin decides
+    upload_state = upload_sessions.get(update.effective_user.id)
+    if upload_state is None and choice != "stop_upload":
+        await query.edit_message_text(SESSION_EXPIRED)
+        return ConversationHandler.END
     
-    if choice == "more_same":
+    if choice == "upload_duplicate":
+        return await _upload_duplicate(query, context, upload_state, update.effective_user.id)
+    
+    elif choice == "more_same":
         await query.edit_message_text("📤 Send me more images for the same category/year...")
         return UPLOAD_GET_IMAGES
     
@@ -206,19 +293,28 @@ async def handle_upload_next_action(update: Update, context: ContextTypes.DEFAUL
         return UPLOAD_SELECT_CATEGORY
     
     elif choice == "stop_upload":
+        upload_state = upload_sessions.end(update.effective_user.id)
+        if upload_state is not None and upload_state.category_id:
+            end_upload_batch(upload_state.category_id, upload_state.year)
         await query.edit_message_text("✅ Upload session ended. Thank you!")
         return ConversationHandler.END
     
     return UPLOAD_NEXT_ACTION
 
 async def cancel_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    upload_sessions.end(update.effective_user.id)
     await update.message.reply_text("❌ Upload process cancelled.")
     return ConversationHandler.END
 
+async def upload_timed_out(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Drop the session as soon as the conversation times out"""
+    if update.effective_user:
+        upload_sessions.end(update.effective_user.id)
+
 def get_upload_handlers():
     return [
         CallbackQueryHandler(handle_upload_category, pattern=r"^cat_"),
-        CallbackQueryHandler(handle_upload_next_action, pattern=r"^(more_same|change_settings|stop_upload)$"),
+        CallbackQueryHandler(handle_upload_next_action, pattern=r"^(more_same|change_settings|stop_upload|upload_duplicate)$"),
         MessageHandler(filters.TEXT & ~filters.COMMAND, handle_upload_year),
         MessageHandler(filters.PHOTO, handle_upload_images),
     ]
\ No newline at end of file
@@ -0,0 +1,20 @@
+from typing import Callable
+
+from telegram.ext import Application, ConversationHandler
+
+
+def wrap_handler_callbacks(application: Application, wrapper: Callable):
+    """Replace every registered handler callback, including those inside conversations, with ``wrapper(callback)``"""
+    def wrap(handler):
+        if isinstance(handler, ConversationHandler):
+            for inner in handler.entry_points + handler.fallbacks:
+                wrap(inner)
+            for handlers in handler.states.values():
+                for inner in handlers:
+                    wrap(inner)
+        elif hasattr(handler, "callback"):
+            handler.callback = wrapper(handler.callback)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            wrap(handler)
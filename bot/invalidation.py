@@ -0,0 +1,73 @@
+import asyncio
+import json
+import logging
+from datetime import timedelta
+from typing import Optional
+
+import httpx
+
+from bot import api
+from bot.gallery_index import gallery_index
+from bot.warmup import request_warmup
+
+logger = logging.getLogger(__name__)
+
+# Cache lifetimes while the backend is pushing invalidations, and without them
+PUSHED_CACHE_DURATION = timedelta(hours=1)
+POLLED_CACHE_DURATION = timedelta(minutes=5)
+
+
+def invalidate_caches(category_id: Optional[str] = None, year: Optional[int] = None):
+    """Drop everything the bot has cached for a category/year (or all of it)"""
+    api.invalidate(category_id)
+    gallery_index.invalidate(category_id, year)
+    request_warmup()
+
+
+def _apply(event: dict):
+    if "watching" in event:
+        _set_watching(event["watching"])
+    elif event.get("categories"):
+        api.invalidate_categories()
+        gallery_index.invalidate_facets()
+        request_warmup()
+    else:
+        invalidate_caches(event.get("category_id"), event.get("year"))
+
+
+async def listen_for_invalidations():
+    """Follow the backend's event stream, reconnecting with backoff"""
+    delay = 1
+    while True:
+        try:
+            async with httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=60.0)) as client:
+                async with client.stream(
+                    "GET", f"{api.BACKEND_URL}/events/", headers=api._get_headers()
+                ) as response:
+                    if response.status_code != 200:
+                        raise httpx.HTTPStatusError(
+                            f"Event stream returned {response.status_code}",
+                            request=response.request,
+                            response=response
+                        )
+                    # Anything could have changed while disconnected
+                    invalidate_caches()
+                    logger.info("Connected to backend invalidation stream")
+                    delay = 1
+                    async for line in response.aiter_lines():
+                        if line.startswith("data:"):
+                            _apply(json.loads(line[5:]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Invalidation stream unavailable: {str(e)}")
+
+        api.CACHE_DURATION = POLLED_CACHE_DURATION
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 60)
+
+
+def _set_watching(watching: bool):
+    # Long TTLs are only safe while the backend's change streams are live
+    api.CACHE_DURATION = PUSHED_CACHE_DURATION if watching else POLLED_CACHE_DURATION
+    logger.info(f"Backend change streams {'active' if watching else 'inactive'}")
@@ -1,15 +1,31 @@
 import logging
 import os
 from pathlib import Path
+from typing import Optional
 from dotenv import load_dotenv
-from telegram.ext import Application, CommandHandler, ConversationHandler, CallbackQueryHandler, MessageHandler, filters
+from telegram import Update
+from telegram.ext import Application, CommandHandler, ConversationHandler, CallbackQueryHandler, MessageHandler, TypeHandler, filters
 from bot.states import (
     SELECTING_CATEGORY, SELECTING_YEAR, VIEWING_IMAGES,
     UPLOAD_SELECT_CATEGORY, UPLOAD_GET_YEAR, UPLOAD_GET_IMAGES, UPLOAD_NEXT_ACTION
 )
 from bot.handlers.base import get_base_handlers, cancel_command
-from bot.handlers.browse import start_browse, get_browse_handlers
-from bot.handlers.upload import handle_upload_category, handle_upload_images, handle_upload_next_action, handle_upload_year, start_upload_flow, get_upload_handlers
+from bot.handlers.admin import get_admin_handlers
+from bot.handlers.archive import get_archive_handlers
+from bot.handlers.subscriptions import get_subscription_handlers
+from bot.handlers.browse import browse_timed_out, start_browse, get_browse_handlers
+from bot.handlers.inline import get_inline_handlers
+from bot.broadcast import broadcaster, flush_upload_batches
+from bot.invalidation import listen_for_invalidations
+from bot.instrumentation import wrap_handler_callbacks
+from bot.profiling import profiled
+from bot.tracing import configure_tracing, traced
+from bot.sessions import SESSION_SWEEP_INTERVAL, SESSION_TIMEOUT, evict_idle_sessions
+from bot.views import VIEW_FLUSH_INTERVAL, flush_views
+from bot.warmup import schedule_warmup
+from bot.scheduler import scheduler
+from bot import api
+from bot.handlers.upload import handle_upload_category, handle_upload_images, handle_upload_next_action, handle_upload_year, start_upload_flow, upload_timed_out, get_upload_handlers
 
 # Load environment variables from .env file in project root
 env_path = Path(__file__).parent.parent / '.env'
@@ -22,25 +38,60 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def main() -> None:
-    token = os.getenv("BOT_TOKEN")
-    if not token:
-        raise ValueError("BOT_TOKEN environment variable not set")
-    
-    application = (
+async def post_init(application: Application) -> None:
+    scheduler.start()
+    # Keep caches in sync with backend writes
+    application.create_task(listen_for_invalidations())
+    # Preload what /browse needs first, then keep refreshing it ahead of expiry
+    schedule_warmup(application.job_queue)
+    # Views are buffered and reported in batches, never one request per click
+    application.job_queue.run_repeating(flush_views, interval=VIEW_FLUSH_INTERVAL, name="flush_views")
+    # Catches sessions whose conversation never timed out, e.g. an unconfirmed /delete
+    application.job_queue.run_repeating(evict_idle_sessions, interval=SESSION_SWEEP_INTERVAL, name="evict_idle_sessions")
+    # Deliver new-photo notifications, including any a previous run left unfinished
+    broadcaster.start(application.bot)
+
+async def post_shutdown(application: Application) -> None:
+    await flush_upload_batches()
+    await broadcaster.stop()
+    await scheduler.stop()
+    await flush_views()
+    await api.close_client()
+
+def build_application(token: str, base_url: Optional[str] = None, base_file_url: Optional[str] = None) -> Application:
+    """Create the application with all handlers; the URLs let a harness point it at a fake Bot API"""
+    builder = (
         Application.builder()
         .token(token)
         .read_timeout(30)
         .write_timeout(30)
         .connect_timeout(30)
         .pool_timeout(30)
-        .build()
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
     )
+    if base_url:
+        builder = builder.base_url(base_url)
+    if base_file_url:
+        builder = builder.base_file_url(base_file_url)
+    application = builder.build()
     
     # Add base command handlers
     for handler in get_base_handlers():
         application.add_handler(handler)
     
+    # Add admin bulk delete/move handlers
+    for handler in get_admin_handlers():
+        application.add_handler(handler)
+    
+    # Add ZIP download handler
+    for handler in get_archive_handlers():
+        application.add_handler(handler)
+    
+    # Add /subscribe and /unsubscribe
+    for handler in get_subscription_handlers():
+        application.add_handler(handler)
+    
     # Add browse conversation handler
     browse_conv = ConversationHandler(
         entry_points=[CommandHandler("browse", start_browse)],
@@ -48,11 +99,12 @@ def main() -> None:
             SELECTING_CATEGORY: get_browse_handlers(),
             SELECTING_YEAR: get_browse_handlers(),
             VIEWING_IMAGES: get_browse_handlers(),
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, browse_timed_out)],
         },
         fallbacks=[CommandHandler("cancel", cancel_command)],
         per_user=True,
         per_chat=True,
-        conversation_timeout=300
+        conversation_timeout=SESSION_TIMEOUT
     )
     application.add_handler(browse_conv)
     
@@ -68,19 +120,37 @@ def main() -> None:
             ],
             UPLOAD_GET_IMAGES: [
                 MessageHandler(filters.PHOTO | filters.Document.IMAGE, handle_upload_images),
-                CallbackQueryHandler(handle_upload_next_action, pattern=r"^(more_same|change_settings|stop_upload)$")
+                CallbackQueryHandler(handle_upload_next_action, pattern=r"^(more_same|change_settings|stop_upload|upload_duplicate)$")
             ],
             UPLOAD_NEXT_ACTION: [
-                CallbackQueryHandler(handle_upload_next_action, pattern=r"^(more_same|change_settings|stop_upload)$")
-            ]
+                CallbackQueryHandler(handle_upload_next_action, pattern=r"^(more_same|change_settings|stop_upload|upload_duplicate)$")
+            ],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, upload_timed_out)],
         },
         fallbacks=[CommandHandler("cancel", cancel_command)],
         per_user=True,
         per_chat=True,
-        conversation_timeout=300
+        conversation_timeout=SESSION_TIMEOUT
     )
     application.add_handler(upload_conv)
     
+    # Add inline query handler (inline mode must be enabled with @BotFather)
+    for handler in get_inline_handlers():
+        application.add_handler(handler)
+    
+    # Lets /profile and BOT_PROFILE_SAMPLE_RATE profile any handler, inside the update's trace
+    configure_tracing()
+    wrap_handler_callbacks(application, profiled)
+    wrap_handler_callbacks(application, traced)
+    return application
+
+def main() -> None:
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        raise ValueError("BOT_TOKEN environment variable not set")
+    
+    application = build_application(token)
+    
     # Start the bot
     logger.info("Bot is starting...")
     application.run_polling()
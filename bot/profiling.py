@@ -0,0 +1,50 @@
+import asyncio
+import functools
+import logging
+import os
+import random
+from typing import Set
+
+from app.services.profiler import ProfileStore, profiler
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = float(os.getenv("BOT_PROFILE_SAMPLE_RATE", "0"))
+profile_store = ProfileStore(
+    os.getenv("BOT_PROFILE_DIR", "profiles/bot"),
+    max_profiles=int(os.getenv("BOT_PROFILE_MAX_FILES", "50")),
+)
+
+# Admins who turned on /profile; every update they send is profiled
+profiled_users: Set[int] = set()
+
+
+def profiled(callback):
+    """Wrap a handler callback so selected updates run under the sampling profiler"""
+    if getattr(callback, "__profiled__", False):
+        return callback
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        if not profiled_users and not SAMPLE_RATE:
+            return await callback(update, context)
+        user = getattr(update, "effective_user", None)
+        wanted = (user is not None and user.id in profiled_users) or (
+            SAMPLE_RATE and random.random() < SAMPLE_RATE
+        )
+        if not wanted:
+            return await callback(update, context)
+
+        session = profiler.start(f"bot {callback.__qualname__}")
+        try:
+            return await callback(update, context)
+        finally:
+            profiler.stop(session)
+            try:
+                await asyncio.to_thread(profile_store.save, session)
+            except OSError as e:
+                logger.error(f"Failed to save profile {session.name}: {str(e)}")
+
+    wrapper.__profiled__ = True
+    return wrapper
+
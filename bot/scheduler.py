@@ -0,0 +1,232 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from telegram.error import RetryAfter
+
+from app.services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Lower value wins: replies to a user's click go ahead of bulk sends such as broadcasts
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Telegram's documented limits: ~30 messages/s overall, ~1/s per chat, 20/min per group
+GLOBAL_RATE = 30.0
+PRIVATE_CHAT_RATE = 1.0
+GROUP_CHAT_RATE = 20 / 60
+CHAT_BURST = 5.0
+
+LATENCY_SAMPLES = 1000
+MAX_TRACKED_CHATS = 10000
+
+SendCall = Tuple[Callable[[], Awaitable], int]  # (zero-argument coroutine factory, message count)
+
+
+class _Bucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, cost: float) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # A send larger than the burst (a 10-photo album) only needs a full bucket
+        needed = min(cost, self.capacity)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+
+    def consume(self, cost: float):
+        self.tokens -= cost
+
+
+class SendJob:
+    __slots__ = (
+        "chat_id", "calls", "priority", "merge_key", "future", "results", "enqueued_at", "not_before", "context"
+    )
+
+    def __init__(self, chat_id: int, calls: List[SendCall], priority: int, merge_key: Optional[Hashable]):
+        self.chat_id = chat_id
+        self.calls = deque(calls)
+        self.priority = priority
+        self.merge_key = merge_key
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Collected across RetryAfter requeues
+        self.results = []
+        self.enqueued_at = time.monotonic()
+        self.not_before = 0.0
+        # Sends run in the submitting handler's context, so they land in the same trace
+        self.context = contextvars.copy_context()
+
+
+class SendScheduler:
+    """Outbound queue for everything the bot sends to Telegram.
+
+    Jobs are ordered by priority, then FIFO. A job only starts when its chat and
+    the global budget have room, jobs for one chat run one at a time, RetryAfter
+    puts the rest of a job back in the queue, and a new job with the same
+    ``merge_key`` replaces one that has not started yet (a user paging ahead only
+    gets the page they stopped on).
+    """
+
+    def __init__(self):
+        self._queues: Dict[int, Deque[SendJob]] = {PRIORITY_INTERACTIVE: deque(), PRIORITY_BULK: deque()}
+        self._global = _Bucket(GLOBAL_RATE, GLOBAL_RATE)
+        self._chats: Dict[int, _Bucket] = {}
+        self._busy_chats = set()
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self._tasks = set()
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.counters = {"sent": 0, "merged": 0, "retry_after": 0, "failed": 0}
+
+    # ---- public API ----
+
+    def submit(
+        self,
+        chat_id: int,
+        calls: List[SendCall],
+        priority: int = PRIORITY_INTERACTIVE,
+        merge_key: Optional[Hashable] = None,
+    ) -> asyncio.Future:
+        """Queue sends for a chat; the future resolves when they are done (None if merged away)"""
+        if merge_key is not None:
+            for queue in self._queues.values():
+                for pending in list(queue):
+                    if pending.merge_key == merge_key:
+                        queue.remove(pending)
+                        pending.future.set_result(None)
+                        self.counters["merged"] += 1
+        job = SendJob(chat_id, calls, priority, merge_key)
+        self._queues[priority].append(job)
+        self._wakeup.set()
+        return job.future
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+
+    def metrics(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+        return {
+            "queued_interactive": len(self._queues[PRIORITY_INTERACTIVE]),
+            "queued_bulk": len(self._queues[PRIORITY_BULK]),
+            "queue_latency_p50_ms": percentile(0.5),
+            "queue_latency_p95_ms": percentile(0.95),
+            "queue_latency_p99_ms": percentile(0.99),
+            **self.counters,
+        }
+
+    # ---- dispatching ----
+
+    def _chat_bucket(self, chat_id: int) -> _Bucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Negative chat IDs are groups and channels
+            rate = GROUP_CHAT_RATE if chat_id < 0 else PRIVATE_CHAT_RATE
+            bucket = self._chats[chat_id] = _Bucket(CHAT_BURST, rate)
+            if len(self._chats) > MAX_TRACKED_CHATS:
+                self._prune_chats()
+        return bucket
+
+    def _prune_chats(self):
+        # A bucket that has refilled completely carries no state worth keeping
+        for chat_id, bucket in list(self._chats.items()):
+            if chat_id not in self._busy_chats and bucket.wait_time(bucket.capacity) == 0:
+                del self._chats[chat_id]
+
+    def _next_job(self) -> Tuple[Optional[SendJob], float]:
+        """Pick the first runnable job; otherwise report how long until one might be"""
+        now = time.monotonic()
+        wait = None
+        for priority in sorted(self._queues):
+            for job in self._queues[priority]:
+                if job.chat_id in self._busy_chats:
+                    continue
+                delay = max(job.not_before - now, self._chat_bucket(job.chat_id).wait_time(job.calls[0][1]))
+                if delay <= 0:
+                    self._queues[priority].remove(job)
+                    return job, 0.0
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait if wait is not None else 60.0
+
+    async def _run(self):
+        while True:
+            # Cleared first so a submit made while scanning is not missed
+            self._wakeup.clear()
+            job, wait = self._next_job()
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._busy_chats.add(job.chat_id)
+            task = asyncio.create_task(self._execute(job), context=job.context)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, job: SendJob):
+        queued = time.monotonic() - job.enqueued_at
+        if job.not_before == 0.0:
+            self._latencies.append(queued)
+        chat_bucket = self._chat_bucket(job.chat_id)
+        try:
+            while job.calls:
+                factory, cost = job.calls[0]
+                for bucket in (self._global, chat_bucket):
+                    delay = bucket.wait_time(cost)
+                    if delay:
+                        await asyncio.sleep(delay)
+                    bucket.consume(cost)
+                try:
+                    with tracer.span("telegram.send", chat_id=job.chat_id, messages=cost, queued_ms=round(queued * 1000)):
+                        job.results.append(await factory())
+                except RetryAfter as e:
+                    retry_after = e.retry_after
+                    if isinstance(retry_after, timedelta):
+                        retry_after = retry_after.total_seconds()
+                    self.counters["retry_after"] += 1
+                    logger.warning(f"Flood control in chat {job.chat_id}, retrying in {retry_after}s")
+                    # Requeue the remaining calls at the front of their priority
+                    job.not_before = time.monotonic() + retry_after
+                    self._queues[job.priority].appendleft(job)
+                    return
+                job.calls.popleft()
+                self.counters["sent"] += cost
+            if not job.future.done():
+                job.future.set_result(job.results)
+        except Exception as e:
+            self.counters["failed"] += 1
+            logger.error(f"Send to chat {job.chat_id} failed: {str(e)}")
+            if not job.future.done():
+                job.future.set_exception(e)
+                # Nobody may be awaiting the future; don't warn about an unretrieved exception
+                job.future.exception()
+        finally:
+            self._busy_chats.discard(job.chat_id)
+            self._wakeup.set()
+
+
+# Shared instance used by the handlers
+scheduler = SendScheduler()
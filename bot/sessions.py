@@ -0,0 +1,148 @@
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# The browse and upload conversations time out after this long too, so a session
+# never outlives the conversation that uses it
+SESSION_TIMEOUT = 300
+SESSION_SWEEP_INTERVAL = 60
+
+
+class BrowseSession:
+    __slots__ = ("category_id", "category_name", "year", "page", "touched")
+
+    def __init__(self):
+        self.category_id: Optional[str] = None
+        self.category_name: Optional[str] = None
+        self.year: Optional[int] = None
+        self.page = 1
+        self.touched = 0.0
+
+
+class UploadSession:
+    __slots__ = ("category_id", "category_name", "year", "duplicate", "touched")
+
+    def __init__(self):
+        self.category_id: Optional[str] = None
+        self.category_name: Optional[str] = None
+        self.year: Optional[int] = None
+        # (file_id, file_unique_id, thumbnail file_id) of a photo refused as a near-duplicate
+        self.duplicate: Optional[Tuple[str, str, Optional[str]]] = None
+        self.touched = 0.0
+
+
+class BulkConfirmation:
+    """A previewed /delete or /move waiting for its confirm button"""
+
+    __slots__ = ("kind", "payload", "touched")
+
+    def __init__(self):
+        self.kind = ""
+        self.payload: dict = {}
+        self.touched = 0.0
+
+
+S = TypeVar("S", BrowseSession, UploadSession, BulkConfirmation)
+
+
+class SessionStore(Generic[S]):
+    """One session per user, dropped after ``timeout`` seconds without use.
+
+    Sessions are kept in least-recently-used order, so eviction only looks at
+    the sessions it removes; memory follows active users, not every user seen.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], S], timeout: float = SESSION_TIMEOUT):
+        self.name = name
+        self.factory = factory
+        self.timeout = timeout
+        self.evicted = 0
+        self._sessions: "OrderedDict[int, S]" = OrderedDict()
+
+    def start(self, user_id: int) -> S:
+        """A fresh session, replacing any the user had"""
+        session = self.factory()
+        session.touched = time.monotonic()
+        self._sessions[user_id] = session
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def get(self, user_id: int) -> Optional[S]:
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if now - session.touched > self.timeout:
+            del self._sessions[user_id]
+            self.evicted += 1
+            return None
+        session.touched = now
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def end(self, user_id: int) -> Optional[S]:
+        """Remove the user's session, returning it unless it had already expired"""
+        session = self._sessions.pop(user_id, None)
+        if session is not None and time.monotonic() - session.touched > self.timeout:
+            self.evicted += 1
+            return None
+        return session
+
+    def evict_idle(self) -> int:
+        cutoff = time.monotonic() - self.timeout
+        evicted = 0
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.touched > cutoff:
+                break
+            del self._sessions[user_id]
+            evicted += 1
+        self.evicted += evicted
+        return evicted
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def memory_bytes(self) -> int:
+        """Approximate bytes held: the index plus each session and its values"""
+        size = sys.getsizeof(self._sessions)
+        for user_id, session in self._sessions.items():
+            size += sys.getsizeof(user_id) + sys.getsizeof(session)
+            for name in session.__slots__:
+                value = getattr(session, name)
+                if isinstance(value, dict):
+                    size += sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value.values())
+                elif isinstance(value, str):
+                    size += sys.getsizeof(value)
+        return size
+
+
+browse_sessions: SessionStore[BrowseSession] = SessionStore("browse", BrowseSession)
+upload_sessions: SessionStore[UploadSession] = SessionStore("upload", UploadSession)
+bulk_confirmations: SessionStore[BulkConfirmation] = SessionStore("bulk", BulkConfirmation)
+
+SESSION_STORES = (browse_sessions, upload_sessions, bulk_confirmations)
+
+
+def end_sessions(user_id: int):
+    for store in SESSION_STORES:
+        store.end(user_id)
+
+
+async def evict_idle_sessions(context: Optional[ContextTypes.DEFAULT_TYPE] = None):
+    evicted = sum(store.evict_idle() for store in SESSION_STORES)
+    if evicted:
+        logger.debug(f"Evicted {evicted} idle sessions")
+
+
+def session_metrics() -> Dict[str, dict]:
+    return {
+        store.name: {"live": len(store), "bytes": store.memory_bytes(), "evicted": store.evicted}
+        for store in SESSION_STORES
+    }
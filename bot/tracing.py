@@ -0,0 +1,30 @@
+import functools
+import os
+
+from app.services.tracing import tracer
+
+
+def configure_tracing():
+    """BOT_TRACE_EXPORT is a JSONL path or a collector URL; BOT_TRACE_SAMPLE_RATE the share of updates traced"""
+    tracer.configure(
+        "bot",
+        os.getenv("BOT_TRACE_EXPORT") or None,
+        float(os.getenv("BOT_TRACE_SAMPLE_RATE", "0")),
+    )
+
+
+def traced(callback):
+    """Wrap a handler callback so each update it handles starts a trace"""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        if not tracer.sample_rate:
+            return await callback(update, context)
+        user = getattr(update, "effective_user", None)
+        with tracer.trace(
+            f"bot {callback.__qualname__}",
+            update_id=getattr(update, "update_id", None),
+            user_id=user.id if user else None,
+        ):
+            return await callback(update, context)
+
+    return wrapper
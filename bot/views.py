@@ -0,0 +1,48 @@
+import logging
+from collections import Counter
+from itertools import islice
+from typing import Iterable, Optional
+
+from telegram.ext import ContextTypes
+
+from bot import api
+
+logger = logging.getLogger(__name__)
+
+VIEW_FLUSH_INTERVAL = 30  # seconds between reports to the backend
+MAX_PENDING_VIEWS = 10000  # distinct images held while the backend is unreachable
+# The backend's ViewBatch/ViewEvent limits; larger reports are rejected outright
+MAX_VIEW_BATCH = 5000
+MAX_VIEW_COUNT = 10000
+
+# (image_id, category_id, year) -> views since the last report
+_pending: Counter = Counter()
+
+
+def record_views(images: Iterable[dict]):
+    """Count one view of each image a user was just shown; no network call"""
+    for img in images:
+        key = (img.get("id"), img["category_id"], img["year"])
+        if key[0] and (key in _pending or len(_pending) < MAX_PENDING_VIEWS):
+            _pending[key] += 1
+
+
+async def flush_views(context: Optional[ContextTypes.DEFAULT_TYPE] = None):
+    """Report buffered views in batches the backend accepts; counts stay buffered if a report fails"""
+    while _pending:
+        batch = {}
+        for key, count in list(islice(_pending.items(), MAX_VIEW_BATCH)):
+            # Anything over the per-event limit waits for the next batch
+            batch[key] = min(count, MAX_VIEW_COUNT)
+            _pending[key] -= batch[key]
+            if not _pending[key]:
+                del _pending[key]
+        views = [
+            {"image_id": image_id, "category_id": category_id, "year": year, "count": count}
+            for (image_id, category_id, year), count in batch.items()
+        ]
+        if not await api.report_views(views):
+            for key, count in batch.items():
+                if key in _pending or len(_pending) < MAX_PENDING_VIEWS:
+                    _pending[key] += count
+            return
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Optional, Tuple
+
+from telegram.ext import ContextTypes, JobQueue
+
+from bot import api
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "cache_warmup"
+REFRESH_AHEAD = 0.8  # refresh when 80% of the cache lifetime has passed
+JITTER = 0.1  # +/-10% so restarts of several bots don't refresh in lockstep
+RETRY_DELAY = 60.0  # seconds before retrying a run that had failures
+BROWSE_PAGE_SIZE = 5  # what /browse requests
+DURATION_SAMPLES = 50
+
+warmup_stats = {"runs": 0, "refreshed": 0, "failed": 0, "last_error": None}
+_durations: Deque[float] = deque(maxlen=DURATION_SAMPLES)
+_job_queue: Optional[JobQueue] = None
+
+
+def _fetched(kind: str, key, since: datetime) -> bool:
+    # api serves stale data instead of raising, so check the entry really was refetched
+    timestamp = api.cache_timestamp(kind, key)
+    return timestamp is not None and timestamp >= since
+
+
+async def warm_caches() -> Tuple[int, int]:
+    """Refetch categories, every category's years and page 1 of its latest year; returns (refreshed, failed)"""
+    since = datetime.now()
+    categories = await api.get_categories(force=True)
+    if not _fetched("categories", None, since):
+        return 0, 1
+
+    async def warm_category(category_id: str) -> Tuple[int, int]:
+        years = await api.get_years(category_id, force=True)
+        if not _fetched("years", category_id, since):
+            return 0, 1
+        if not years:
+            return 1, 0
+        key = (category_id, max(years), 1, BROWSE_PAGE_SIZE, None)
+        await api.get_images(*key[:4], force=True)
+        return (2, 0) if _fetched("pages", key, since) else (1, 1)
+
+    results = await asyncio.gather(*(warm_category(cat["id"]) for cat in categories or []))
+    return 1 + sum(ok for ok, _ in results), sum(failed for _, failed in results)
+
+
+async def warmup_job(context: ContextTypes.DEFAULT_TYPE):
+    started = time.monotonic()
+    try:
+        refreshed, failed = await warm_caches()
+        if failed:
+            warmup_stats["last_error"] = f"{failed} entries not refreshed at {datetime.now():%H:%M:%S}"
+    except Exception as e:
+        logger.exception(f"Cache warm-up failed: {str(e)}")
+        refreshed, failed = 0, 1
+        warmup_stats["last_error"] = f"{type(e).__name__}: {e}"
+    duration = time.monotonic() - started
+    _durations.append(duration)
+    warmup_stats["runs"] += 1
+    warmup_stats["refreshed"] += refreshed
+    warmup_stats["failed"] += failed
+    logger.info(f"Cache warm-up refreshed {refreshed} entries ({failed} failed) in {duration * 1000:.0f} ms")
+
+    lifetime = api.CACHE_DURATION.total_seconds() * REFRESH_AHEAD
+    delay = lifetime * random.uniform(1 - JITTER, 1 + JITTER)
+    schedule_warmup(context.job_queue, min(delay, RETRY_DELAY) if failed else delay)
+
+
+def schedule_warmup(job_queue: JobQueue, when: float = 0.0):
+    """(Re)schedule the single warm-up job to run ``when`` seconds from now"""
+    global _job_queue
+    _job_queue = job_queue
+    for job in job_queue.get_jobs_by_name(JOB_NAME):
+        job.schedule_removal()
+    job_queue.run_once(warmup_job, when, name=JOB_NAME)
+
+
+def request_warmup(delay: float = 5.0):
+    """Refill caches soon after an invalidation emptied them; bursts of writes share one run"""
+    if _job_queue is None:
+        return
+    due = datetime.now(timezone.utc) + timedelta(seconds=delay)
+    jobs = _job_queue.get_jobs_by_name(JOB_NAME)
+    if jobs and jobs[0].next_t is not None and jobs[0].next_t <= due:
+        return
+    schedule_warmup(_job_queue, delay)
+
+
+def warmup_metrics() -> dict:
+    durations = sorted(_durations)
+    jobs = _job_queue.get_jobs_by_name(JOB_NAME) if _job_queue else []
+    next_t = jobs[0].next_t if jobs else None
+    return {
+        **warmup_stats,
+        "last_ms": _durations[-1] * 1000 if _durations else 0.0,
+        "p50_ms": durations[len(durations) // 2] * 1000 if durations else 0.0,
+        "max_ms": durations[-1] * 1000 if durations else 0.0,
+        "next_in_s": (next_t - datetime.now(timezone.utc)).total_seconds() if next_t else None,
+    }
@@ -0,0 +1,100 @@
+import os
+import shutil
+import socket
+import subprocess
+import time
+
+import pytest
+import pytest_asyncio
+
+# app.config refuses to load without these; nothing in the tests talks to the real services
+for name, value in {
+    "BOT_BACKEND_API_KEY": "test-key",
+    "BOT_TOKEN": "123:test",
+    "MONGODB_URL": "mongodb://127.0.0.1:1/focus_gallery_test",
+}.items():
+    os.environ.setdefault(name, value)
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from pymongo import MongoClient  # noqa: E402
+from pymongo.errors import OperationFailure, PyMongoError  # noqa: E402
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _initiate(port: int, timeout: float = 30):
+    url = f"mongodb://127.0.0.1:{port}/"
+    client = MongoClient(url, directConnection=True, serverSelectionTimeoutMS=1000)
+    config = {"_id": "rs0", "members": [{"_id": 0, "host": f"127.0.0.1:{port}"}]}
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                try:
+                    client.admin.command("replSetInitiate", config)
+                except OperationFailure:
+                    # Already initiated
+                    pass
+                if client.admin.command("hello").get("isWritablePrimary"):
+                    return
+            except PyMongoError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"No replica set primary at {url}")
+            time.sleep(0.2)
+    finally:
+        client.close()
+
+
+@pytest.fixture(scope="session")
+def replica_set_url(tmp_path_factory):
+    """A single-node replica set, so change streams work.
+
+    TEST_MONGODB_URL points at one that is already running; otherwise ``mongod``
+    (or $MONGOD) is started on a free port for the session. Tests using it are
+    skipped when neither is available.
+    """
+    url = os.getenv("TEST_MONGODB_URL")
+    if url:
+        yield url
+        return
+    mongod = os.getenv("MONGOD") or shutil.which("mongod")
+    if not mongod:
+        pytest.skip("needs mongod on PATH or TEST_MONGODB_URL")
+
+    port = _free_port()
+    dbpath = tmp_path_factory.mktemp("mongod")
+    process = subprocess.Popen(
+        [mongod, "--replSet", "rs0", "--port", str(port), "--bind_ip", "127.0.0.1",
+         "--dbpath", str(dbpath), "--quiet"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        _initiate(port)
+        yield f"mongodb://127.0.0.1:{port}/?directConnection=true"
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+@pytest_asyncio.fixture
+async def mongo_db(replica_set_url, request):
+    """``database.db`` pointed at a fresh database on the replica set, dropped afterwards"""
+    from app.database import database
+
+    client = AsyncIOMotorClient(replica_set_url)
+    name = f"test_{request.node.name}"[:60].replace("[", "_").replace("]", "_")
+    await client.drop_database(name)
+    previous = database.db
+    database.db = client[name]
+    try:
+        yield database.db
+    finally:
+        database.db = previous
+        await client.drop_database(name)
+        client.close()
@@ -0,0 +1,60 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.database import database
+from app.routers import images
+
+
+@pytest.fixture
+def archives(monkeypatch):
+    async def count_documents(query):
+        await asyncio.sleep(0)
+        return 3
+
+    async def stream_archive(category, year, concurrency):
+        yield b"PK"
+
+    monkeypatch.setattr(database, "db", SimpleNamespace(images=SimpleNamespace(count_documents=count_documents)))
+    monkeypatch.setattr(images, "stream_archive", stream_archive)
+    monkeypatch.setattr(images.settings, "max_concurrent_archives", 2)
+    monkeypatch.setattr(images, "_active_archives", 0)
+
+
+async def _receive():
+    await asyncio.sleep(60)
+    return {"type": "http.disconnect"}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_cannot_exceed_the_limit(archives):
+    results = await asyncio.gather(
+        *(images.download_archive("easter", 2024) for _ in range(4)), return_exceptions=True
+    )
+    refused = [result for result in results if isinstance(result, HTTPException)]
+    assert len(refused) == 2 and all(error.status_code == 503 for error in refused)
+    assert images._active_archives == 2
+
+
+@pytest.mark.asyncio
+async def test_slot_is_released_whether_or_not_the_body_was_sent(archives):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def broken_send(message):
+        raise OSError("client went away")
+
+    finished = await images.download_archive("easter", 2024)
+    never_started = await images.download_archive("easter", 2024)
+    assert images._active_archives == 2
+
+    await finished({"type": "http", "asgi": {"spec_version": "2.4"}}, _receive, send)
+    assert b"".join(message.get("body", b"") for message in sent) == b"PK"
+    # Starlette may wrap it in an ExceptionGroup
+    with pytest.raises(Exception):
+        await never_started({"type": "http", "asgi": {"spec_version": "2.4"}}, _receive, broken_send)
+    assert images._active_archives == 0
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.database import database
+from app.models import BroadcastRequest
+from app.routers.subscriptions import create_broadcast, start_broadcast
+from bot import api
+from bot.broadcast import Broadcaster
+
+
+def _pending(count: int) -> dict:
+    return {
+        "id": "0" * 24, "category_id": "easter", "year": 2024, "count": count, "title": "Easter 2024",
+        "status": "pending", "checkpoint": None, "sent": 0, "failed": 0, "removed": 0,
+    }
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    """Fake subscription endpoints; ``started`` is what starting the broadcast returns"""
+    calls = {"started": None, "texts": [], "progress": []}
+
+    async def start_broadcast(broadcast_id):
+        return calls["started"]
+
+    async def get_subscribers(category_id, after, limit):
+        return {"chat_ids": [1, 2], "next_after": None}
+
+    async def update_broadcast(broadcast_id, progress):
+        calls["progress"].append(progress)
+        return {}
+
+    async def send_page(self, chat_ids, text):
+        calls["texts"].append(text)
+        return {"checkpoint": chat_ids[-1], "sent": len(chat_ids), "failed": 0, "removed": 0}
+
+    monkeypatch.setattr(api, "start_broadcast", start_broadcast)
+    monkeypatch.setattr(api, "get_subscribers", get_subscribers)
+    monkeypatch.setattr(api, "update_broadcast", update_broadcast)
+    monkeypatch.setattr(Broadcaster, "_send_page", send_page)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_announces_the_count_it_started_with(backend):
+    # Three more photos were folded in after the pending broadcast was read
+    backend["started"] = {**_pending(5), "status": "running"}
+    assert await Broadcaster()._deliver(_pending(2))
+    assert backend["texts"][0].startswith("🆕 5 new photos in Easter 2024")
+    assert backend["progress"][-1]["status"] == "completed"
+
+
+@pytest.mark.asyncio
+async def test_broadcast_started_elsewhere_is_left_alone(backend):
+    backend["started"] = False
+    assert await Broadcaster()._deliver(_pending(2))
+    assert not backend["texts"] and not backend["progress"]
+
+
+@pytest.mark.asyncio
+async def test_backend_failure_retries_later(backend):
+    assert not await Broadcaster()._deliver(_pending(2))
+    assert not backend["texts"]
+
+
+def _request(count: int) -> BroadcastRequest:
+    return BroadcastRequest(category_id="easter", year=2024, count=count, title="Easter 2024")
+
+
+@pytest.mark.asyncio
+async def test_batches_fold_into_the_pending_broadcast_until_it_starts(mongo_db):
+    await database._ensure_indexes()
+    results = await asyncio.gather(*(create_broadcast(_request(1)) for _ in range(5)))
+    assert len({broadcast.id for broadcast in results}) == 1
+
+    started = await start_broadcast(results[0].id)
+    assert (started.status, started.count) == ("running", 5)
+    with pytest.raises(HTTPException) as error:
+        await start_broadcast(results[0].id)
+    assert error.value.status_code == 404
+
+    later = await create_broadcast(_request(2))
+    assert later.id != started.id
+    assert (later.status, later.count) == ("pending", 2)
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.models import BulkSelection
+from app.services import bulk
+from bot import api
+from bot.handlers import admin
+
+
+@pytest.mark.asyncio
+async def test_snapshot_failure_fails_the_operation(mongo_db, monkeypatch):
+    async def broken(op, query):
+        raise RuntimeError("E11000 duplicate key error index: _id_")
+
+    monkeypatch.setattr(bulk, "_snapshot", broken)
+    with pytest.raises(RuntimeError):
+        await bulk.create_operation("delete", BulkSelection(category="easter"))
+    op = await mongo_db.bulk_operations.find_one()
+    assert op["status"] == "failed" and op["owner"] is None
+    # Nothing is left for the sweep to pick up
+    assert await bulk._claim(op["_id"], bulk.RESUMABLE) is None
+
+
+class _Message:
+    def __init__(self):
+        self.edits = []
+
+    async def edit_text(self, text, **kwargs):
+        self.edits.append((text, kwargs))
+
+
+@pytest.mark.asyncio
+async def test_failed_operation_is_reported_as_plain_text_with_a_resume_button(monkeypatch):
+    monkeypatch.setattr(admin, "invalidate_caches", lambda category_id, year: None)
+    message = _Message()
+    op = {
+        "id": "a" * 24, "kind": "delete", "status": "failed", "total": 10, "processed": 4,
+        "affected": [], "error": "E11000 duplicate key error index: _id_ *",
+    }
+    await admin._follow_operation(message, op)
+    text, options = message.edits[-1]
+    assert op["error"] in text
+    assert "parse_mode" not in options
+    assert options["reply_markup"].inline_keyboard[0][0].callback_data == f"bulk_resume:{op['id']}"
+
+
+@pytest.mark.asyncio
+async def test_resume_button_follows_the_operation_again(monkeypatch):
+    monkeypatch.setattr(admin, "invalidate_caches", lambda category_id, year: None)
+    monkeypatch.setattr(admin, "is_admin", lambda user_id: True)
+    monkeypatch.setattr(admin, "POLL_INTERVAL", 0)
+    op = {"id": "a" * 24, "kind": "delete", "total": 10, "processed": 4, "affected": [], "error": None}
+    resumed = []
+
+    async def resume_bulk_operation(op_id):
+        resumed.append(op_id)
+        # Still the state from before the restart
+        return {**op, "status": "failed"}
+
+    async def get_bulk_operation(op_id):
+        return {**op, "status": "completed", "processed": 10}
+
+    monkeypatch.setattr(api, "resume_bulk_operation", resume_bulk_operation)
+    monkeypatch.setattr(api, "get_bulk_operation", get_bulk_operation)
+
+    message = _Message()
+    tasks = []
+
+    async def answer():
+        pass
+
+    query = SimpleNamespace(
+        data=f"bulk_resume:{op['id']}", message=message, answer=answer, edit_message_text=message.edit_text
+    )
+    update = SimpleNamespace(callback_query=query, effective_user=SimpleNamespace(id=1))
+    context = SimpleNamespace(application=SimpleNamespace(create_task=lambda coro, update: tasks.append(coro)))
+    await admin.handle_bulk_resume(update, context)
+    await tasks[0]
+    assert resumed == [op["id"]]
+    assert [text for text, _ in message.edits] == ["⏳ Resuming at 4/10 images...", "✅ Deleted 10 images."]
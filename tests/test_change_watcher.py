@@ -0,0 +1,165 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.database import database
+from app.services import change_watcher
+from app.services.cache import ResponseCache, response_cache
+from app.services.change_watcher import ChangeWatcher
+
+IMAGES_KEY = ("images", "easter", 2024, 1, 5, None)
+
+
+def test_set_is_skipped_after_an_invalidation_during_the_read():
+    cache = ResponseCache(ttl=60)
+    generation = cache.generation(IMAGES_KEY)
+    # A change event lands while the handler is still reading MongoDB
+    cache.invalidate("easter", 2024)
+    cache.set(IMAGES_KEY, "stale", generation)
+    assert cache.is_miss(cache.get(IMAGES_KEY))
+
+    cache.set(IMAGES_KEY, "fresh", cache.generation(IMAGES_KEY))
+    assert cache.get(IMAGES_KEY) == "fresh"
+
+
+def test_generations_are_scoped_to_the_invalidated_category():
+    cache = ResponseCache(ttl=60)
+    other = ("images", "christmas", 2024, 1, 5, None)
+    facets = ("facets", None, None)
+    generations = {key: cache.generation(key) for key in (IMAGES_KEY, other, facets)}
+    cache.invalidate("christmas", 2023)
+    for key in generations:
+        cache.set(key, "value", generations[key])
+    # Facets span every category, so they were invalidated too
+    assert cache.get(IMAGES_KEY) == "value"
+    assert cache.is_miss(cache.get(other))
+    assert cache.is_miss(cache.get(facets))
+
+
+def test_full_invalidation_moves_every_generation():
+    cache = ResponseCache(ttl=60)
+    generation = cache.generation(IMAGES_KEY)
+    cache.invalidate()
+    cache.set(IMAGES_KEY, "stale", generation)
+    assert cache.is_miss(cache.get(IMAGES_KEY))
+
+
+def test_delete_without_pre_image_flushes_everything():
+    change = {"ns": {"coll": "images"}, "operationType": "delete", "documentKey": {"_id": 1}}
+    assert ChangeWatcher._events_for(change) == [{"category_id": None, "year": None}]
+
+
+async def _next_event(queue: asyncio.Queue, timeout: float = 10) -> dict:
+    return await asyncio.wait_for(queue.get(), timeout)
+
+
+async def _until(predicate, timeout: float = 10):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.05)
+
+
+@pytest_asyncio.fixture
+async def watcher(mongo_db):
+    await mongo_db.create_collection("images")
+    await database._enable_pre_images()
+    watcher = ChangeWatcher()
+    queue = watcher.subscribe()
+    watcher.start()
+    assert await _next_event(queue) == {"watching": True}
+    # Catch-up flush sent whenever the stream (re)opens
+    assert await _next_event(queue) == {"category_id": None, "year": None}
+    yield watcher, queue
+    await watcher.stop()
+
+
+@pytest.mark.asyncio
+async def test_insert_invalidates_cached_page(watcher, mongo_db):
+    _, queue = watcher
+    response_cache.set(IMAGES_KEY, "cached")
+    await mongo_db.images.insert_one({"category_id": "easter", "year": 2024, "url": "u"})
+    assert await _next_event(queue) == {"category_id": "easter", "year": 2024}
+    await _until(lambda: response_cache.is_miss(response_cache.get(IMAGES_KEY)))
+
+
+@pytest.mark.asyncio
+async def test_move_reports_old_and_new_category(watcher, mongo_db):
+    _, queue = watcher
+    result = await mongo_db.images.insert_one({"category_id": "easter", "year": 2024, "url": "u"})
+    await _next_event(queue)
+    await mongo_db.images.update_one({"_id": result.inserted_id}, {"$set": {"category_id": "christmas"}})
+    assert await _next_event(queue) == {"category_id": "easter", "year": 2024}
+    assert await _next_event(queue) == {"category_id": "christmas", "year": 2024}
+
+
+@pytest.mark.asyncio
+async def test_delete_reports_category_from_pre_image(watcher, mongo_db):
+    _, queue = watcher
+    result = await mongo_db.images.insert_one({"category_id": "easter", "year": 2024, "url": "u"})
+    await _next_event(queue)
+    await mongo_db.images.delete_one({"_id": result.inserted_id})
+    assert await _next_event(queue) == {"category_id": "easter", "year": 2024}
+
+
+@pytest.mark.asyncio
+async def test_category_change_invalidates_listings(watcher, mongo_db):
+    _, queue = watcher
+    response_cache.set(("categories", None, None), "cached")
+    await mongo_db.categories.insert_one({"id": "easter", "name": "Easter"})
+    assert await _next_event(queue) == {"categories": True}
+    await _until(lambda: response_cache.is_miss(response_cache.get(("categories", None, None))))
+
+
+class _Stream:
+    """Plays one scripted outcome per open: an event then a dropped connection, a lost
+    resume token, or a quiet stream"""
+
+    def __init__(self, opened: list):
+        self.opened = opened
+        self.resume_token = {"_data": "token"}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if len(self.opened) == 1:
+            if not getattr(self, "sent", False):
+                self.sent = True
+                return {"ns": {"coll": "categories"}, "operationType": "insert"}
+            raise PyMongoError("connection reset")
+        if len(self.opened) == 2:
+            raise OperationFailure("Resume of change stream was not possible", code=286)
+        await asyncio.sleep(60)
+
+
+@pytest.mark.asyncio
+async def test_lost_resume_token_rebuilds_the_similarity_index(monkeypatch):
+    opened, resyncs = [], []
+
+    def watch(pipeline, resume_after=None, **options):
+        opened.append(resume_after)
+        return _Stream(opened)
+
+    monkeypatch.setattr(database, "db", SimpleNamespace(watch=watch))
+    monkeypatch.setattr(change_watcher.similarity_index, "resync", lambda: resyncs.append(len(opened)))
+    watcher = ChangeWatcher()
+    watcher.start()
+    try:
+        await _until(lambda: len(opened) == 2)
+        # The first open is covered by the index's initial load; resuming with a token loses nothing
+        assert resyncs == []
+        await _until(lambda: len(opened) == 3)
+        assert opened == [None, {"_data": "token"}, None]
+        await _until(lambda: resyncs == [3])
+    finally:
+        await watcher.stop()
@@ -0,0 +1,122 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.services.changes import (
+    LAST_ID,
+    Position,
+    check_token_age,
+    decode_token,
+    encode_token,
+    record_deletions,
+    stream_changes,
+)
+
+
+def _now() -> datetime:
+    # Millisecond precision, like everything MongoDB stores
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def test_token_round_trip():
+    position = Position(_now() - timedelta(days=400), ObjectId(), _now())
+    assert decode_token(encode_token(position)) == position
+
+
+def test_token_without_horizon_is_as_of_its_position():
+    modified_at = _now()
+    raw = json.dumps({"t": int((modified_at - datetime(1970, 1, 1)).total_seconds() * 1000), "id": str(ObjectId())})
+    token = base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+    assert decode_token(token).as_of == modified_at
+
+
+@pytest.mark.parametrize("token", ["", "not-a-token", "eyJ0IjoxfQ", "eyJ0IjoxLCJpZCI6Inh5eiJ9"])
+def test_invalid_tokens_are_rejected(token):
+    with pytest.raises(HTTPException) as error:
+        decode_token(token)
+    assert error.value.status_code == 400
+
+
+def test_old_position_is_fine_while_its_sync_is_recent():
+    # Page two of a full pull of a gallery whose newest change is a year old
+    check_token_age(Position(_now() - timedelta(days=365), ObjectId(), _now() - timedelta(minutes=5)))
+
+
+def test_sync_older_than_the_tombstones_is_gone():
+    old = _now() - timedelta(days=31)
+    with pytest.raises(HTTPException) as error:
+        check_token_age(Position(old, ObjectId(), old))
+    assert error.value.status_code == 410
+
+
+async def _read(since, limit: int = 1000) -> list:
+    lines = []
+    async for chunk in stream_changes(since, limit):
+        lines += [json.loads(line) for line in chunk.decode().splitlines()]
+    return lines
+
+
+def _image(modified_at: datetime, **fields) -> dict:
+    return {
+        "_id": ObjectId(), "url": "u", "cloudinary_id": "k", "category_id": "easter", "year": 2024,
+        "uploaded_by": 1, "uploaded_at": modified_at, "modified_at": modified_at, **fields,
+    }
+
+
+@pytest.mark.asyncio
+async def test_full_pull_pages_through_an_old_gallery(mongo_db):
+    started = _now() - timedelta(days=400)
+    images = [_image(started + timedelta(minutes=i)) for i in range(5)]
+    await mongo_db.images.insert_many(images)
+
+    first = await _read(None, limit=3)
+    assert [line["id"] for line in first[:-1]] == [str(doc["_id"]) for doc in images[:3]]
+    assert first[-1]["op"] == "end" and first[-1]["more"]
+
+    since = decode_token(first[-1]["token"])
+    assert since.modified_at == images[2]["modified_at"]
+    check_token_age(since)
+    second = await _read(since, limit=3)
+    assert [line["id"] for line in second[:-1]] == [str(doc["_id"]) for doc in images[3:]]
+    assert not second[-1]["more"]
+
+
+@pytest.mark.asyncio
+async def test_images_and_deletes_are_merged_in_order(mongo_db):
+    base = _now() - timedelta(hours=1)
+    since = Position(base, LAST_ID, base)
+    kept = _image(base + timedelta(minutes=1))
+    updated = _image(base + timedelta(minutes=3), uploaded_at=base - timedelta(days=1))
+    deleted = _image(base - timedelta(days=1))
+    await mongo_db.images.insert_many([kept, updated])
+    await record_deletions([deleted])
+    await mongo_db.image_tombstones.update_one(
+        {"_id": deleted["_id"]}, {"$set": {"modified_at": base + timedelta(minutes=2)}}
+    )
+
+    lines = await _read(since)
+    assert [(line["op"], line["id"]) for line in lines[:-1]] == [
+        ("insert", str(kept["_id"])),
+        ("delete", str(deleted["_id"])),
+        ("update", str(updated["_id"])),
+    ]
+    assert lines[1]["category_id"] == "easter"
+    # Resuming after a line continues right after it
+    rest = await _read(decode_token(lines[1]["token"]))
+    assert [line["id"] for line in rest[:-1]] == [str(updated["_id"])]
+
+
+@pytest.mark.asyncio
+async def test_quiet_feed_token_advances_to_the_read_horizon(mongo_db):
+    long_ago = _now() - timedelta(days=20)
+    lines = await _read(Position(long_ago, ObjectId(), long_ago))
+    assert lines == [{"op": "end", "token": lines[0]["token"], "count": 0, "more": False}]
+    token = decode_token(lines[0]["token"])
+    assert token.image_id == LAST_ID
+    assert _now() - token.modified_at < timedelta(minutes=1)
+    assert token.as_of == token.modified_at
@@ -0,0 +1,124 @@
+import asyncio
+
+import httpx
+import pytest
+
+from bot import api
+from bot.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, get_breaker
+
+
+def _expire(breaker: CircuitBreaker):
+    """Pretend reset_timeout has passed since the circuit opened or the probe started"""
+    breaker.opened_at -= breaker.reset_timeout
+    breaker._probe_started -= breaker.reset_timeout
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker("test", failure_threshold=1)
+    breaker.record_failure()
+    _expire(breaker)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker("test", failure_threshold=1)
+    breaker.record_failure()
+    _expire(breaker)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_probe_that_never_reports_back_is_replaced():
+    breaker = CircuitBreaker("test", failure_threshold=1)
+    breaker.record_failure()
+    _expire(breaker)
+    assert breaker.allow()
+    assert not breaker.allow()
+    _expire(breaker)
+    assert breaker.allow()
+
+
+def _client(handler) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+async def _open_breaker(name: str) -> CircuitBreaker:
+    breaker = get_breaker(name)
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    _expire(breaker)
+    return breaker
+
+
+@pytest.mark.asyncio
+async def test_request_records_server_errors_and_successes():
+    breaker = get_breaker("test-status")
+    async with _client(lambda request: httpx.Response(500)) as client:
+        for _ in range(breaker.failure_threshold):
+            await api._request(client, "GET", "http://backend/x", endpoint="test-status")
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        await api._request(client, "GET", "http://backend/x", endpoint="test-status")
+
+    _expire(breaker)
+    async with _client(lambda request: httpx.Response(404)) as client:
+        response = await api._request(client, "GET", "http://backend/x", endpoint="test-status")
+    assert response.status_code == 404
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_probe_failing_outside_httpx_still_resolves():
+    breaker = await _open_breaker("test-error")
+
+    def broken(request):
+        raise ValueError("could not build the upload body")
+
+    async with _client(broken) as client:
+        with pytest.raises(ValueError):
+            await api._request(client, "GET", "http://backend/x", endpoint="test-error")
+    assert breaker.state == OPEN
+    _expire(breaker)
+    async with _client(lambda request: httpx.Response(200)) as client:
+        await api._request(client, "GET", "http://backend/x", endpoint="test-error")
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_cancelled_probe_still_resolves():
+    breaker = await _open_breaker("test-cancel")
+    started = asyncio.Event()
+
+    async def hang(request):
+        started.set()
+        await asyncio.sleep(60)
+        return httpx.Response(200)
+
+    async with _client(hang) as client:
+        probe = asyncio.create_task(api._request(client, "GET", "http://backend/x", endpoint="test-cancel"))
+        await started.wait()
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+    assert breaker.state == OPEN
+    assert not breaker._probing
@@ -0,0 +1,49 @@
+import pytest
+from fastapi import Response
+
+from app.routers.upload import _store_image
+
+
+async def _upload(key: str = "photo-1", category: str = "easter", year: int = 2024):
+    saved = []
+
+    async def save():
+        saved.append(key)
+        return {"url": f"https://example.invalid/{len(saved)}.jpg", "key": f"gallery/{len(saved)}"}
+
+    async def phash():
+        return None
+
+    response = Response()
+    image = await _store_image(response, save, phash, category, year, "", 1, key, False)
+    return image, bool(saved), response.headers.get("Idempotent-Replayed") == "true"
+
+
+@pytest.mark.asyncio
+async def test_repeated_upload_is_replayed(mongo_db):
+    first, saved, _ = await _upload()
+    assert saved
+    again, saved, replayed = await _upload()
+    assert (again.id, saved, replayed) == (first.id, False, True)
+    assert await mongo_db.images.count_documents({}) == 1
+
+
+@pytest.mark.asyncio
+async def test_upload_after_delete_stores_the_photo_again(mongo_db):
+    first, _, _ = await _upload()
+    await mongo_db.images.delete_many({})
+    again, saved, replayed = await _upload()
+    assert saved and not replayed
+    assert again.id != first.id
+    assert await mongo_db.images.count_documents({}) == 1
+    # And the new result is what later repeats get
+    assert (await _upload())[0].id == again.id
+
+
+@pytest.mark.asyncio
+async def test_upload_after_move_stores_the_photo_again(mongo_db):
+    first, _, _ = await _upload()
+    await mongo_db.images.update_many({}, {"$set": {"category_id": "xmas"}})
+    again, saved, replayed = await _upload()
+    assert saved and not replayed
+    assert (again.category_id, again.year) == ("easter", 2024)
@@ -0,0 +1,50 @@
+import pytest
+
+from app.middleware.rate_limit import RateLimitMiddleware
+
+
+async def _ok(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _call(middleware, path: str, headers=(), client="203.0.113.9") -> int:
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "headers": list(headers), "client": (client, 1234)}
+    await middleware(scope, None, send)
+    return sent[0]["status"]
+
+
+def _middleware(**options) -> RateLimitMiddleware:
+    return RateLimitMiddleware(_ok, api_key="secret", capacity=1, rate=0.001, exempt_paths=("/health",), **options)
+
+
+@pytest.mark.asyncio
+async def test_health_is_never_shed_or_limited():
+    middleware = _middleware(max_in_flight=1)
+    middleware.in_flight = 1
+    assert await _call(middleware, "/api/v1/images") == 503
+    assert [await _call(middleware, "/health") for _ in range(3)] == [200, 200, 200]
+
+
+@pytest.mark.asyncio
+async def test_api_key_skips_the_buckets():
+    middleware = _middleware()
+    assert await _call(middleware, "/api/v1/images") == 200
+    assert await _call(middleware, "/api/v1/images") == 429
+    trusted = [(b"authorization", b"Bearer secret")]
+    assert await _call(middleware, "/api/v1/images", trusted) == 200
+    assert await _call(middleware, "/api/v1/images", [(b"authorization", b"Bearer wrong")]) == 429
+
+
+@pytest.mark.asyncio
+async def test_clients_are_told_apart_by_the_proxy_appended_address():
+    middleware = _middleware()
+    spoofed = [(b"x-forwarded-for", b"198.51.100.1, 192.0.2.7")]
+    assert await _call(middleware, "/api/v1/images", spoofed) == 200
+    assert await _call(middleware, "/api/v1/images", [(b"x-forwarded-for", b"198.51.100.2, 192.0.2.7")]) == 429
+    assert await _call(middleware, "/api/v1/images", [(b"x-forwarded-for", b"192.0.2.8")]) == 200
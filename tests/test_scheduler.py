@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from telegram.error import RetryAfter
+
+from bot.scheduler import PRIORITY_BULK, PRIORITY_INTERACTIVE, SendScheduler
+
+
+@pytest_asyncio.fixture
+async def scheduler():
+    scheduler = SendScheduler()
+    yield scheduler
+    await scheduler.stop()
+
+
+def _send(log: list, value, delay: float = 0):
+    async def call():
+        if delay:
+            await asyncio.sleep(delay)
+        log.append(value)
+        return value
+    return call, 1
+
+
+@pytest.mark.asyncio
+async def test_calls_run_in_order_and_resolve_the_future(scheduler):
+    log = []
+    scheduler.start()
+    results = await asyncio.wait_for(scheduler.submit(1, [_send(log, "a"), _send(log, "b")]), 5)
+    assert results == ["a", "b"] == log
+    assert scheduler.metrics()["sent"] == 2
+
+
+@pytest.mark.asyncio
+async def test_interactive_jobs_go_ahead_of_bulk(scheduler):
+    log = []
+    bulk = scheduler.submit(1, [_send(log, "bulk")], priority=PRIORITY_BULK)
+    interactive = scheduler.submit(2, [_send(log, "interactive")], priority=PRIORITY_INTERACTIVE)
+    scheduler.start()
+    await asyncio.wait_for(asyncio.gather(bulk, interactive), 5)
+    assert log == ["interactive", "bulk"]
+
+
+@pytest.mark.asyncio
+async def test_merge_key_replaces_a_job_that_has_not_started(scheduler):
+    log = []
+    first = scheduler.submit(1, [_send(log, "page 1")], merge_key=("browse", 1))
+    second = scheduler.submit(1, [_send(log, "page 2")], merge_key=("browse", 1))
+    scheduler.start()
+    assert await asyncio.wait_for(first, 5) is None
+    assert await asyncio.wait_for(second, 5) == ["page 2"]
+    assert log == ["page 2"]
+    assert scheduler.metrics()["merged"] == 1
+
+
+@pytest.mark.asyncio
+async def test_jobs_for_one_chat_never_overlap(scheduler):
+    log = []
+    scheduler.start()
+    slow = scheduler.submit(1, [_send(log, "slow", delay=0.1)])
+    fast = scheduler.submit(1, [_send(log, "fast")])
+    other_chat = scheduler.submit(2, [_send(log, "other")])
+    await asyncio.wait_for(asyncio.gather(slow, fast, other_chat), 5)
+    assert log.index("slow") < log.index("fast")
+    # Another chat is not held up by the slow send
+    assert log.index("other") < log.index("slow")
+
+
+@pytest.mark.asyncio
+async def test_retry_after_requeues_the_remaining_calls(scheduler):
+    log = []
+    attempts = []
+
+    async def flaky():
+        attempts.append(asyncio.get_running_loop().time())
+        if len(attempts) == 1:
+            raise RetryAfter(0.2)
+        log.append("flaky")
+
+    scheduler.start()
+    future = scheduler.submit(1, [_send(log, "before"), (flaky, 1), _send(log, "after")])
+    assert await asyncio.wait_for(future, 5) == ["before", None, "after"]
+    assert log == ["before", "flaky", "after"]
+    assert attempts[1] - attempts[0] >= 0.2
+    assert scheduler.metrics()["retry_after"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failures_reach_the_future_and_the_queue_moves_on(scheduler):
+    log = []
+
+    async def broken():
+        raise ValueError("boom")
+
+    scheduler.start()
+    failed = scheduler.submit(1, [(broken, 1)])
+    with pytest.raises(ValueError):
+        await asyncio.wait_for(failed, 5)
+    assert await asyncio.wait_for(scheduler.submit(1, [_send(log, "next")]), 5) == ["next"]
+    assert scheduler.metrics()["failed"] == 1
@@ -0,0 +1,114 @@
+import asyncio
+import random
+
+import pytest
+from bson import ObjectId
+
+np = pytest.importorskip("numpy")
+
+from app.services import similarity  # noqa: E402
+from app.services.similarity import HashArray, SimilarityIndex, hamming_distances  # noqa: E402
+
+
+def _hashes(count: int, seed: int = 0) -> list:
+    generator = random.Random(seed)
+    # Signed 64-bit, the way MongoDB stores them
+    return [generator.getrandbits(64) - 2 ** 63 for _ in range(count)]
+
+
+def _popcount(value: int) -> int:
+    return bin(value & 0xFFFFFFFFFFFFFFFF).count("1")
+
+
+@pytest.mark.parametrize("bitwise_count", [True, False])
+def test_hamming_distances(monkeypatch, bitwise_count):
+    if not bitwise_count:
+        # The SWAR fallback used on numpy < 2.0
+        monkeypatch.delattr(np, "bitwise_count", raising=False)
+    elif not hasattr(np, "bitwise_count"):
+        pytest.skip("numpy < 2.0")
+    values = _hashes(200) + [0, -1, 2 ** 63 - 1, -(2 ** 63)]
+    hashes = np.array(values, dtype=np.int64).view(np.uint64)
+    target = values[7]
+    assert hamming_distances(hashes, target).tolist() == [_popcount(value ^ target) for value in values]
+
+
+def test_add_grows_and_search_finds_the_closest():
+    array = HashArray(capacity=2)
+    image_ids = [ObjectId() for _ in range(100)]
+    hashes = _hashes(100)
+    array.add(image_ids[:50], hashes[:50])
+    array.add(image_ids[50:], hashes[50:])
+    assert array.size == 100
+
+    target = hashes[42] ^ 0b111  # three bits away from image 42
+    near = hashes[42] ^ 0b1
+    array.add([ObjectId()], [near])
+    matches = array.search(target, max_distance=5, limit=10)
+    assert [distance for _, distance in matches] == [2, 3]
+    assert matches[1][0] == image_ids[42]
+    assert array.search(target, max_distance=5, limit=1) == matches[:1]
+    assert array.search(target, max_distance=5, limit=10, exclude=matches[0][0]) == matches[1:]
+
+
+@pytest.mark.parametrize("removed", [3, similarity.SCAN_REMOVALS + 20])
+def test_remove_returns_what_was_present(removed):
+    array = HashArray()
+    image_ids = [ObjectId() for _ in range(100)]
+    hashes = _hashes(100, seed=1)
+    array.add(image_ids, hashes)
+
+    gone = image_ids[10:10 + removed]
+    unknown = [ObjectId()]
+    assert sorted(array.remove(gone + unknown)) == sorted(zip(gone, hashes[10:10 + removed]))
+    assert array.size == 100 - removed
+    assert array.remove(gone) == []
+    # The rest are still found, with their own IDs
+    for oid, phash in [(image_ids[0], hashes[0]), (image_ids[-1], hashes[-1])]:
+        assert array.search(phash, max_distance=0, limit=1) == [(oid, 0)]
+
+
+def test_index_moves_and_replaces_images():
+    index = SimilarityIndex()
+    oid = ObjectId()
+    index.apply(added=[("easter", oid, 12345)])
+    assert index.search("easter", 12345, 0, 5) == [(oid, 0)]
+
+    index.move([oid], "xmas")
+    assert index.search("easter", 12345, 0, 5) == []
+    assert index.search("xmas", 12345, 0, 5) == [(oid, 0)]
+
+    # Repeating a change, or adding an image again, replaces it rather than duplicating it
+    index.apply(added=[("xmas", oid, 12345)])
+    index.apply(added=[("xmas", oid, 54321)])
+    assert len(index) == 1
+    assert index.search("xmas", 54321, 0, 5) == [(oid, 0)]
+
+
+@pytest.mark.asyncio
+async def test_resync_rebuilds_a_live_index_right_away(monkeypatch):
+    index = SimilarityIndex()
+    rebuilds = []
+
+    async def rebuild():
+        rebuilds.append(index.live)
+        index.ready = True
+
+    monkeypatch.setattr(index, "rebuild", rebuild)
+    index.start()
+    try:
+        await asyncio.sleep(0.05)
+        index.live = True
+        await asyncio.sleep(0.05)
+        # Live: the change stream keeps it current, so no periodic reloads
+        assert rebuilds == [False]
+        index.resync()
+        await asyncio.wait_for(_until(lambda: len(rebuilds) == 2), 5)
+        assert rebuilds == [False, True]
+    finally:
+        await index.stop()
+
+
+async def _until(predicate):
+    while not predicate():
+        await asyncio.sleep(0.01)
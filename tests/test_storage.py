@@ -0,0 +1,130 @@
+import os
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.routers.media import _parse_range
+from app.services.storage import LocalStorage, delete_unreferenced
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes = 10 - 20", (10, 20)),
+    # Multiple or malformed ranges fall back to the whole file
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+    ("bytes=a-b", None),
+])
+def test_parse_range(header, expected):
+    assert _parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=500-100", "bytes=-0", "bytes=-"])
+def test_unsatisfiable_range(header):
+    with pytest.raises(HTTPException) as error:
+        _parse_range(header, 1000)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */1000"
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorage(str(tmp_path / "media"), "http://localhost:8000/")
+
+
+def _upload(tmp_path, content: bytes, name: str = "photo.jpeg") -> str:
+    source = tmp_path / name
+    source.write_bytes(content)
+    return str(source)
+
+
+def _age(storage: LocalStorage, key: str, seconds: float):
+    old = time.time() - seconds
+    os.utime(storage.path(key), (old, old))
+
+
+def test_identical_uploads_share_one_file(storage, tmp_path):
+    key = storage._store(_upload(tmp_path, b"image"))
+    assert key == storage._store(_upload(tmp_path, b"image", "copy.jpg"))
+    assert key.endswith(".jpg")
+    assert storage.path(key).read_bytes() == b"image"
+    assert storage.url(key) == f"http://localhost:8000/media/{key}"
+
+
+def test_keys_outside_the_layout_are_rejected(storage):
+    assert storage.path("../../etc/passwd") is None
+    assert storage.path("ab/cd/" + "0" * 64 + ".jpg") is None
+
+
+def test_reusing_a_file_refreshes_its_age(storage, tmp_path):
+    key = storage._store(_upload(tmp_path, b"image"))
+    _age(storage, key, 3600)
+    storage._store(_upload(tmp_path, b"image"))
+    assert time.time() - os.stat(storage.path(key)).st_mtime < 60
+
+
+def test_fresh_files_are_deleted_unless_still_referenced(storage, tmp_path):
+    key = storage._store(_upload(tmp_path, b"image"))
+    checked = []
+
+    def referenced(keys):
+        # Asked only once the file can't be reused any more
+        checked.append(storage.existing(keys))
+        return {key}
+
+    assert storage.delete([key], referenced) == {key}
+    assert checked == [set()]
+    assert storage.existing([key]) == {key}
+
+    assert storage.delete([key], lambda keys: set()) == {key}
+    assert storage.existing([key]) == set()
+    # Nothing is left behind, and deleting again is harmless
+    assert not any(name.startswith(".del-") for _, _, files in os.walk(storage.root) for name in files)
+    assert storage.delete([key]) == {key}
+
+
+def test_failed_reference_check_puts_the_files_back(storage, tmp_path):
+    key = storage._store(_upload(tmp_path, b"image"))
+
+    def referenced(keys):
+        raise RuntimeError("database unavailable")
+
+    with pytest.raises(RuntimeError):
+        storage.delete([key], referenced)
+    assert storage.existing([key]) == {key}
+
+
+def test_recover_puts_back_files_left_by_a_crashed_delete(storage, tmp_path):
+    key = storage._store(_upload(tmp_path, b"image"))
+    path = storage.path(key)
+    os.rename(path, path.with_name(".del-" + path.name))
+    assert storage.existing([key]) == set()
+
+    assert storage.recover(min_age=3600) == 0
+    assert storage.recover(min_age=0) == 1
+    assert storage.existing([key]) == {key}
+    assert [obj["key"] for page in storage.iter_objects() for obj in page] == [key]
+
+
+def test_upload_after_delete_writes_the_file_again(storage, tmp_path):
+    key = storage._store(_upload(tmp_path, b"image"))
+    storage.delete([key])
+    assert storage._store(_upload(tmp_path, b"image")) == key
+    assert storage.path(key).read_bytes() == b"image"
+
+
+@pytest.mark.asyncio
+async def test_delete_unreferenced_checks_image_documents(mongo_db, storage, tmp_path):
+    key = storage._store(_upload(tmp_path, b"image"))
+    await mongo_db.images.insert_one({"cloudinary_id": key, "storage": "local"})
+    assert await delete_unreferenced(storage, [key]) == {key}
+    assert storage.existing([key]) == {key}
+
+    await mongo_db.images.delete_many({})
+    assert await delete_unreferenced(storage, [key]) == {key}
+    assert storage.existing([key]) == set()
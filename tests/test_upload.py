@@ -0,0 +1,16 @@
+import httpx
+import pytest
+
+from bot.handlers.upload import _is_duplicate
+
+
+@pytest.mark.parametrize("response, expected", [
+    (httpx.Response(409, json={"detail": {"reason": "duplicate", "message": "m", "duplicates": []}}), True),
+    # Another request with the same Idempotency-Key is still running: not something to upload anyway
+    (httpx.Response(409, json={"detail": "A request with this Idempotency-Key is still in progress"}), False),
+    (httpx.Response(409, text="Conflict"), False),
+    (httpx.Response(200, json={"detail": {"reason": "duplicate"}}), False),
+    (None, False),
+])
+def test_is_duplicate(response, expected):
+    assert _is_duplicate(response) is expected
@@ -0,0 +1,69 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+
+from app.database import database
+from app.services.views import ViewCounter
+from bot import views
+
+
+@pytest.fixture
+def reports(monkeypatch):
+    """Batches accepted by a fake backend that enforces the API's limits; set ``fail`` to refuse the next ones"""
+    sent = SimpleNamespace(batches=[], fail=0)
+
+    async def report_views(batch):
+        assert len(batch) <= views.MAX_VIEW_BATCH
+        assert all(1 <= event["count"] <= views.MAX_VIEW_COUNT for event in batch)
+        if sent.fail:
+            sent.fail -= 1
+            return False
+        sent.batches.append(batch)
+        return True
+
+    monkeypatch.setattr(views.api, "report_views", report_views)
+    views._pending.clear()
+    yield sent
+    views._pending.clear()
+
+
+@pytest.mark.asyncio
+async def test_flush_splits_a_large_buffer_into_accepted_batches(reports):
+    for i in range(views.MAX_VIEW_BATCH + 10):
+        views._pending[(f"image{i}", "easter", 2024)] = 2
+    views._pending[("popular", "easter", 2024)] = views.MAX_VIEW_COUNT * 2 + 1
+
+    await views.flush_views()
+    assert not views._pending
+    assert sum(event["count"] for batch in reports.batches for event in batch) == \
+        2 * (views.MAX_VIEW_BATCH + 10) + views.MAX_VIEW_COUNT * 2 + 1
+
+
+@pytest.mark.asyncio
+async def test_failed_report_keeps_the_counts(reports):
+    views._pending[("image", "easter", 2024)] = 3
+    reports.fail = 1
+    await views.flush_views()
+    assert views._pending[("image", "easter", 2024)] == 3
+    await views.flush_views()
+    assert reports.batches == [[{"image_id": "image", "category_id": "easter", "year": 2024, "count": 3}]]
+
+
+@pytest.mark.asyncio
+async def test_stop_waits_for_a_flush_in_progress(monkeypatch):
+    written = []
+
+    async def bulk_write(requests, ordered):
+        await asyncio.sleep(0.2)
+        written.extend(requests)
+
+    monkeypatch.setattr(database, "db", SimpleNamespace(image_views=SimpleNamespace(bulk_write=bulk_write)))
+    counter = ViewCounter(flush_interval=0.01, max_pending=10)
+    counter.record(str(ObjectId()), "easter", 2024)
+    counter.start()
+    await asyncio.sleep(0.1)
+    counter.record(str(ObjectId()), "easter", 2024)
+    await counter.stop()
+    assert len(written) == 2